@@ -0,0 +1,284 @@
+"""Admission control: concurrency limits, rate limits and load shedding.
+
+Every request is put in a class by method and path (priority writes, other
+writes, reads, PDFs) and admitted only if
+
+- the worker has a free slot; PRIORITY_RESERVED of WORKER_CAPACITY slots are
+  kept for priority writes (placing and delivering orders),
+- its class is below its concurrency limit,
+- the caller's role is below its concurrency limit (priority writes are exempt),
+- the caller (user, or client address when anonymous) has a token left in the
+  class's token bucket.
+
+Anything else is answered at once with 503 (no capacity) or 429 (rate
+limited) and a Retry-After header, instead of waiting in the threadpool queue
+until the client times out.
+
+Concurrency is counted per worker. Token buckets are per worker too, unless
+ADMISSION_SHARED_STATE names a SQLite file that all workers of a host share;
+that file is only touched from one helper thread, never the event loop.
+
+Anonymous callers are keyed by client address. Behind a proxy or NAT that is
+one address for everyone (every login would share write=5/20), so list the
+proxies in ADMISSION_TRUSTED_PROXIES: requests from them are keyed by the
+nearest X-Forwarded-For address that is not itself a trusted proxy.
+
+Limits are "name=value" lists, e.g. ADMISSION_CLASS_LIMITS="pdf=2,read=32";
+rates are "class=tokens_per_second/burst", e.g. ADMISSION_RATES="pdf=0.5/5".
+"""
+import asyncio
+import math
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from jose import JWTError
+from starlette.responses import JSONResponse
+
+from .auth import decode_access_token
+from . import metrics
+
+PRIORITY, WRITE, READ, PDF = "priority", "write", "read", "pdf"
+
+# First match wins; unmatched requests are READ for GET/HEAD and WRITE otherwise
+ROUTE_CLASSES = [
+    ("POST", re.compile(r"^/orders/?$"), PRIORITY),
+    ("POST", re.compile(r"^/salesman/deliver-order$"), PRIORITY),
+    ("GET", re.compile(r"/invoice$"), PDF),
+]
+# Probes, metrics, docs and the profiler are never shed
+EXEMPT_PATHS = {"/", "/health", "/ready", "/metrics", "/docs", "/redoc", "/openapi.json"}
+EXEMPT_PREFIXES = ("/debug/",)
+
+
+def _parse_limits(value: str) -> dict[str, int]:
+    return {name.strip(): int(limit) for name, limit in (item.split("=") for item in value.split(",") if item)}
+
+
+def _parse_rates(value: str) -> dict[str, tuple[float, float]]:
+    rates = {}
+    for item in value.split(","):
+        if item:
+            name, spec = item.split("=")
+            rate, burst = spec.split("/")
+            rates[name.strip()] = (float(rate), float(burst))
+    return rates
+
+
+ENABLED = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+# Requests one worker serves at once; anyio runs at most 40 sync endpoints in its threadpool
+WORKER_CAPACITY = int(os.getenv("ADMISSION_WORKER_CAPACITY", "40"))
+PRIORITY_RESERVED = int(os.getenv("ADMISSION_PRIORITY_RESERVED", "8"))
+CLASS_LIMITS = _parse_limits(os.getenv("ADMISSION_CLASS_LIMITS", "pdf=4,read=24,write=16"))
+ROLE_LIMITS = _parse_limits(os.getenv(
+    "ADMISSION_ROLE_LIMITS", "shopkeeper=16,salesman=16,warehouse_manager=16,manufacturer=16,anonymous=8"
+))
+RATES = _parse_rates(os.getenv("ADMISSION_RATES", "priority=10/20,write=5/20,read=20/60,pdf=0.5/5"))
+SHARED_STATE = os.getenv("ADMISSION_SHARED_STATE")
+TRUSTED_PROXIES = {p.strip() for p in os.getenv("ADMISSION_TRUSTED_PROXIES", "").split(",") if p.strip()}
+RETRY_AFTER_SECONDS = 1
+
+
+class TokenBuckets:
+    """In-memory token buckets keyed by (caller, class)."""
+
+    PURGE_EVERY = 10000
+
+    def __init__(self, rates: dict[str, tuple[float, float]]):
+        self.rates = rates
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._takes = 0
+
+    def take(self, key: str, cls: str) -> float:
+        """Take a token; returns 0 on success, else the seconds until one is available."""
+        rate, burst = self.rates[cls]
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        self._takes += 1
+        if self._takes % self.PURGE_EVERY == 0:
+            self._purge(now)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+        self._buckets[key] = (tokens - 1, now)
+        return 0
+
+    async def take_async(self, key: str, cls: str) -> float:
+        return self.take(key, cls)
+
+    def _purge(self, now: float):
+        # A bucket idle long enough to be full again is the same as no bucket
+        max_idle = max(burst / rate for rate, burst in self.rates.values())
+        for key in [k for k, (_, updated) in self._buckets.items() if now - updated > max_idle]:
+            del self._buckets[key]
+
+
+class SharedTokenBuckets(TokenBuckets):
+    """Token buckets in a SQLite file, so all workers of a host share one budget per caller."""
+
+    def __init__(self, rates: dict[str, tuple[float, float]], path: str):
+        super().__init__(rates)
+        self.path = path
+        self._conn = None
+        self._executor = None
+        self._fallback_logged = False
+
+    def _connection(self):
+        if self._conn is None:
+            # Opened lazily: gunicorn forks workers after importing the app
+            self._conn = sqlite3.connect(self.path, timeout=0.05, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)"
+            )
+        return self._conn
+
+    def take(self, key: str, cls: str) -> float:
+        rate, burst = self.rates[cls]
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = conn.execute("SELECT tokens, updated FROM token_buckets WHERE key = ?", (key,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                wait = 0 if tokens >= 1 else (1 - tokens) / rate
+                conn.execute(
+                    "INSERT OR REPLACE INTO token_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                    (key, tokens - 1 if wait == 0 else tokens, now),
+                )
+                conn.execute("COMMIT")
+                return wait
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            # A busy or broken store must not take the API down: fall back to this worker's buckets
+            if not self._fallback_logged:
+                self._fallback_logged = True
+                print(f"Shared rate limit store unavailable ({e}); using per-worker limits while it is")
+            return super().take(key, cls)
+
+    async def take_async(self, key: str, cls: str) -> float:
+        # One dedicated thread: the file lock waits stay off the event loop, the sqlite3
+        # connection stays in the thread that opened it, and a full threadpool cannot delay it
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="admission-buckets")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.take, key, cls)
+
+
+def classify(method: str, path: str) -> str:
+    for route_method, pattern, cls in ROUTE_CLASSES:
+        if method == route_method and pattern.search(path):
+            return cls
+    return READ if method in ("GET", "HEAD") else WRITE
+
+
+def client_address(scope) -> str:
+    client = scope.get("client")
+    address = client[0] if client else "unknown"
+    if address not in TRUSTED_PROXIES:
+        return address
+    forwarded = [
+        hop.strip() for name, value in scope.get("headers", []) if name == b"x-forwarded-for"
+        for hop in value.decode("latin-1").split(",")
+    ]
+    # Rightmost first: entries left of the first untrusted hop can be forged by the client
+    for hop in reversed(forwarded):
+        if hop and hop not in TRUSTED_PROXIES:
+            return hop
+    return address
+
+
+def _caller(scope) -> tuple[str, str]:
+    """(rate-limit key, role) from the bearer token, or the client address when anonymous."""
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            value = value.decode("latin-1")
+            if value.lower().startswith("bearer "):
+                try:
+                    payload = decode_access_token(value[7:])
+                except JWTError:
+                    break
+                return f"user:{payload.get('sub')}", payload.get("role") or "anonymous"
+    return f"ip:{client_address(scope)}", "anonymous"
+
+
+class AdmissionController:
+    def __init__(self, capacity: int = WORKER_CAPACITY, reserved: int = PRIORITY_RESERVED,
+                 class_limits: dict = CLASS_LIMITS, role_limits: dict = ROLE_LIMITS, buckets: TokenBuckets = None):
+        self.capacity = capacity
+        self.reserved = reserved
+        self.class_limits = class_limits
+        self.role_limits = role_limits
+        self.buckets = buckets
+        # Only touched from the event loop thread, so plain counters suffice
+        self.in_flight = 0
+        self.by_class: dict[str, int] = {}
+        self.by_role: dict[str, int] = {}
+
+    async def admit(self, cls: str, role: str, key: str):
+        """None if admitted, else (status code, retry after seconds, reason)."""
+        available = self.capacity - (0 if cls == PRIORITY else self.reserved)
+        if self.in_flight >= available:
+            return 503, RETRY_AFTER_SECONDS, "capacity"
+        limit = self.class_limits.get(cls)
+        if limit is not None and self.by_class.get(cls, 0) >= limit:
+            return 503, RETRY_AFTER_SECONDS, "class_limit"
+        limit = self.role_limits.get(role)
+        if cls != PRIORITY and limit is not None and self.by_role.get(role, 0) >= limit:
+            return 503, RETRY_AFTER_SECONDS, "role_limit"
+        # The slot is held while the token is taken, so requests arriving meanwhile see it in use
+        self.in_flight += 1
+        self.by_class[cls] = self.by_class.get(cls, 0) + 1
+        self.by_role[role] = self.by_role.get(role, 0) + 1
+        if self.buckets is not None and cls in self.buckets.rates:
+            wait = await self.buckets.take_async(f"{key}:{cls}", cls)
+            if wait > 0:
+                self.release(cls, role)
+                return 429, max(1, math.ceil(wait)), "rate_limit"
+        return None
+
+    def release(self, cls: str, role: str):
+        self.in_flight -= 1
+        self.by_class[cls] -= 1
+        self.by_role[role] -= 1
+
+
+controller = AdmissionController(
+    buckets=SharedTokenBuckets(RATES, SHARED_STATE) if SHARED_STATE else TokenBuckets(RATES)
+)
+
+
+class AdmissionMiddleware:
+    """Sheds requests over the limits above with an immediate 429/503."""
+
+    def __init__(self, app, controller: AdmissionController = controller):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if (not ENABLED or scope["type"] != "http" or scope["method"] == "OPTIONS"
+                or scope["path"] in EXEMPT_PATHS or scope["path"].startswith(EXEMPT_PREFIXES)):
+            await self.app(scope, receive, send)
+            return
+
+        cls = classify(scope["method"], scope["path"])
+        key, role = _caller(scope)
+        rejected = await self.controller.admit(cls, role, key)
+        if rejected:
+            status_code, retry_after, reason = rejected
+            scope.setdefault("state", {})["role"] = role
+            metrics.inc("http_requests_shed_total", {"class": cls, "role": role, "reason": reason})
+            detail = "Too many requests" if status_code == 429 else "Server is busy, try again shortly"
+            response = JSONResponse({"detail": detail}, status_code=status_code, headers={"Retry-After": str(retry_after)})
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(cls, role)
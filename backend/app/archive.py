@@ -0,0 +1,184 @@
+"""Archival of delivered, fully-paid orders.
+
+Delivered orders with nothing left to pay that are older than
+ARCHIVE_AFTER_DAYS move, with their payments, from orders/payments into
+archived_orders/archived_payments. Each batch of ARCHIVE_BATCH_SIZE orders is
+copied and deleted in its own short transaction, so locks are only held for
+one batch at a time. /orders/my-orders and the invoice endpoints read through
+to the archive, so clients do not notice the move.
+
+On MySQL archived_orders is partitioned by month of created_at (migration 4);
+every run adds the partitions for the coming months.
+
+Run from cron with:  python -m app.archive [--days N] [--batch-size N] [--dry-run]
+"""
+import argparse
+import os
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, func, insert, literal, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session, joinedload
+
+from .models import ArchivedOrder, ArchivedPayment, Order, Payment
+from . import versioning
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+# Pause between batches so replicas and concurrent writers keep up
+ARCHIVE_PAUSE_SECONDS = float(os.getenv("ARCHIVE_PAUSE_SECONDS", "0.05"))
+PARTITION_MONTHS_AHEAD = 3
+
+ORDER_COLUMNS = [
+    "id", "user_id", "product_name", "quantity", "total_amount_minor", "advance_payment_minor",
+    "remaining_payment_minor", "status",
+]
+PAYMENT_COLUMNS = ["id", "order_id", "amount_minor", "payment_type", "paid_at"]
+
+
+# Read-through
+
+def find_order(db: Session, order_id: int):
+    """The order with its payments, from the live table or the archive."""
+    order = db.query(Order).options(joinedload(Order.payments)).filter(Order.id == order_id).first()
+    if order is None:
+        order = db.query(ArchivedOrder).options(joinedload(ArchivedOrder.payments)).filter(
+            ArchivedOrder.id == order_id
+        ).first()
+    return order
+
+
+def orders_for_user(db: Session, user_id: int) -> list:
+    live = db.query(Order).options(joinedload(Order.payments)).filter(Order.user_id == user_id).all()
+    archived = db.query(ArchivedOrder).options(joinedload(ArchivedOrder.payments)).filter(
+        ArchivedOrder.user_id == user_id
+    ).all()
+    return sorted(archived + live, key=lambda order: order.id)
+
+
+# Archival
+
+def _eligible(cutoff: datetime):
+    return (Order.status == "delivered") & (Order.remaining_payment_minor == 0) & (Order.created_at < cutoff)
+
+
+def _next_batch(db: Session, cutoff: datetime, batch_size: int) -> list[int]:
+    query = select(Order.id).where(_eligible(cutoff)).order_by(Order.created_at, Order.id).limit(batch_size)
+    if db.bind.dialect.name == "mysql":
+        # Rows another archiver already holds are skipped instead of waited on
+        query = query.with_for_update(skip_locked=True)
+    return list(db.execute(query).scalars())
+
+
+def _move(db: Session, ids: list[int]):
+    now = datetime.utcnow()
+    order_columns = [getattr(Order, c) for c in ORDER_COLUMNS]
+    db.execute(insert(ArchivedOrder).from_select(
+        ORDER_COLUMNS + ["created_at", "archived_at"],
+        select(*order_columns, func.coalesce(Order.created_at, now), literal(now)).where(Order.id.in_(ids)),
+    ))
+    db.execute(insert(ArchivedPayment).from_select(
+        PAYMENT_COLUMNS,
+        select(*[getattr(Payment, c) for c in PAYMENT_COLUMNS]).where(Payment.order_id.in_(ids)),
+    ))
+    db.execute(delete(Payment).where(Payment.order_id.in_(ids)))
+    db.execute(delete(Order).where(Order.id.in_(ids)))
+
+
+def archive_orders(session_factory, days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE,
+                   pause: float = ARCHIVE_PAUSE_SECONDS, dry_run: bool = False) -> int:
+    """Move eligible orders in batches and return how many were moved (or would be, with dry_run)."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    moved = 0
+    with session_factory() as db:
+        if dry_run:
+            return db.query(func.count(Order.id)).filter(_eligible(cutoff)).scalar()
+        if db.bind.dialect.name == "mysql":
+            ensure_partitions(db.connection(), date.today())
+            db.commit()
+        while True:
+            ids = _next_batch(db, cutoff, batch_size)
+            if not ids:
+                break
+            _move(db, ids)
+            versioning.bump(db, versioning.ORDERS)
+            db.commit()
+            moved += len(ids)
+            if len(ids) < batch_size:
+                break
+            time.sleep(pause)
+    return moved
+
+
+# MySQL month partitions
+
+def _month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def _next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _partition(month: date) -> str:
+    return f"PARTITION p{month:%Y%m} VALUES LESS THAN ('{_next_month(month):%Y-%m-%d}')"
+
+
+def _months(first: date, last: date) -> list[date]:
+    months, month = [], _month_start(first)
+    while month <= last:
+        months.append(month)
+        month = _next_month(month)
+    return months
+
+
+def _partition_names(conn: Connection) -> list[str]:
+    return list(conn.execute(text(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'archived_orders' AND PARTITION_NAME IS NOT NULL"
+    )).scalars())
+
+
+def partition_archive(conn: Connection, first_month: date):
+    """Partition the (still empty) archive by month, from first_month to a few months ahead."""
+    if _partition_names(conn):
+        return
+    last = _month_start(date.today())
+    for _ in range(PARTITION_MONTHS_AHEAD):
+        last = _next_month(last)
+    partitions = [_partition(m) for m in _months(first_month, last)]
+    conn.execute(text(
+        f"ALTER TABLE archived_orders PARTITION BY RANGE COLUMNS(created_at) "
+        f"({', '.join(partitions)}, PARTITION pmax VALUES LESS THAN (MAXVALUE))"
+    ))
+
+
+def ensure_partitions(conn: Connection, today: date):
+    """Split empty month partitions off pmax so the coming months are never written to pmax."""
+    names = sorted(name for name in _partition_names(conn) if name != "pmax")
+    if not names:
+        return
+    last = _month_start(today)
+    for _ in range(PARTITION_MONTHS_AHEAD):
+        last = _next_month(last)
+    newest = datetime.strptime(names[-1][1:], "%Y%m").date()
+    new = [_partition(m) for m in _months(_next_month(newest), last)]
+    if new:
+        conn.execute(text(
+            f"ALTER TABLE archived_orders REORGANIZE PARTITION pmax INTO "
+            f"({', '.join(new)}, PARTITION pmax VALUES LESS THAN (MAXVALUE))"
+        ))
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Move old delivered, fully-paid orders to the archive tables.")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="minimum order age in days")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="only count the orders that would move")
+    args = parser.parse_args()
+
+    count = archive_orders(SessionLocal, args.days, args.batch_size, dry_run=args.dry_run)
+    print(f"{count} orders {'eligible' if args.dry_run else 'archived'}")
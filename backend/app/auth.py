@@ -1,35 +1,83 @@
 from datetime import datetime, timedelta
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+from collections import OrderedDict
+import hashlib
+import os
+import secrets
+import threading
+import time
+from jose import JWTError  # jose's package root only loads its exceptions
 from fastapi import HTTPException, status
 
 #config
-SECRET_KEY = "secret123"
+SECRET_KEY = os.getenv("SECRET_KEY", "secret123")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 1 day
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "14"))
+TOKEN_CACHE_MAX_ENTRIES = 10000
 
-#password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+#password hashing (passlib/bcrypt are only loaded by the first register or login)
+_pwd_context = None
+
+def get_pwd_context():
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
 
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
-# JWT functions 
+# JWT functions
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
+    from jose import jwt
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "type": "access"})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# Refresh tokens are random strings; only their sha256 is stored
+
+def create_refresh_token() -> str:
+    return secrets.token_urlsafe(48)
+
+def hash_refresh_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+# Decoded access tokens, keyed by token digest, so each token is verified once per worker
+_token_cache: OrderedDict[str, dict] = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+def decode_access_token(token: str) -> dict:
+    """Verify an access token and return its claims. Raises JWTError."""
+    digest = hashlib.sha256(token.encode()).digest()
+    payload = _token_cache.get(digest)
+    if payload is not None:
+        if payload["exp"] > time.time():
+            return payload
+        with _token_cache_lock:
+            _token_cache.pop(digest, None)
+        raise JWTError("Signature has expired.")
+
+    from jose import jwt
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    if payload.get("type", "access") != "access" or "exp" not in payload:
+        raise JWTError("Not an access token")
+    with _token_cache_lock:
+        _token_cache[digest] = payload
+        while len(_token_cache) > TOKEN_CACHE_MAX_ENTRIES:
+            _token_cache.popitem(last=False)
+    return payload
+
 # For protecting routes
 async def get_current_user(token: str):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(token)
         username: str = payload.get("sub")
         role: str = payload.get("role")
         if username is None:
@@ -44,4 +92,4 @@ async def get_current_user(token: str):
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
-        )
\ No newline at end of file
+        )
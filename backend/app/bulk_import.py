@@ -0,0 +1,389 @@
+"""Bulk import of legacy users, orders, payments and stock.
+
+Streams a CSV or NDJSON file, validates every row against the *Import
+schemas, and writes chunks of --chunk-size rows with one multi-row INSERT
+(executemany) per table. On MySQL the chunks are loaded with LOAD DATA LOCAL
+INFILE instead, which needs local_infile enabled on the server. Each chunk
+is one transaction that also advances the job's row in import_checkpoints,
+so --resume continues after the last committed line without loading any
+line twice.
+
+Invalid rows, and rows the database refuses (unknown user, duplicate id),
+are appended to <file>.rejects.ndjson with the reason once their chunk has
+committed, so a resumed import does not write them again; the import goes on.
+
+    python -m app.bulk_import users users.csv
+    python -m app.bulk_import orders orders.ndjson --chunk-size 10000 --resume
+
+Users: give hashed_password (the legacy bcrypt hash) rather than password;
+hashing plaintext passwords costs bcrypt time per row. Orders reference
+their user by user_id or username and may carry nested "payments" (NDJSON).
+Orders without an id get ids after the current maximum, archived orders
+included, so keep the legacy ids when payments are imported separately. Restart the workers after an
+import: their forecast history only re-reads the last FORECAST_RESCAN_DAYS
+days of orders.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import create_engine, func, insert, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session, sessionmaker
+
+from .auth import hash_password
+from .models import ArchivedOrder, ImportCheckpoint, Order, Payment, ProductStock, User
+from .money import to_minor
+from .schemas import OrderImport, PaymentImport, StockImport, UserImport
+from . import inventory, ledger, versioning
+
+CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+
+
+class LoadDataMismatch(Exception):
+    pass
+
+
+@dataclass
+class Stats:
+    line: int = 0
+    rows: int = 0
+    rejected: int = 0
+
+
+# Input
+
+def read_rows(path: str, fmt: str):
+    """Yield (line number, dict) pairs; CSV empty cells become None."""
+    f = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+    try:
+        if fmt == "csv":
+            # Line 1 is the header
+            for number, row in enumerate(csv.DictReader(f), start=2):
+                yield number, {k: (v if v != "" else None) for k, v in row.items()}
+        else:
+            for number, line in enumerate(f, start=1):
+                if line.strip():
+                    try:
+                        yield number, json.loads(line)
+                    except ValueError as e:
+                        yield number, e
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+# Writers: turn validated rows into table rows and insert them
+
+def _insert(db: Session, table, rows: list[dict], load_data: bool):
+    # executemany needs one key set per statement
+    groups: dict[tuple, list[dict]] = {}
+    for row in rows:
+        groups.setdefault(tuple(row), []).append(row)
+    for columns, group in groups.items():
+        if load_data:
+            _load_data(db, table.name, columns, group)
+        else:
+            db.execute(insert(table), group)
+
+
+def _tsv_value(value) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+def _load_data(db: Session, table: str, columns: tuple, rows: list[dict]):
+    with tempfile.NamedTemporaryFile("w", suffix=".tsv", delete=False, encoding="utf-8") as f:
+        for row in rows:
+            f.write("\t".join(_tsv_value(row[c]) for c in columns) + "\n")
+    try:
+        result = db.execute(text(
+            f"LOAD DATA LOCAL INFILE '{f.name}' INTO TABLE {table} CHARACTER SET utf8mb4 "
+            f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({', '.join(columns)})"
+        ))
+    finally:
+        os.remove(f.name)
+    if result.rowcount != len(rows):
+        # LOCAL loads turn duplicate keys and bad values into warnings; find the rows with plain INSERTs
+        raise LoadDataMismatch(f"{table}: loaded {result.rowcount} of {len(rows)} rows")
+
+
+def _drop_none_id(row: dict) -> dict:
+    if row.get("id") is None:
+        row.pop("id", None)
+    return row
+
+
+def write_users(db: Session, items: list[UserImport], load_data: bool) -> list[str]:
+    rows = [_drop_none_id({
+        "id": u.id,
+        "username": u.username,
+        "email": u.email,
+        "role": u.role,
+        "hashed_password": u.hashed_password or hash_password(u.password),
+        "warehouse_id": u.warehouse_id,
+    }) for u in items]
+    _insert(db, User.__table__, rows, load_data)
+    return [None] * len(items)
+
+
+_user_ids: dict[str, int] = {}
+
+
+def _resolve_users(db: Session, usernames: set[str]):
+    missing = [name for name in usernames if name not in _user_ids]
+    if missing:
+        _user_ids.update(db.execute(select(User.username, User.id).where(User.username.in_(missing))).all())
+
+
+def write_orders(db: Session, items: list[OrderImport], load_data: bool) -> list[str]:
+    _resolve_users(db, {o.username for o in items if o.user_id is None})
+    errors = [None if o.user_id is not None or o.username in _user_ids else f"unknown user {o.username}" for o in items]
+    accepted = [o for o, error in zip(items, errors) if error is None]
+
+    # Ids are assigned up front so nested payments can reference their order; archived ids stay taken
+    next_id = max(
+        db.execute(select(func.max(Order.id))).scalar() or 0,
+        db.execute(select(func.max(ArchivedOrder.id))).scalar() or 0,
+    ) + 1
+    orders, payments = [], []
+    for o in accepted:
+        order_id = o.id
+        if order_id is None:
+            order_id, next_id = next_id, next_id + 1
+        orders.append({
+            "id": order_id,
+            "user_id": o.user_id if o.user_id is not None else _user_ids[o.username],
+            "product_name": o.product_name,
+            "quantity": o.quantity,
+            "total_amount_minor": to_minor(o.total_amount),
+            "advance_payment_minor": to_minor(o.advance_payment),
+            "remaining_payment_minor": to_minor(o.remaining_payment),
+            "status": o.status,
+            "created_at": o.created_at or datetime.utcnow(),
+        })
+        payments.extend(_payment_row(p, order_id) for p in o.payments)
+    _insert(db, Order.__table__, orders, load_data)
+    if payments:
+        _insert(db, Payment.__table__, payments, load_data)
+    billed, paid = Counter(), Counter()
+    for row in orders:
+        billed[row["user_id"]] += row["total_amount_minor"]
+    user_by_order = {row["id"]: row["user_id"] for row in orders}
+    for row in payments:
+        if row["payment_type"] in ledger.CUSTOMER_PAYMENT_TYPES:
+            paid[user_by_order[row["order_id"]]] += row["amount_minor"]
+    _update_balances(db, billed, paid)
+    return errors
+
+
+def _payment_row(p: PaymentImport, order_id: int) -> dict:
+    return _drop_none_id({
+        "id": p.id,
+        "order_id": order_id,
+        "amount_minor": to_minor(p.amount),
+        "payment_type": p.payment_type,
+        "paid_at": p.paid_at or datetime.utcnow(),
+    })
+
+
+def write_payments(db: Session, items: list[PaymentImport], load_data: bool) -> list[str]:
+    errors = [None if p.order_id is not None else "order_id is required" for p in items]
+    rows = [_payment_row(p, p.order_id) for p, error in zip(items, errors) if error is None]
+    _insert(db, Payment.__table__, rows, load_data)
+    user_by_order = dict(db.execute(
+        select(Order.id, Order.user_id).where(Order.id.in_({row["order_id"] for row in rows}))
+    ).all())
+    paid = Counter()
+    for row in rows:
+        if row["payment_type"] in ledger.CUSTOMER_PAYMENT_TYPES and row["order_id"] in user_by_order:
+            paid[user_by_order[row["order_id"]]] += row["amount_minor"]
+    _update_balances(db, Counter(), paid)
+    return errors
+
+
+def _update_balances(db: Session, billed: Counter, paid: Counter):
+    # One increment per shopkeeper in the chunk, in the chunk's transaction
+    for user_id in billed.keys() | paid.keys():
+        ledger.add(db, user_id, billed_minor=billed[user_id], paid_minor=paid[user_id])
+
+
+def write_stock(db: Session, items: list[StockImport], load_data: bool) -> list[str]:
+    # One row per (warehouse, product): set the on-hand quantity
+    default_id = inventory.default_warehouse(db).id
+    existing = {(s.warehouse_id, s.product_name): s for s in db.query(ProductStock).filter(
+        ProductStock.product_name.in_({s.product_name for s in items})
+    )}
+    for item in items:
+        key = (item.warehouse_id or default_id, item.product_name)
+        stock = existing.get(key)
+        if stock is None:
+            stock = existing[key] = ProductStock(warehouse_id=key[0], product_name=item.product_name)
+            db.add(stock)
+        stock.quantity = item.quantity
+    db.flush()
+    return [None] * len(items)
+
+
+# kind -> (row schema, writer, collection versions bumped)
+KINDS = {
+    "users": (UserImport, write_users, ()),
+    "orders": (OrderImport, write_orders, (versioning.ORDERS,)),
+    "payments": (PaymentImport, write_payments, (versioning.ORDERS,)),
+    "stock": (StockImport, write_stock, (versioning.STOCK,)),
+}
+
+
+# Runner
+
+def _checkpoint(db: Session, job: str) -> ImportCheckpoint:
+    checkpoint = db.get(ImportCheckpoint, job)
+    if checkpoint is None:
+        checkpoint = ImportCheckpoint(job=job, line=0, rows=0, rejected=0)
+        db.add(checkpoint)
+        db.flush()
+    return checkpoint
+
+
+class Importer:
+    def __init__(self, kind: str, session_factory, chunk_size: int = CHUNK_SIZE, load_data: bool = False,
+                 rejects_path: str | None = None):
+        self.kind = kind
+        self.schema, self.writer, self.collections = KINDS[kind]
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size
+        self.load_data = load_data
+        self.rejects_path = rejects_path
+        self.stats = Stats()
+        # Rejects of lines not committed yet; written out by _commit
+        self._rejects: list[str] = []
+
+    def reject(self, line: int, row, reason: str):
+        self.stats.rejected += 1
+        if self.rejects_path:
+            self._rejects.append(json.dumps({"line": line, "row": row, "error": reason}, default=str) + "\n")
+
+    def _flush_rejects(self):
+        if self._rejects:
+            with open(self.rejects_path, "a", encoding="utf-8") as f:
+                f.writelines(self._rejects)
+            self._rejects = []
+
+    def _write(self, db: Session, chunk: list[tuple[int, dict, BaseModel]], load_data: bool = None):
+        load_data = self.load_data if load_data is None else load_data
+        try:
+            with db.begin_nested():
+                errors = self.writer(db, [item for _, _, item in chunk], load_data)
+        except (DBAPIError, LoadDataMismatch) as e:
+            if len(chunk) == 1 and not load_data:
+                line, row, _ = chunk[0]
+                self.reject(line, row, str(getattr(e, "orig", e)))
+                return
+            # Find the offending rows one at a time; the others are still written
+            for single in chunk:
+                self._write(db, [single], load_data=False)
+            return
+        for (line, row, _), error in zip(chunk, errors):
+            if error:
+                self.reject(line, row, error)
+            else:
+                self.stats.rows += 1
+
+    def _commit(self, db: Session, job: str, chunk: list, last_line: int):
+        if chunk:
+            self._write(db, chunk)
+        checkpoint = _checkpoint(db, job)
+        checkpoint.line, checkpoint.rows, checkpoint.rejected = last_line, self.stats.rows, self.stats.rejected
+        if self.collections:
+            versioning.bump(db, *self.collections)
+        db.commit()
+        # After the checkpoint: a resume starts past these lines and never rejects them twice
+        self._flush_rejects()
+        self.stats.line = last_line
+
+    def run(self, rows, job: str, resume: bool = False) -> Stats:
+        started = time.perf_counter()
+        with self.session_factory() as db:
+            start_line = 0
+            if resume:
+                checkpoint = _checkpoint(db, job)
+                start_line = checkpoint.line
+                self.stats = Stats(checkpoint.line, checkpoint.rows, checkpoint.rejected)
+                if start_line:
+                    print(f"Resuming {job} after line {start_line}")
+            rows_at_start = self.stats.rows
+
+            chunk, last_line = [], start_line
+            for line, row in rows:
+                if line <= start_line:
+                    continue
+                last_line = line
+                if isinstance(row, Exception):
+                    self.reject(line, None, f"invalid JSON: {row}")
+                    continue
+                try:
+                    chunk.append((line, row, self.schema.model_validate(row)))
+                except ValidationError as e:
+                    self.reject(line, row, "; ".join(
+                        f"{'.'.join(map(str, err['loc'])) or 'row'}: {err['msg']}" for err in e.errors()
+                    ))
+                    continue
+                if len(chunk) >= self.chunk_size:
+                    self._commit(db, job, chunk, last_line)
+                    chunk = []
+                    self.report(started, rows_at_start)
+            self._commit(db, job, chunk, last_line)
+            self.report(started, rows_at_start)
+        return self.stats
+
+    def report(self, started: float, rows_at_start: int):
+        elapsed = time.perf_counter() - started
+        rate = (self.stats.rows - rows_at_start) / elapsed if elapsed else 0
+        print(f"{self.kind}: {self.stats.rows:,} rows imported, {self.stats.rejected:,} rejected, "
+              f"line {self.stats.line:,}, {rate:,.0f} rows/s")
+
+
+def _session_factory(load_data: bool):
+    from .database import DATABASE_URL, SessionLocal
+
+    if not load_data:
+        return SessionLocal
+    # LOAD DATA LOCAL needs the client-side switch as well as the server's local_infile
+    engine = create_engine(DATABASE_URL, pool_pre_ping=True, connect_args={"local_infile": True})
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    parser = argparse.ArgumentParser(description="Bulk import legacy data from CSV or NDJSON.")
+    parser.add_argument("kind", choices=sorted(KINDS))
+    parser.add_argument("path", help="input file, or - for stdin")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="defaults to the file extension")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--job", help="checkpoint name (default: kind and absolute path)")
+    parser.add_argument("--resume", action="store_true", help="continue after the last committed line")
+    parser.add_argument("--load-data", action=argparse.BooleanOptionalAction, default=None,
+                        help="use LOAD DATA LOCAL INFILE (default on MySQL)")
+    args = parser.parse_args()
+
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    load_data = args.load_data if args.load_data is not None else engine.dialect.name == "mysql"
+    job = args.job or f"{args.kind}:{os.path.abspath(args.path)}"
+    rejects = None if args.path == "-" else f"{args.path}.rejects.ndjson"
+
+    importer = Importer(args.kind, _session_factory(load_data), args.chunk_size, load_data, rejects)
+    stats = importer.run(read_rows(args.path, fmt), job, resume=args.resume)
+    if stats.rejected and rejects:
+        print(f"Rejected rows written to {rejects}")
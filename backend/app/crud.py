@@ -1,5 +1,5 @@
 from sqlalchemy.orm import Session
-from .models import User
+from .models import AccountBalance, User
 from .schemas import UserCreate
 from .auth import hash_password
 
@@ -9,9 +9,14 @@ def create_user(db: Session, user: UserCreate):
         username=user.username,
         hashed_password=hashed,
         role=user.role, 
-        email=user.email
+        email=user.email,
+        warehouse_id=user.warehouse_id
     )
     db.add(db_user)
+    if user.role == "shopkeeper":
+        # Created up front so the first orders only ever update it
+        db.flush()
+        db.add(AccountBalance(user_id=db_user.id, billed_minor=0, paid_minor=0))
     db.commit()
     db.refresh(db_user)
     return db_user
@@ -1,7 +1,10 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from fastapi import HTTPException, Request
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,16 +13,151 @@ MYSQL_HOST = os.getenv("MYSQL_HOST", "db")
 MYSQL_USER = os.getenv("MYSQL_USER", "root")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "password123")
 MYSQL_DB =  os.getenv("MYSQL_DB" , "distributor_db")
+MYSQL_REPLICA_HOST = os.getenv("MYSQL_REPLICA_HOST")
 
-DATABASE_URL = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}/{MYSQL_DB}"
+# DATABASE_URL / REPLICA_DATABASE_URL override the MySQL settings (e.g. sqlite:///primary.db)
+DATABASE_URL = os.getenv("DATABASE_URL") or f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}/{MYSQL_DB}"
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL")
+if not REPLICA_DATABASE_URL and MYSQL_REPLICA_HOST:
+    REPLICA_DATABASE_URL = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_REPLICA_HOST}/{MYSQL_DB}"
 
-engine = create_engine(DATABASE_URL)
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_CHECK_INTERVAL_SECONDS = float(os.getenv("REPLICA_CHECK_INTERVAL_SECONDS", "5"))
+# After a user's own write, their reads stay on the primary for this long
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "10"))
+PRIMARY_UNTIL_COOKIE = "primary_until"
+PRIMARY_UNTIL_HEADER = "x-primary-until"
+
+
+def _create_engine(url):
+    if url.startswith("sqlite"):
+        return create_engine(url, connect_args={"check_same_thread": False})
+    return create_engine(url, pool_pre_ping=True)
+
+
+engine = _create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit = False , autoflush=False , bind = engine)
 Base = declarative_base()
 
+replica_engine = _create_engine(REPLICA_DATABASE_URL) if REPLICA_DATABASE_URL else None
+ReadSessionLocal = (
+    sessionmaker(autocommit=False, autoflush=False, bind=replica_engine) if replica_engine else SessionLocal
+)
+
+
+class ReplicaHealth:
+    """Cached replica status, re-checked at most every REPLICA_CHECK_INTERVAL_SECONDS."""
+
+    def __init__(self):
+        self.healthy = True
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def is_healthy(self) -> bool:
+        if time.monotonic() - self.checked_at < REPLICA_CHECK_INTERVAL_SECONDS:
+            return self.healthy
+        # One thread re-checks; the others keep using the last known state
+        if not self._lock.acquire(blocking=False):
+            return self.healthy
+        try:
+            self.healthy = self._check()
+            self.checked_at = time.monotonic()
+        finally:
+            self._lock.release()
+        return self.healthy
+
+    def mark_down(self):
+        self.healthy = False
+        self.checked_at = time.monotonic()
+
+    def _check(self) -> bool:
+        try:
+            with replica_engine.connect() as conn:
+                if replica_engine.dialect.name != "mysql":
+                    conn.execute(text("SELECT 1"))
+                    return True
+                row = conn.execute(text("SHOW REPLICA STATUS")).mappings().first()
+        except Exception:
+            return False
+        if row is None:
+            # Not configured as a replica (e.g. a standalone stand-in)
+            return True
+        lag = row.get("Seconds_Behind_Source")
+        return lag is not None and lag <= REPLICA_MAX_LAG_SECONDS
+
+
+replica_health = ReplicaHealth()
+
+if replica_engine is not None:
+    @event.listens_for(replica_engine, "handle_error")
+    def _replica_error(context):
+        # Stop routing reads to a replica that dropped connections until the next check
+        if context.is_disconnect:
+            replica_health.mark_down()
+
+
+def _wants_primary(request: Request) -> bool:
+    value = request.headers.get(PRIMARY_UNTIL_HEADER) or request.cookies.get(PRIMARY_UNTIL_COOKIE)
+    if not value:
+        return False
+    try:
+        return float(value) > time.time()
+    except ValueError:
+        return False
+
+
+# Set once migrations have run; until then DB-backed endpoints answer 503
+db_ready = threading.Event()
+
+
+def _ensure_ready():
+    if not db_ready.is_set():
+        raise HTTPException(status_code=503, detail="Database is not ready yet", headers={"Retry-After": "3"})
+
+
 def get_db():
+    _ensure_ready()
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def get_read_db(request: Request):
+    # Replica session for read-only endpoints, falling back to the primary
+    _ensure_ready()
+    if replica_engine is None or _wants_primary(request) or not replica_health.is_healthy():
+        db = SessionLocal()
+    else:
+        db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+class ReadYourWritesMiddleware:
+    """Marks the client for primary reads for a short window after a successful write."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS") or replica_engine is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def sticky_send(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                until = f"{time.time() + READ_YOUR_WRITES_SECONDS:.3f}"
+                message["headers"] = list(message.get("headers", [])) + [
+                    (PRIMARY_UNTIL_HEADER.encode(), until.encode()),
+                    (b"set-cookie", (
+                        f"{PRIMARY_UNTIL_COOKIE}={until}; Max-Age={int(READ_YOUR_WRITES_SECONDS) + 1}; "
+                        "Path=/; SameSite=Lax"
+                    ).encode()),
+                ]
+            await send(message)
+
+        await self.app(scope, receive, sticky_send)
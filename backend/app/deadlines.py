@@ -0,0 +1,289 @@
+"""Request deadlines, propagated to the database.
+
+Every request gets a deadline when it arrives: the ROUTE_DEADLINES entry for
+its path, else DEADLINE_SECONDS for its admission class. Clients may ask for
+a different one with an X-Request-Timeout header (seconds, at most
+DEADLINE_MAX_SECONDS). The deadline lives in a context variable, which the
+threadpool copies into sync endpoints, and bounds every statement run for the
+request:
+
+- no statement starts once the deadline has passed or the client is gone,
+- MySQL SELECTs carry a MAX_EXECUTION_TIME hint with the time left, and a
+  statement still running when the deadline passes or the client
+  disconnects is stopped with KILL QUERY from a separate connection,
+- SQLite statements are interrupted by a progress handler.
+
+Once the request's session commits, the deadline is disarmed: statements run
+after COMMIT (refreshes, collection version bumps) are not interrupted, so a
+request whose writes are committed is never reported as failed.
+
+Otherwise the request fails with DeadlineExceeded: 504 when out of time, 499 when
+the client disconnected. Both are counted in http_request_timeouts_total.
+
+Limits are "name=value" lists, e.g. DEADLINE_SECONDS="read=3,pdf=20" and
+DEADLINE_ROUTES="GET /forecast/=30" (method and path prefix; first match wins).
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+from starlette.responses import JSONResponse
+
+from . import admission, metrics
+
+
+def _parse_routes(value: str) -> list[tuple[str, str, float]]:
+    routes = []
+    for item in value.split(","):
+        if item:
+            route, seconds = item.rsplit("=", 1)
+            method, prefix = route.split()
+            routes.append((method.upper(), prefix, float(seconds)))
+    return routes
+
+
+ENABLED = os.getenv("DEADLINES", "true").lower() in ("1", "true", "yes")
+DEADLINE_SECONDS = {
+    name.strip(): float(seconds) for name, seconds in (
+        item.split("=") for item in os.getenv("DEADLINE_SECONDS", "priority=10,write=10,read=5,pdf=30").split(",")
+        if item
+    )
+}
+ROUTE_DEADLINES = _parse_routes(os.getenv(
+    "DEADLINE_ROUTES", "GET /forecast/=30,POST /forecast/=60,GET /accounts/=15"
+))
+DEFAULT_DEADLINE_SECONDS = 10.0
+DEADLINE_MAX_SECONDS = float(os.getenv("DEADLINE_MAX_SECONDS", "60"))
+TIMEOUT_HEADER = b"x-request-timeout"
+# SQLite VM instructions between deadline checks
+SQLITE_PROGRESS_STEPS = 10000
+
+_current: contextvars.ContextVar["Deadline | None"] = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason  # "deadline" or "disconnect"
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.cancelled: str | None = None
+        # Set, under lock, when the request's transaction commits
+        self.committed = False
+        # (engine, MySQL connection id) while a statement runs for this request. Set and cleared
+        # under lock, which _kill holds while it sends KILL QUERY: the statement cannot finish
+        # and hand its connection back to the pool in between
+        self.running = None
+        self.lock = threading.Lock()
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def reason(self) -> str | None:
+        """Why the request must stop, or None while it may go on."""
+        if self.committed:
+            return None
+        if self.cancelled:
+            return self.cancelled
+        if self.remaining() <= 0:
+            return "deadline"
+        return None
+
+    def check(self):
+        reason = self.reason()
+        if reason:
+            raise DeadlineExceeded(reason)
+
+
+def budget(method: str, path: str, headers) -> float:
+    seconds = None
+    for route_method, prefix, route_seconds in ROUTE_DEADLINES:
+        if method == route_method and path.startswith(prefix):
+            seconds = route_seconds
+            break
+    if seconds is None:
+        seconds = DEADLINE_SECONDS.get(admission.classify(method, path), DEFAULT_DEADLINE_SECONDS)
+    for name, value in headers:
+        if name == TIMEOUT_HEADER:
+            try:
+                requested = float(value)
+            except ValueError:
+                break
+            if requested > 0:
+                seconds = requested
+            break
+    return min(seconds, DEADLINE_MAX_SECONDS)
+
+
+# Database hooks
+
+def _sqlite_progress() -> int:
+    # Runs in the thread executing the statement, so it sees that request's deadline
+    deadline = _current.get()
+    return 1 if deadline is not None and deadline.reason() else 0
+
+
+def install(engine):
+    """Bound every statement run on engine by the current request's deadline."""
+    mysql = engine.dialect.name == "mysql"
+
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def _connect(dbapi_connection, connection_record):
+            dbapi_connection.set_progress_handler(_sqlite_progress, SQLITE_PROGRESS_STEPS)
+
+    @event.listens_for(engine, "before_cursor_execute", retval=True)
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        deadline = _current.get()
+        if deadline is None:
+            return statement, parameters
+        deadline.check()
+        if mysql:
+            stripped = statement.lstrip()
+            if stripped[:6].upper() == "SELECT":
+                ms = max(1, int(deadline.remaining() * 1000))
+                statement = f"SELECT /*+ MAX_EXECUTION_TIME({ms}) */{stripped[6:]}"
+            with deadline.lock:
+                deadline.running = (engine, cursor.connection.thread_id())
+        return statement, parameters
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        deadline = _current.get()
+        if deadline is not None:
+            with deadline.lock:
+                deadline.running = None
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        deadline = _current.get()
+        if deadline is None:
+            return
+        with deadline.lock:
+            deadline.running = None
+        # Interrupted (SQLite), out of time (MySQL 3024) or killed (1317): report the cause, not the symptom
+        reason = deadline.reason()
+        if reason and not context.is_disconnect:
+            raise DeadlineExceeded(reason) from context.original_exception
+
+
+@event.listens_for(Session, "after_commit")
+def _disarm(session):
+    # Class-level, so it runs before per-session after_commit hooks such as versioning's bumps
+    deadline = _current.get()
+    if deadline is not None:
+        with deadline.lock:
+            deadline.committed = True
+
+
+_kill_engines = {}
+
+
+def _kill(deadline: Deadline):
+    # Held until KILL QUERY returns, so the connection is still this request's statement's
+    with deadline.lock:
+        running = deadline.running
+        if running is None or deadline.committed:
+            return
+        engine, connection_id = running
+        # Own unpooled connection: the pool may be exhausted by the very queries being killed
+        killer = _kill_engines.get(engine.url)
+        if killer is None:
+            killer = _kill_engines[engine.url] = create_engine(engine.url, poolclass=NullPool)
+        try:
+            with killer.connect() as conn:
+                conn.execute(text(f"KILL QUERY {int(connection_id)}"))
+        except Exception as e:
+            print(f"Could not stop query {connection_id}: {e}")
+
+
+# Responses
+
+def deadline_exceeded_handler(request, exc: DeadlineExceeded):
+    route = request.scope.get("route")
+    metrics.inc("http_request_timeouts_total", {
+        "method": request.method,
+        "route": getattr(route, "path", "unmatched"),
+        "reason": exc.reason,
+    })
+    if exc.reason == "disconnect":
+        # Nobody is listening; 499 keeps these apart from real timeouts in logs and metrics
+        return JSONResponse({"detail": "Client closed request"}, status_code=499)
+    return JSONResponse({"detail": "Request deadline exceeded"}, status_code=504)
+
+
+class DeadlineMiddleware:
+    """Starts each request's deadline and cancels it when time is up or the client disconnects."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (not ENABLED or scope["type"] != "http" or scope["method"] == "OPTIONS"
+                or scope["path"] in admission.EXEMPT_PATHS or scope["path"].startswith(admission.EXEMPT_PREFIXES)):
+            await self.app(scope, receive, send)
+            return
+
+        deadline = Deadline(budget(scope["method"], scope["path"], scope.get("headers", [])))
+        headers = dict(scope.get("headers", []))
+        body_read = asyncio.Event()
+        if b"transfer-encoding" not in headers and headers.get(b"content-length", b"0") == b"0":
+            body_read.set()
+        disconnected = asyncio.Event()
+        responded = False
+
+        async def watched_send(message):
+            nonlocal responded
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                responded = True
+            await send(message)
+
+        async def watched_receive():
+            if body_read.is_set():
+                # Past the body the watcher owns the channel; all that is left to come is the disconnect
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body", False):
+                body_read.set()
+            return message
+
+        async def watch():
+            async def client_gone():
+                await body_read.wait()
+                if not disconnected.is_set():
+                    while (await receive())["type"] != "http.disconnect":
+                        pass
+                    disconnected.set()
+
+            try:
+                await asyncio.wait_for(client_gone(), timeout=max(deadline.remaining(), 0))
+                if responded:
+                    # The server reports a finished response as a disconnect too
+                    return
+                deadline.cancelled = "disconnect"
+            except asyncio.TimeoutError:
+                deadline.cancelled = "deadline"
+            # Not the anyio threadpool: when it is full, this is what frees it
+            await asyncio.get_running_loop().run_in_executor(None, _kill, deadline)
+
+        token = _current.set(deadline)
+        watcher = asyncio.create_task(watch())
+        try:
+            await self.app(scope, watched_receive, watched_send)
+        finally:
+            watcher.cancel()
+            with deadline.lock:
+                deadline.running = None
+            _current.reset(token)
@@ -0,0 +1,119 @@
+import gzip
+import json
+import os
+from datetime import datetime, timezone
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.distributor.columnar+json"
+MSGPACK = "application/msgpack"
+
+MEDIA_TYPES = [JSON, COLUMNAR_JSON, MSGPACK]
+MEDIA_ALIASES = {"application/x-msgpack": MSGPACK}
+
+# Payloads smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+def _parse_accept(header: str | None) -> list[tuple[str, float]]:
+    items = []
+    for part in (header or "").split(","):
+        fields = [f.strip() for f in part.split(";")]
+        if not fields[0]:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        items.append((fields[0].lower(), q))
+    return items
+
+
+def negotiate_media_type(accept: str | None) -> str:
+    best, best_q = JSON, 0.0
+    for media_type, q in _parse_accept(accept):
+        media_type = MEDIA_ALIASES.get(media_type, media_type)
+        if media_type in MEDIA_TYPES and q > best_q:
+            best, best_q = media_type, q
+    return best
+
+
+def negotiate_encoding(accept_encoding: str | None) -> str | None:
+    offered = {coding: q for coding, q in _parse_accept(accept_encoding) if q > 0}
+    if brotli is not None and "br" in offered:
+        return "br"
+    if "gzip" in offered:
+        return "gzip"
+    return None
+
+
+def _rows(data, mode: str = "python") -> list[dict]:
+    # model_dump(mode="json") is much cheaper than jsonable_encoder for pydantic rows
+    return [row.model_dump(mode=mode) if isinstance(row, BaseModel) else jsonable_encoder(row) for row in data]
+
+
+def _msgpack_default(value):
+    import msgpack
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return msgpack.Timestamp.from_datetime(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def to_columns(rows: list[dict]) -> dict:
+    """Column-oriented layout: field names once, then one array of values per field."""
+    fields = list(rows[0].keys()) if rows else []
+    return {
+        "count": len(rows),
+        "fields": fields,
+        "columns": {field: [row.get(field) for row in rows] for field in fields},
+    }
+
+
+def serialize(data, media_type: str) -> bytes:
+    if media_type == MSGPACK:
+        import msgpack
+        return msgpack.packb(_rows(data), default=_msgpack_default, use_bin_type=True)
+    content = _rows(data, mode="json")
+    if media_type == COLUMNAR_JSON:
+        content = to_columns(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def compress(body: bytes, content_encoding: str | None) -> tuple[bytes, str | None]:
+    if content_encoding is None or len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    if content_encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+    return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+
+
+def encode(request: Request, data) -> tuple[bytes, dict]:
+    """Serialize a list payload in the format and encoding the client accepts."""
+    media_type = negotiate_media_type(request.headers.get("accept"))
+    body, content_encoding = compress(
+        serialize(data, media_type), negotiate_encoding(request.headers.get("accept-encoding"))
+    )
+    headers = {"Content-Type": media_type, "Vary": "Accept, Accept-Encoding"}
+    if content_encoding:
+        headers["Content-Encoding"] = content_encoding
+    return body, headers
+
+
+def render(request: Request, data) -> Response:
+    body, headers = encode(request, data)
+    return Response(content=body, headers=headers)
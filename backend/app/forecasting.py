@@ -0,0 +1,187 @@
+import math
+import os
+import threading
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .models import Order, Replenishment
+from . import inventory, jobs, versioning
+
+# Forecast config (overridable from the environment)
+WINDOW_DAYS = int(os.getenv("FORECAST_WINDOW_DAYS", "28"))        # days used for averages
+HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", "180"))     # daily buckets kept in memory
+RESCAN_DAYS = int(os.getenv("FORECAST_RESCAN_DAYS", "2"))         # recent days re-read on every refresh
+SMOOTHING_ALPHA = float(os.getenv("FORECAST_SMOOTHING_ALPHA", "0.3"))
+LEAD_TIME_DAYS = int(os.getenv("REORDER_LEAD_TIME_DAYS", "3"))    # manufacturer -> warehouse
+REVIEW_DAYS = int(os.getenv("REORDER_REVIEW_DAYS", "7"))          # cover to order beyond the lead time
+SERVICE_Z = float(os.getenv("REORDER_SERVICE_Z", "1.65"))         # ~95% service level
+AUTO_REPLENISH = os.getenv("AUTO_REPLENISH", "false").lower() in ("1", "true", "yes")
+
+
+def _as_date(value) -> date:
+    # func.date() returns a date on MySQL and an ISO string on SQLite
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+class DemandHistory:
+    """Per-product daily demand buckets, refreshed incrementally from recent orders.
+
+    The first refresh loads the whole window; later ones rebuild only the
+    last RESCAN_DAYS days from orders.created_at (through its index). Orders
+    are matched by creation time rather than by id, so an order that commits
+    after others with higher ids is still counted on the next refresh.
+    """
+
+    def __init__(self, history_days: int = HISTORY_DAYS, rescan_days: int = RESCAN_DAYS):
+        self.history_days = history_days
+        self.rescan_days = rescan_days
+        self.origin: date | None = None          # date of bucket 0
+        self.buckets: dict = {}                  # product -> numpy array of daily demand
+        self._lock = threading.Lock()
+
+    def refresh(self, db: Session):
+        import numpy as np  # loaded on first use, most workers never forecast
+        with self._lock:
+            today = datetime.utcnow().date()
+            first = self.origin is None
+            if first:
+                self.origin = today - timedelta(days=self.history_days - 1)
+            self._roll_to(today)
+            since = self.origin if first else max(self.origin, today - timedelta(days=self.rescan_days - 1))
+
+            rows = (
+                db.query(Order.product_name, func.date(Order.created_at), func.sum(Order.quantity))
+                .filter(Order.created_at >= datetime.combine(since, datetime.min.time()))
+                .group_by(Order.product_name, func.date(Order.created_at))
+                .all()
+            )
+
+            # The rescanned days are rebuilt from scratch rather than added to
+            first_offset = (since - self.origin).days
+            for series in self.buckets.values():
+                series[first_offset:] = 0
+            if not rows:
+                return
+
+            products = np.array([r[0] for r in rows])
+            offsets = np.array([(_as_date(r[1]) - self.origin).days for r in rows])
+            quantities = np.array([int(r[2]) for r in rows], dtype=np.float64)
+
+            in_range = (offsets >= first_offset) & (offsets < self.history_days)
+            for product in np.unique(products[in_range]):
+                mask = in_range & (products == product)
+                series = self.buckets.setdefault(str(product), np.zeros(self.history_days))
+                np.add.at(series, offsets[mask], quantities[mask])
+
+    def _roll_to(self, today: date):
+        # Shift every series left so the last bucket is always today
+        shift = (today - self.origin).days - (self.history_days - 1)
+        if shift <= 0:
+            return
+        for product, series in self.buckets.items():
+            if shift >= self.history_days:
+                series[:] = 0
+            else:
+                series[:-shift] = series[shift:]
+                series[-shift:] = 0
+        self.origin += timedelta(days=shift)
+
+    def forecast(self, window_days: int = WINDOW_DAYS, alpha: float = SMOOTHING_ALPHA) -> dict[str, dict]:
+        """Demand rates and reorder points for every product with history."""
+        import numpy as np
+        with self._lock:
+            if not self.buckets:
+                return {}
+            names = sorted(self.buckets)
+            window = min(window_days, self.history_days)
+            matrix = np.vstack([self.buckets[name][-window:] for name in names])
+
+        sma = matrix.mean(axis=1)
+        std = matrix.std(axis=1)
+        # Exponential smoothing as a weighted sum: newest day weighted alpha, older days decay
+        weights = (1 - alpha) ** np.arange(window - 1, -1, -1)
+        ewma = matrix @ weights / weights.sum()
+
+        lead = LEAD_TIME_DAYS
+        reorder_points = np.ceil(ewma * lead + SERVICE_Z * std * math.sqrt(lead))
+        active_days = (matrix > 0).sum(axis=1)
+
+        return {
+            name: {
+                "product_name": name,
+                "daily_demand_sma": round(float(sma[i]), 3),
+                "daily_demand_ewma": round(float(ewma[i]), 3),
+                "demand_std": round(float(std[i]), 3),
+                "reorder_point": int(reorder_points[i]),
+                "days_with_demand": int(active_days[i]),
+            }
+            for i, name in enumerate(names)
+        }
+
+
+history = DemandHistory()
+
+
+def get_forecasts(db: Session) -> dict[str, dict]:
+    history.refresh(db)
+    return history.forecast()
+
+
+def check_reorder_point(db: Session, product_name: str, forecasts: dict | None = None, warehouse_id: int | None = None):
+    """Queue a replenishment when stock has fallen to the reorder point.
+
+    Demand and stock are compared over all warehouses; the shipment goes to
+    warehouse_id (the default warehouse when None). The new row is added to
+    the caller's session and committed with the caller's transaction.
+    Returns the replenishment or None.
+    """
+    if forecasts is None:
+        forecasts = get_forecasts(db)
+    forecast = forecasts.get(product_name)
+    if not forecast or forecast["reorder_point"] <= 0:
+        return None
+
+    db.flush()  # the caller's pending stock changes count
+    on_hand = inventory.on_hand(db, product_name).get(product_name, 0)
+    if on_hand > forecast["reorder_point"]:
+        return None
+
+    open_request = (
+        db.query(Replenishment)
+        .filter(Replenishment.product_name == product_name, Replenishment.status == "requested")
+        .first()
+    )
+    if open_request:
+        return None
+
+    # Order up to the reorder point plus demand over one review period
+    target = forecast["reorder_point"] + math.ceil(forecast["daily_demand_ewma"] * REVIEW_DAYS)
+    replenishment = Replenishment(
+        product_name=product_name,
+        quantity=max(target - on_hand, 1),
+        reorder_point=forecast["reorder_point"],
+        warehouse_id=warehouse_id,
+    )
+    db.add(replenishment)
+    versioning.bump(db, versioning.REPLENISHMENTS)
+    return replenishment
+
+
+@jobs.handler("reorder_check", batch_size=50)
+def run_reorder_checks(db: Session, payloads: list[dict]):
+    """Reorder-point checks queued by dispatches: one forecast for the batch, one check per (product, warehouse).
+
+    Checks run in dispatch order; a product has at most one open replenishment,
+    so it goes to the first depot in the batch that finds the product at its
+    reorder point.
+    """
+    forecasts = get_forecasts(db)
+    checks = dict.fromkeys((payload["product_name"], payload.get("warehouse_id")) for payload in payloads)
+    for product_name, warehouse_id in checks:
+        check_reorder_point(db, product_name, forecasts, warehouse_id=warehouse_id)
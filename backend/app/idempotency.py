@@ -0,0 +1,313 @@
+import contextvars
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from jose import JWTError
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from .admission import client_address
+from .auth import decode_access_token
+from .database import SessionLocal, db_ready
+from .models import IdempotencyRecord
+
+HEADER = "idempotency-key"
+MAX_KEY_LENGTH = 255
+RECORD_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 60 * 60)))
+CACHE_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_CACHE_TTL_SECONDS", "600"))
+CACHE_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_CACHE_MAX_ENTRIES", "10000"))
+# A claim left behind by a crashed worker is taken over after this long
+CLAIM_TIMEOUT_SECONDS = 60
+PURGE_EVERY = 1000
+
+# Responses carrying credentials are never persisted
+EXEMPT_PATHS = {"/auth/login", "/auth/refresh"}
+# Recomputed or connection-specific, so not replayed
+UNSTORED_HEADERS = {b"content-length", b"transfer-encoding", b"connection", b"date", b"server"}
+# What Starlette answers for an unhandled exception; stored when the request had already committed
+UNHANDLED_ERROR = ([(b"content-type", b"text/plain; charset=utf-8")], b"Internal Server Error")
+
+# Transactions committed by the request being run under a key; the threadpool copies it into sync endpoints
+_commits: contextvars.ContextVar["list | None"] = contextvars.ContextVar("idempotency_commits", default=None)
+
+
+@event.listens_for(Session, "after_commit")
+def _count_commit(session):
+    commits = _commits.get()
+    if commits is not None:
+        commits.append(True)
+
+
+@dataclass
+class StoredResponse:
+    request_hash: str
+    status_code: int
+    headers: list[tuple[bytes, bytes]]
+    body: bytes
+
+
+class ResponseCache:
+    """In-memory front cache for stored responses with TTL eviction."""
+
+    def __init__(self, ttl: int = CACHE_TTL_SECONDS, max_entries: int = CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, StoredResponse]] = OrderedDict()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, response = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        return response
+
+    def put(self, key: str, response: StoredResponse):
+        now = time.monotonic()
+        self._entries[key] = (now + self.ttl, response)
+        self._entries.move_to_end(key)
+        # Entries are kept in insertion order, so expired ones sit at the front
+        while self._entries:
+            oldest_key, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at >= now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[oldest_key]
+
+
+cache = ResponseCache()
+_claims_since_purge = 0
+
+
+def _subject(scope, authorization: str | None) -> str | None:
+    """Scope of the caller's keys: the user, the client address when anonymous, None for a bad token."""
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return f"anonymous:{client_address(scope)}"
+    try:
+        payload = decode_access_token(authorization[7:])
+    except JWTError:
+        return None
+    return payload.get("sub")
+
+
+def _to_stored(record: IdempotencyRecord) -> StoredResponse:
+    if record.response_headers:
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(record.response_headers)]
+    else:
+        headers = [(b"content-type", record.content_type.encode())]
+    return StoredResponse(
+        request_hash=record.request_hash,
+        status_code=record.status_code,
+        headers=headers,
+        body=record.response_data or b"",
+    )
+
+
+def claim(key_hash: str, request_hash: str):
+    """Claim a key for execution.
+
+    Returns None when the caller now owns the key, a StoredResponse when the
+    request already completed, or "in_progress" when another request holds it.
+    """
+    global _claims_since_purge
+    db = SessionLocal()
+    try:
+        _claims_since_purge += 1
+        if _claims_since_purge >= PURGE_EVERY:
+            _claims_since_purge = 0
+            cutoff = datetime.utcnow() - timedelta(seconds=RECORD_TTL_SECONDS)
+            db.query(IdempotencyRecord).filter(IdempotencyRecord.created_at < cutoff).delete()
+            db.commit()
+
+        db.add(IdempotencyRecord(key_hash=key_hash, request_hash=request_hash))
+        try:
+            db.commit()
+            return None
+        except IntegrityError:
+            db.rollback()
+
+        record = db.query(IdempotencyRecord).filter(IdempotencyRecord.key_hash == key_hash).first()
+        if record is None:
+            return "in_progress"
+        age = (datetime.utcnow() - record.created_at).total_seconds()
+        if record.status_code is not None and age < RECORD_TTL_SECONDS:
+            return _to_stored(record)
+        if record.status_code is None and age < CLAIM_TIMEOUT_SECONDS:
+            return "in_progress"
+
+        # Expired response or abandoned claim: take it over
+        record.request_hash = request_hash
+        record.status_code = None
+        record.content_type = None
+        record.response_data = None
+        record.response_headers = None
+        record.created_at = datetime.utcnow()
+        db.commit()
+        return None
+    finally:
+        db.close()
+
+
+def store(key_hash: str, response: StoredResponse):
+    db = SessionLocal()
+    try:
+        db.query(IdempotencyRecord).filter(IdempotencyRecord.key_hash == key_hash).update({
+            "status_code": response.status_code,
+            "content_type": Headers(raw=response.headers).get("content-type"),
+            "response_data": response.body,
+            "response_headers": json.dumps(
+                [[name.decode("latin-1"), value.decode("latin-1")] for name, value in response.headers]
+            ),
+        })
+        db.commit()
+    finally:
+        db.close()
+
+
+def release(key_hash: str):
+    db = SessionLocal()
+    try:
+        db.query(IdempotencyRecord).filter(
+            IdempotencyRecord.key_hash == key_hash,
+            IdempotencyRecord.status_code.is_(None),
+        ).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+class IdempotencyMiddleware:
+    """Replays the stored response for a POST retried with the same Idempotency-Key.
+
+    The first request with a key runs normally and its response is stored;
+    retries are answered from the front cache or the idempotency table without
+    running the endpoint again. 5xx and 499 responses are not stored so they can
+    be retried, unless the request committed a transaction first: its retry
+    would then apply the writes a second time, so the failure is final.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http" or scope["method"] != "POST"
+            or scope["path"] in EXEMPT_PATHS or not db_ready.is_set()
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        key = headers.get(HEADER)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > MAX_KEY_LENGTH:
+            await JSONResponse({"detail": "Invalid Idempotency-Key header"}, status_code=400)(scope, receive, send)
+            return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        subject = _subject(scope, headers.get("authorization"))
+        if subject is None:
+            # Would otherwise share one scope with every other bad token and see their responses
+            await JSONResponse(
+                {"detail": "Invalid or expired token"}, status_code=401, headers={"WWW-Authenticate": "Bearer"}
+            )(scope, receive, send)
+            return
+        key_hash = hashlib.sha256(f"{subject}\n{scope['path']}\n{key}".encode()).hexdigest()
+        request_hash = hashlib.sha256(body).hexdigest()
+
+        stored = cache.get(key_hash)
+        if stored is None:
+            stored = await run_in_threadpool(claim, key_hash, request_hash)
+            if isinstance(stored, StoredResponse):
+                cache.put(key_hash, stored)
+
+        if stored == "in_progress":
+            await JSONResponse(
+                {"detail": "A request with this Idempotency-Key is already in progress"},
+                status_code=409,
+            )(scope, receive, send)
+            return
+
+        if stored is not None:
+            if stored.request_hash != request_hash:
+                await JSONResponse(
+                    {"detail": "Idempotency-Key was already used with a different request"},
+                    status_code=422,
+                )(scope, receive, send)
+                return
+            await send({
+                "type": "http.response.start",
+                "status": stored.status_code,
+                "headers": stored.headers + [
+                    (b"content-length", str(len(stored.body)).encode()),
+                    (b"idempotent-replayed", b"true"),
+                ],
+            })
+            await send({"type": "http.response.body", "body": stored.body})
+            return
+
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        status_code = 500
+        response_headers = []
+        chunks = []
+
+        async def capture_send(message):
+            nonlocal status_code, response_headers
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                response_headers = [
+                    (name, value) for name, value in message.get("headers", []) if name.lower() not in UNSTORED_HEADERS
+                ]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        commits = []
+        token = _commits.set(commits)
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except Exception:
+            if commits:
+                await run_in_threadpool(store, key_hash, StoredResponse(request_hash, 500, *UNHANDLED_ERROR))
+            else:
+                await run_in_threadpool(release, key_hash)
+            raise
+        finally:
+            _commits.reset(token)
+
+        if (status_code >= 500 or status_code == 499) and not commits:
+            # 499: the client went away mid-request (see deadlines); its retry runs afresh
+            await run_in_threadpool(release, key_hash)
+            return
+
+        response = StoredResponse(request_hash, status_code, response_headers, b"".join(chunks))
+        await run_in_threadpool(store, key_hash, response)
+        cache.put(key_hash, response)
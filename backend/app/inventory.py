@@ -0,0 +1,139 @@
+"""Stock per warehouse and allocation across warehouses.
+
+product_stock has one row per (warehouse, product), so dispatches and
+shipments at different depots update different rows instead of all queuing
+on one row per product.
+
+Dispatch allocates from the order's warehouse first (the shopkeeper's, else
+the dispatching manager's, else DEFAULT_WAREHOUSE_CODE), then spills over to
+the other warehouses nearest to it. Only the origin's row is locked, through
+the (warehouse_id, product_name) unique index; other depots' rows are locked
+only on a shortfall, just enough of them to cover it, in id order. Two
+short depots spilling onto each other at the same moment can still deadlock;
+InnoDB then aborts one of the dispatches, which can be retried.
+"""
+import math
+import os
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .models import ProductStock, Warehouse
+
+DEFAULT_WAREHOUSE_CODE = os.getenv("DEFAULT_WAREHOUSE_CODE", "main")
+EARTH_RADIUS_KM = 6371.0
+
+
+class InsufficientStock(Exception):
+    def __init__(self, available: int):
+        super().__init__(available)
+        self.available = available
+
+
+def default_warehouse(db: Session) -> Warehouse:
+    warehouse = db.query(Warehouse).filter(Warehouse.code == DEFAULT_WAREHOUSE_CODE).first()
+    return warehouse or db.query(Warehouse).order_by(Warehouse.id).first()
+
+
+def distance_km(a: Warehouse, b: Warehouse) -> float:
+    if None in (a.latitude, a.longitude, b.latitude, b.longitude):
+        return math.inf
+    lat1, lon1, lat2, lon2 = map(math.radians, (a.latitude, a.longitude, b.latitude, b.longitude))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+def by_distance(db: Session, origin: Warehouse) -> list[Warehouse]:
+    """All warehouses, origin first, then nearest first."""
+    others = [w for w in db.query(Warehouse).all() if w.id != origin.id]
+    return [origin] + sorted(others, key=lambda w: (distance_km(origin, w), w.id))
+
+
+def _locked_row(db: Session, warehouse_id: int, product_name: str) -> ProductStock | None:
+    return (
+        db.query(ProductStock)
+        .filter(ProductStock.warehouse_id == warehouse_id, ProductStock.product_name == product_name)
+        .with_for_update()
+        .first()
+    )
+
+
+def _lock_spillover(db: Session, product_name: str, shortfall: int, origin: Warehouse) -> list[ProductStock]:
+    """Lock the nearest other depots' rows holding at least shortfall units, nearest first."""
+    rank = {w.id: i for i, w in enumerate(by_distance(db, origin))}
+    # Plain read through the (product_name, warehouse_id) index; only the rows picked are locked
+    candidates = (
+        db.query(ProductStock.id, ProductStock.warehouse_id, ProductStock.quantity)
+        .filter(
+            ProductStock.product_name == product_name,
+            ProductStock.warehouse_id != origin.id,
+            ProductStock.quantity > 0,
+        )
+        .all()
+    )
+    candidates.sort(key=lambda c: (rank.get(c.warehouse_id, len(rank)), c.id))
+
+    locked = []
+    while shortfall > 0 and candidates:
+        ids, covered = [], 0
+        while candidates and covered < shortfall:
+            candidate = candidates.pop(0)
+            ids.append(candidate.id)
+            covered += candidate.quantity
+        rows = db.query(ProductStock).filter(ProductStock.id.in_(ids)).order_by(ProductStock.id).with_for_update().all()
+        # Quantities may have dropped since the plain read: lock more if the rows fall short
+        shortfall -= sum(row.quantity for row in rows)
+        locked += rows
+    locked.sort(key=lambda s: (rank.get(s.warehouse_id, len(rank)), s.id))
+    return locked
+
+
+def allocate(db: Session, product_name: str, quantity: int, origin: Warehouse) -> list[tuple[ProductStock, int]]:
+    """Take quantity units from origin, then the nearest warehouses; returns (stock row, units taken).
+
+    Raises InsufficientStock, without taking anything, when all warehouses together hold too little.
+    """
+    stock = _locked_row(db, origin.id, product_name)
+    stocks = [stock] if stock is not None and stock.quantity > 0 else []
+    held = sum(s.quantity for s in stocks)
+    if held < quantity:
+        stocks += _lock_spillover(db, product_name, quantity - held, origin)
+    available = sum(s.quantity for s in stocks)
+    if available < quantity:
+        raise InsufficientStock(available)
+
+    allocations = []
+    for stock in stocks:
+        if quantity == 0:
+            break
+        taken = min(stock.quantity, quantity)
+        stock.quantity -= taken
+        quantity -= taken
+        allocations.append((stock, taken))
+    return allocations
+
+
+def take(db: Session, warehouse_id: int, product_name: str, quantity: int) -> ProductStock:
+    """Take quantity units from one warehouse (transfers); raises InsufficientStock."""
+    stock = _locked_row(db, warehouse_id, product_name)
+    if stock is None or stock.quantity < quantity:
+        raise InsufficientStock(stock.quantity if stock else 0)
+    stock.quantity -= quantity
+    return stock
+
+
+def receive(db: Session, warehouse_id: int, product_name: str, quantity: int) -> ProductStock:
+    stock = _locked_row(db, warehouse_id, product_name)
+    if not stock:
+        stock = ProductStock(warehouse_id=warehouse_id, product_name=product_name, quantity=0)
+        db.add(stock)
+    stock.quantity += quantity
+    return stock
+
+
+def on_hand(db: Session, product_name: str | None = None) -> dict[str, int]:
+    """Units per product over all warehouses."""
+    query = db.query(ProductStock.product_name, func.sum(ProductStock.quantity)).group_by(ProductStock.product_name)
+    if product_name is not None:
+        query = query.filter(ProductStock.product_name == product_name)
+    return {name: int(quantity or 0) for name, quantity in query.all()}
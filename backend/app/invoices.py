@@ -0,0 +1,117 @@
+import io
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from reportlab.lib import colors
+
+# PDF rendering lives here so reportlab is only imported by the first invoice request
+
+
+def customer_invoice(order, customer_name: str) -> io.BytesIO:
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter)
+    
+    # Header
+    c.setFont("Helvetica-Bold", 24)
+    c.drawString(50, 750, "INVOICE")
+    
+    c.setFont("Helvetica", 12)
+    c.drawString(50, 730, f"Order ID: #{order.id}")
+    c.drawString(50, 715, f"Date: {order.created_at.strftime('%Y-%m-%d %H:%M')}")
+    c.drawString(50, 700, f"Customer: {customer_name}")
+    
+    # Line
+    c.setStrokeColor(colors.grey)
+    c.line(50, 680, 550, 680)
+    
+    # Order Details
+    y = 650
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(50, y, "Item")
+    c.drawString(300, y, "Quantity")
+    c.drawString(450, y, "Total")
+    
+    y -= 30
+    c.setFont("Helvetica", 12)
+    c.drawString(50, y, order.product_name)
+    c.drawString(300, y, str(order.quantity))
+    c.drawString(450, y, f"Rs {order.total_amount:.2f}")
+
+    # Payment Details
+    y -= 50
+    c.line(50, y, 550, y)
+    y -= 30
+    
+    c.drawString(350, y, "Total Amount:")
+    c.drawString(450, y, f"Rs {order.total_amount:.2f}")
+    y -= 20
+    c.drawString(350, y, "Advance Paid:")
+    c.drawString(450, y, f"Rs {order.advance_payment:.2f}")
+    y -= 20
+    c.drawString(350, y, "Remaining Due:")
+    c.drawString(450, y, f"Rs {order.remaining_payment:.2f}")
+    y -= 20
+    
+    # Status
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(50, y, f"Status: {order.status.upper()}")
+
+    c.save()
+    buffer.seek(0)
+    return buffer
+
+
+def stock_supply_invoice(order, m_price: float) -> io.BytesIO:
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter)
+    
+    # Header
+    c.setFont("Helvetica-Bold", 24)
+    c.drawString(50, 750, "STOCK SUPPLY INVOICE")
+    
+    c.setFont("Helvetica", 12)
+    c.drawString(50, 730, f"Stock Request ID: #{order.id}")
+    c.drawString(50, 715, f"Date: {order.created_at.strftime('%Y-%m-%d %H:%M')}")
+    c.drawString(50, 700, f"From: Manufacturer")
+    c.drawString(50, 685, f"To: Warehouse Manager")
+    
+    # Line
+    c.setStrokeColor(colors.grey)
+    c.line(50, 665, 550, 665)
+    
+    # Order Details
+    y = 630
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(50, y, "Item")
+    c.drawString(300, y, "Quantity")
+    c.drawString(450, y, "Wholesale Total")
+    
+    y -= 30
+    c.setFont("Helvetica", 12)
+    c.drawString(50, y, order.product_name.replace("_", " ").title())
+    c.drawString(300, y, str(order.quantity))
+    c.drawString(450, y, f"INR {m_price:.2f}")
+
+    # Payment Details
+    y -= 50
+    c.line(50, y, 550, y)
+    y -= 30
+    
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(350, y, "TOTAL DUE:")
+    c.drawString(450, y, f"Rs {m_price:.2f}")
+    y -= 30
+    
+    # Status
+    # Based on our logic, if status is 'paid_to_manufacturer' or later, it's paid.
+    payment_status = "PENDING PAYMENT"
+    if order.status in ["paid_to_manufacturer", "dispatched", "delivered", "confirmed"]:
+        if order.status != "stock_requested" and order.status != "payment_requested":
+             payment_status = "PAID"
+             
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(50, y, f"Status: {payment_status}")
+    c.drawString(50, y-20, f"Workflow State: {order.status.upper()}")
+
+    c.save()
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,262 @@
+"""Durable background jobs, stored in the jobs table.
+
+Routers call enqueue(db, kind, payload) inside the transaction of the change
+that needs the follow-up, so the job exists exactly when the change was
+committed, and return without doing the work. Workers claim due jobs of one
+kind in batches, run the kind's handler on the whole batch and delete the
+jobs in the handler's transaction.
+
+- Visibility timeout: a claimed job is hidden for JOBS_VISIBILITY_SECONDS. If
+  its worker dies, another one claims it again after that.
+- Retries: a failed batch is retried job by job; a failing job is retried
+  with exponential backoff and jitter, and marked failed after max_attempts
+  (python -m app.jobs --retry-failed queues those again).
+- Workers run as threads in every API process once migrations are done
+  (JOBS_INLINE_WORKERS, 0 to disable) and/or as separate processes:
+      python -m app.jobs [--workers N] [--kinds a,b] [--once] [--status]
+
+Handlers are registered with @handler(kind, batch_size) in the module owning
+the work and get (db, payloads); they must not commit. Effects outside the
+database must be idempotent: a worker dying between them and its commit
+leaves the job to run again.
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, func, select, update
+from sqlalchemy.orm import Session
+
+from .models import Job
+from . import metrics
+
+INLINE_WORKERS = int(os.getenv("JOBS_INLINE_WORKERS", "1"))
+POLL_SECONDS = float(os.getenv("JOBS_POLL_SECONDS", "1"))
+VISIBILITY_SECONDS = float(os.getenv("JOBS_VISIBILITY_SECONDS", "60"))
+MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE_SECONDS = float(os.getenv("JOBS_BACKOFF_BASE_SECONDS", "2"))
+BACKOFF_MAX_SECONDS = float(os.getenv("JOBS_BACKOFF_MAX_SECONDS", "600"))
+
+# kind -> (handler, batch size)
+HANDLERS: dict[str, tuple[callable, int]] = {}
+
+
+def handler(kind: str, batch_size: int = 1):
+    def register(fn):
+        HANDLERS[kind] = (fn, batch_size)
+        return fn
+    return register
+
+
+def _load_handlers():
+    from . import forecasting  # noqa: F401  (registers reorder_check)
+
+
+# Enqueueing
+
+_wakeup = threading.Event()
+
+
+def _wake(session):
+    _wakeup.set()
+
+
+def enqueue(db: Session, kind: str, payload: dict, delay: float = 0, max_attempts: int = MAX_ATTEMPTS):
+    """Add a job to the caller's transaction; it becomes visible to workers on commit."""
+    db.add(Job(
+        kind=kind,
+        payload=json.dumps(payload),
+        max_attempts=max_attempts,
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+    ))
+    # Workers in this process start on it right after the commit instead of at their next poll
+    event.listen(db, "after_commit", _wake, once=True)
+
+
+# Claiming and running
+
+def _backoff(attempt: int) -> float:
+    return min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)) * random.uniform(0.5, 1)
+
+
+def _due(now: datetime):
+    # A running job whose run_at (its visibility deadline) has passed was abandoned by its worker
+    return Job.status.in_(("queued", "running")) & (Job.run_at <= now)
+
+
+def claim(db: Session, kinds: list[str] | None = None) -> tuple[str, list[Job]]:
+    """Claim a batch of due jobs of the kind waiting longest; returns (claim token, jobs)."""
+    now = datetime.utcnow()
+    # Only kinds this process has handlers for, so jobs from newer code do not block the queue
+    kinds = [kind for kind in kinds or HANDLERS if kind in HANDLERS]
+    kind = db.execute(
+        select(Job.kind).where(_due(now), Job.kind.in_(kinds)).order_by(Job.run_at).limit(1)
+    ).scalar()
+    if kind is None:
+        return "", []
+
+    ids_query = select(Job.id).where(_due(now), Job.kind == kind).order_by(Job.run_at).limit(HANDLERS[kind][1])
+    if db.bind.dialect.name == "mysql":
+        # Jobs another worker is claiming right now are skipped instead of waited on
+        ids_query = ids_query.with_for_update(skip_locked=True)
+    ids = list(db.execute(ids_query).scalars())
+    token = uuid.uuid4().hex
+    db.execute(
+        update(Job)
+        .where(Job.id.in_(ids), _due(now))
+        .values(status="running", locked_by=token, attempts=Job.attempts + 1,
+                run_at=now + timedelta(seconds=VISIBILITY_SECONDS))
+    )
+    db.commit()
+    # Without SKIP LOCKED (SQLite) a concurrent worker may have won some of them
+    jobs = db.query(Job).filter(Job.locked_by == token).order_by(Job.id).all()
+    return token, jobs
+
+
+def _run(session_factory, kind: str, token: str, jobs: list[Job]):
+    fn = HANDLERS[kind][0]
+    ids = [job.id for job in jobs]
+    with session_factory() as db:
+        try:
+            fn(db, [json.loads(job.payload) for job in jobs])
+            deleted = db.execute(delete(Job).where(Job.id.in_(ids), Job.locked_by == token)).rowcount
+            if deleted != len(ids):
+                # Past the visibility timeout another worker took some over; let it do the work
+                db.rollback()
+                return
+            db.commit()
+            metrics.inc("jobs_processed_total", {"kind": kind, "outcome": "done"}, len(ids))
+            return
+        except Exception:
+            db.rollback()
+            error = traceback.format_exc(limit=5)
+
+    if len(jobs) > 1:
+        # One bad payload must not hold back the rest of the batch
+        for job in jobs:
+            _run(session_factory, kind, token, [job])
+        return
+    _retry_or_fail(session_factory, kind, token, jobs[0], error)
+
+
+def _retry_or_fail(session_factory, kind: str, token: str, job: Job, error: str):
+    if job.attempts >= job.max_attempts:
+        values, outcome = {"status": "failed"}, "failed"
+        print(f"Job {job.id} ({kind}) failed after {job.attempts} attempts:\n{error}")
+    else:
+        run_at = datetime.utcnow() + timedelta(seconds=_backoff(job.attempts))
+        values, outcome = {"status": "queued", "run_at": run_at}, "retried"
+    with session_factory() as db:
+        db.execute(
+            update(Job).where(Job.id == job.id, Job.locked_by == token)
+            .values(locked_by=None, last_error=error[-4000:], **values)
+        )
+        db.commit()
+    metrics.inc("jobs_processed_total", {"kind": kind, "outcome": outcome})
+
+
+def run_once(session_factory, kinds: list[str] | None = None) -> int:
+    """Claim and run one batch; returns the number of jobs claimed."""
+    with session_factory() as db:
+        token, jobs = claim(db, kinds)
+        db.expunge_all()
+    if jobs:
+        _run(session_factory, jobs[0].kind, token, jobs)
+    return len(jobs)
+
+
+# Workers
+
+class Worker(threading.Thread):
+    def __init__(self, session_factory, kinds: list[str] | None = None, name: str = "job-worker"):
+        super().__init__(name=name, daemon=True)
+        self.session_factory = session_factory
+        self.kinds = kinds
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                claimed = run_once(self.session_factory, self.kinds)
+            except Exception as e:
+                # Database briefly unavailable and the like: keep the worker alive
+                print(f"Job worker error: {e}")
+                claimed = 0
+            if not claimed:
+                _wakeup.wait(POLL_SECONDS)
+                _wakeup.clear()
+
+
+_workers: list[Worker] = []
+
+
+def start(session_factory, count: int = INLINE_WORKERS, kinds: list[str] | None = None):
+    _load_handlers()
+    for i in range(count):
+        worker = Worker(session_factory, kinds, name=f"job-worker-{i}")
+        worker.start()
+        _workers.append(worker)
+
+
+def stop(timeout: float = 5):
+    for worker in _workers:
+        worker.stopping.set()
+    _wakeup.set()
+    for worker in _workers:
+        worker.join(timeout)
+    _workers.clear()
+
+
+def status(db: Session) -> list[tuple[str, str, int]]:
+    return db.execute(
+        select(Job.kind, Job.status, func.count()).group_by(Job.kind, Job.status).order_by(Job.kind, Job.status)
+    ).all()
+
+
+def retry_failed(db: Session) -> int:
+    count = db.execute(
+        update(Job).where(Job.status == "failed")
+        .values(status="queued", attempts=0, run_at=datetime.utcnow())
+    ).rowcount
+    db.commit()
+    return count
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Run background job workers.")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--kinds", help="comma-separated job kinds to run (default: all)")
+    parser.add_argument("--once", action="store_true", help="run until no job is due, then exit")
+    parser.add_argument("--status", action="store_true", help="print job counts by kind and status")
+    parser.add_argument("--retry-failed", action="store_true", help="queue failed jobs again")
+    args = parser.parse_args()
+    kinds = args.kinds.split(",") if args.kinds else None
+
+    if args.status or args.retry_failed:
+        with SessionLocal() as db:
+            if args.retry_failed:
+                print(f"{retry_failed(db)} failed jobs queued again")
+            for kind, job_status, count in status(db):
+                print(f"{kind:30} {job_status:10} {count}")
+    elif args.once:
+        _load_handlers()
+        total = 0
+        while claimed := run_once(SessionLocal, kinds):
+            total += claimed
+        print(f"{total} jobs run")
+    else:
+        start(SessionLocal, args.workers, kinds)
+        print(f"{args.workers} job workers running; Ctrl-C to stop")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            stop()
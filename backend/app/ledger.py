@@ -0,0 +1,189 @@
+"""Shopkeeper ledger: maintained balances, statements and aging.
+
+account_balances holds one row per shopkeeper with everything billed and
+paid so far. place_order and deliver_order update it in the same transaction
+as the order or payment, so "how much does this shop owe" is a single-row
+read. Statements are computed in SQL over live and archived orders and
+payments: a window function gives the running balance, and aging buckets
+are conditional sums over the unpaid orders.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, delete, func, insert, literal, null, select, union_all
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.orm import Session
+
+from .models import AccountBalance, ArchivedOrder, ArchivedPayment, Order, Payment
+from .money import from_minor
+
+# Payments made by the shopkeeper; stock_supply is the warehouse paying the manufacturer
+CUSTOMER_PAYMENT_TYPES = ("advance", "remaining")
+AGING_DAYS = (30, 60, 90)
+
+
+def add(db: Session, user_id: int, billed_minor: int = 0, paid_minor: int = 0):
+    """Apply an order (billed) or payment (paid) to the user's balance inside the caller's transaction.
+
+    One upsert, so two first orders of a shopkeeper at once cannot both try to create the row.
+    """
+    table = AccountBalance.__table__
+    now = datetime.utcnow()
+    increments = {
+        "billed_minor": table.c.billed_minor + billed_minor,
+        "paid_minor": table.c.paid_minor + paid_minor,
+        "updated_at": now,
+    }
+    values = {"user_id": user_id, "billed_minor": billed_minor, "paid_minor": paid_minor, "updated_at": now}
+    if db.bind.dialect.name == "mysql":
+        upsert = mysql.insert(table).values(**values).on_duplicate_key_update(**increments)
+    else:
+        upsert = sqlite.insert(table).values(**values).on_conflict_do_update(
+            index_elements=[table.c.user_id], set_=increments
+        )
+    db.execute(upsert)
+
+
+def _amounts():
+    # (user_id, billed, paid) for every order and customer payment, live and archived
+    parts = []
+    for orders, payments in ((Order, Payment), (ArchivedOrder, ArchivedPayment)):
+        parts.append(select(
+            orders.user_id, orders.total_amount_minor.label("billed"), literal(0).label("paid")
+        ))
+        parts.append(
+            select(orders.user_id, literal(0).label("billed"), payments.amount_minor.label("paid"))
+            .join(orders, orders.id == payments.order_id)
+            .where(payments.payment_type.in_(CUSTOMER_PAYMENT_TYPES))
+        )
+    return union_all(*parts).subquery("amounts")
+
+
+def recompute_balances(db, user_ids=None):
+    """Rebuild balance rows from the orders and payments (all users, or the given ones).
+
+    For migrations and bulk loads; concurrent order writes for the same users
+    would be lost, so regular writes use add().
+    """
+    amounts = _amounts()
+    totals = select(
+        amounts.c.user_id,
+        func.sum(amounts.c.billed),
+        func.sum(amounts.c.paid),
+        literal(datetime.utcnow()),
+    ).group_by(amounts.c.user_id)
+    clear = delete(AccountBalance.__table__)
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        totals = totals.where(amounts.c.user_id.in_(user_ids))
+        clear = clear.where(AccountBalance.user_id.in_(user_ids))
+    db.execute(clear)
+    db.execute(insert(AccountBalance.__table__).from_select(
+        ["user_id", "billed_minor", "paid_minor", "updated_at"], totals
+    ))
+
+
+def get_balance(db: Session, user_id: int) -> AccountBalance:
+    return db.get(AccountBalance, user_id) or AccountBalance(user_id=user_id, billed_minor=0, paid_minor=0)
+
+
+def _entries(user_id: int):
+    parts = []
+    for orders, payments in ((Order, Payment), (ArchivedOrder, ArchivedPayment)):
+        parts.append(select(
+            orders.created_at.label("entry_date"),
+            literal(0).label("kind"),
+            orders.id.label("order_id"),
+            orders.id.label("entry_id"),
+            orders.product_name,
+            orders.quantity,
+            null().label("payment_type"),
+            orders.total_amount_minor.label("debit"),
+            literal(0).label("credit"),
+        ).where(orders.user_id == user_id))
+        parts.append(
+            select(
+                payments.paid_at.label("entry_date"),
+                literal(1).label("kind"),
+                payments.order_id,
+                payments.id.label("entry_id"),
+                orders.product_name,
+                orders.quantity,
+                payments.payment_type,
+                literal(0).label("debit"),
+                payments.amount_minor.label("credit"),
+            )
+            .join(orders, orders.id == payments.order_id)
+            .where(orders.user_id == user_id, payments.payment_type.in_(CUSTOMER_PAYMENT_TYPES))
+        )
+    return union_all(*parts).subquery("entries")
+
+
+def statement(db: Session, user_id: int, start: datetime | None = None, end: datetime | None = None) -> dict:
+    entries = _entries(user_id)
+    order_by = (entries.c.entry_date, entries.c.kind, entries.c.order_id, entries.c.entry_id)
+    running = select(
+        entries,
+        func.sum(entries.c.debit - entries.c.credit).over(order_by=order_by, rows=(None, 0)).label("balance"),
+    ).subquery("running")
+
+    query = select(running).order_by(running.c.entry_date, running.c.kind, running.c.order_id, running.c.entry_id)
+    if start is not None:
+        query = query.where(running.c.entry_date >= start)
+    if end is not None:
+        query = query.where(running.c.entry_date < end)
+
+    opening = 0
+    if start is not None:
+        opening = db.execute(
+            select(func.coalesce(func.sum(entries.c.debit - entries.c.credit), 0)).where(entries.c.entry_date < start)
+        ).scalar()
+
+    rows = db.execute(query).all()
+    lines = []
+    for row in rows:
+        if row.kind == 0:
+            description = f"Order #{row.order_id}: {row.quantity} x {row.product_name}"
+        else:
+            description = f"{row.payment_type.capitalize()} payment for order #{row.order_id}"
+        lines.append({
+            "date": row.entry_date,
+            "entry_type": "order" if row.kind == 0 else "payment",
+            "order_id": row.order_id,
+            "description": description,
+            "debit": from_minor(row.debit),
+            "credit": from_minor(row.credit),
+            "balance": from_minor(row.balance),
+        })
+    closing = rows[-1].balance if rows else opening
+    return {
+        "opening_balance": from_minor(opening),
+        "closing_balance": from_minor(closing),
+        "entries": lines,
+    }
+
+
+def aging(db: Session, user_id: int, now: datetime | None = None) -> dict:
+    """Unpaid amounts by order age. Archived orders are fully paid, so only live orders count."""
+    now = now or datetime.utcnow()
+    d30, d60, d90 = (now - timedelta(days=days) for days in AGING_DAYS)
+    owed = Order.remaining_payment_minor
+
+    def bucket(condition):
+        return func.coalesce(func.sum(case((condition, owed), else_=0)), 0)
+
+    row = db.execute(
+        select(
+            bucket(Order.created_at >= d30),
+            bucket((Order.created_at < d30) & (Order.created_at >= d60)),
+            bucket((Order.created_at < d60) & (Order.created_at >= d90)),
+            bucket(Order.created_at < d90),
+        ).where(Order.user_id == user_id, owed > 0)
+    ).one()
+    return {
+        "current": from_minor(row[0]),
+        "days_31_60": from_minor(row[1]),
+        "days_61_90": from_minor(row[2]),
+        "over_90": from_minor(row[3]),
+    }
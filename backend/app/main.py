@@ -1,61 +1,178 @@
-from fastapi import FastAPI, Depends, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from .database import engine, Base, get_db
-import time
-import sqlalchemy
-from .routers.auth import router as auth_router
-from .routers.protected import router as protected_router
-from .routers.orders import router as orders_router
-from .routers.salesman import router as salesman_router
-from .routers.warehouse import router as warehouse_router
-from .routers.manufacturer import router as manufacturer_router
+from .startup_profile import timed
+from . import startup_profile
+
+with timed("import fastapi + sqlalchemy"):
+    from fastapi import FastAPI, Depends, HTTPException
+    from fastapi.responses import PlainTextResponse
+    from fastapi.middleware.cors import CORSMiddleware
+    from sqlalchemy.orm import Session
+    from starlette.concurrency import run_in_threadpool
+    import asyncio
+    import os
+    import sys
+    import sqlalchemy
+    from sqlalchemy import text
+with timed("import database + models"):
+    from .database import engine, replica_engine, SessionLocal, get_db, db_ready, ReadYourWritesMiddleware
+    from . import models, migrations
+with timed("import middleware"):
+    from .idempotency import IdempotencyMiddleware
+    from .metrics import MetricsMiddleware
+    from .profiler import ProfilerMiddleware
+    from .admission import AdmissionMiddleware
+    from .deadlines import DeadlineExceeded, DeadlineMiddleware, deadline_exceeded_handler
+    from . import deadlines
+    from . import metrics
+    from . import jobs
+with timed("import routers.auth"):
+    from .routers.auth import router as auth_router
+with timed("import routers.protected"):
+    from .routers.protected import router as protected_router
+with timed("import routers.orders"):
+    from .routers.orders import router as orders_router
+with timed("import routers.salesman"):
+    from .routers.salesman import router as salesman_router
+with timed("import routers.warehouse"):
+    from .routers.warehouse import router as warehouse_router
+with timed("import routers.manufacturer"):
+    from .routers.manufacturer import router as manufacturer_router
+with timed("import routers.forecast"):
+    from .routers.forecast import router as forecast_router
+with timed("import routers.accounts"):
+    from .routers.accounts import router as accounts_router
+with timed("import routers.debug"):
+    from .routers.debug import router as debug_router
 
 
 app = FastAPI(title="Distributor Automation System")
 
+# Bounds each request, and the statements it runs, by a deadline; 504 when it passes.
+# Inside the idempotency layer, whose own claim/store statements are then never cut short
+# outside the exception handlers
+app.add_middleware(DeadlineMiddleware)
+app.add_exception_handler(DeadlineExceeded, deadline_exceeded_handler)
+deadlines.install(engine)
+if replica_engine is not None:
+    deadlines.install(replica_engine)
+# Retried POSTs carrying the same Idempotency-Key get the original response
+app.add_middleware(IdempotencyMiddleware)
+# Keeps a client's reads on the primary right after its own writes
+app.add_middleware(ReadYourWritesMiddleware)
+# Sheds load with 429/503 before it reaches the threadpool; inside CORS so browsers can read the rejection
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allows all origins
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    # Read by the frontend and sent back on its next reads (see ReadYourWritesMiddleware)
+    expose_headers=["X-Primary-Until"],
 )
-app.include_router(auth_router)
-app.include_router(protected_router)
-app.include_router(orders_router)
-app.include_router(salesman_router)
-app.include_router(warehouse_router)
-app.include_router(manufacturer_router)
-# Improved startup: Wait for DB with retries
-@app.on_event("startup")
-def on_startup():
-    max_retries = 20
-    retry_delay = 3  # seconds
+# X-Profile: 1 requests from allowed users are sampled by the profiler
+app.add_middleware(ProfilerMiddleware)
+# Outermost, so latency includes every other middleware
+app.add_middleware(MetricsMiddleware)
+with timed("register routers"):
+    app.include_router(auth_router)
+    app.include_router(protected_router)
+    app.include_router(orders_router)
+    app.include_router(salesman_router)
+    app.include_router(warehouse_router)
+    app.include_router(manufacturer_router)
+    app.include_router(forecast_router)
+    app.include_router(accounts_router)
+    app.include_router(debug_router)
+
+# Startup never blocks: migrations run in the background while / and /health already answer
+DB_WAIT_ATTEMPTS = 20
+DB_WAIT_DELAY_SECONDS = 3
+# A worker whose migrations failed reports it on /health for this long, then exits for a restart
+STARTUP_FAILURE_EXIT_SECONDS = 5
 
-    for attempt in range(1, max_retries + 1):
+def _exit(code: int):
+    sys.stdout.flush()
+    os._exit(code)
+
+def fail_startup(reason: str):
+    app.state.startup_error = reason
+    print(f"Startup failed: {reason}; exiting in {STARTUP_FAILURE_EXIT_SECONDS}s so the worker is restarted")
+    asyncio.get_running_loop().call_later(STARTUP_FAILURE_EXIT_SECONDS, _exit, 1)
+
+async def wait_for_database():
+    started = startup_profile.since_start()
+    for attempt in range(1, DB_WAIT_ATTEMPTS + 1):
         try:
-            print(f"Attempting to connect to database... (attempt {attempt}/{max_retries})")
-            Base.metadata.create_all(bind=engine)
-            print("Database connected and tables created successfully!")
+            print(f"Attempting to connect to database... (attempt {attempt}/{DB_WAIT_ATTEMPTS})")
+            applied = await run_in_threadpool(migrations.upgrade, engine)
+            print(f"Database ready (migrations applied: {applied or 'none'})")
+            db_ready.set()
+            if jobs.INLINE_WORKERS:
+                # Workers need the jobs table, so they start once migrations are done
+                jobs.start(SessionLocal)
+            startup_profile.record("database ready after startup", startup_profile.since_start() - started)
+            startup_profile.report("database ready")
             return
         except sqlalchemy.exc.OperationalError as e:
             if "Connection refused" in str(e) or "Can't connect" in str(e):
-                print("Database not ready yet. Retrying in {} seconds...".format(retry_delay))
-                time.sleep(retry_delay)
+                print("Database not ready yet. Retrying in {} seconds...".format(DB_WAIT_DELAY_SECONDS))
+                await asyncio.sleep(DB_WAIT_DELAY_SECONDS)
             else:
-                raise  # If it's a different error, crash immediately
+                fail_startup(f"Database migration failed: {e}")
+                return
+        except Exception as e:
+            fail_startup(f"Database migration failed: {e}")
+            return
+    fail_startup("Failed to connect to database after multiple attempts")
 
-    raise Exception("Failed to connect to database after multiple attempts")
+@app.on_event("startup")
+async def on_startup():
+    app.state.db_wait_task = asyncio.create_task(wait_for_database())
+    metrics.start_flusher()
+    startup_profile.report("accepting requests")
+
+@app.on_event("shutdown")
+def on_shutdown():
+    jobs.stop()
 
 @app.get("/")
 def read_root():
     return {"message": "FastAPI connected to MySQL!"}
 
+@app.get("/health")
+def health():
+    # Liveness: the process is up, whether or not the database is, unless startup failed for good
+    startup_error = getattr(app.state, "startup_error", None)
+    if startup_error:
+        raise HTTPException(status_code=503, detail=startup_error)
+    return {"status": "ok"}
+
+@app.get("/ready")
+def ready():
+    if not db_ready.is_set():
+        raise HTTPException(status_code=503, detail="Database is not ready yet", headers={"Retry-After": "3"})
+    return {"status": "ready"}
+
 @app.get("/test-db")
 def test_db(db: Session = Depends(get_db)):
     try:
-        db.execute("SELECT 1")
+        db.execute(text("SELECT 1"))
         return {"status": "MySQL connection successful!"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"DB Error: {str(e)}")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    # Stock levels are read at scrape time rather than tracked on every write
+    stock_gauges = {}
+    if db_ready.is_set():
+        db = SessionLocal()
+        try:
+            stock = db.query(models.Warehouse.code, models.ProductStock.product_name, models.ProductStock.quantity).join(
+                models.Warehouse, models.ProductStock.warehouse_id == models.Warehouse.id
+            )
+            for code, product_name, quantity in stock:
+                stock_gauges[("product_stock_quantity", (("product", product_name), ("warehouse", code)))] = quantity
+        finally:
+            db.close()
+    return PlainTextResponse(metrics.render(stock_gauges), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,287 @@
+"""Prometheus-style metrics.
+
+Every thread records into its own shard (plain dicts, no locks on the hot
+path); a scrape sums the shards. The threadpool retires idle threads and
+starts new ones, so the shards of threads that have exited are folded into
+one at each snapshot, which keeps their number bounded by the live threads. With several workers, set
+METRICS_MULTIPROC_DIR to a directory shared by them: each worker writes its
+snapshot there and /metrics merges all snapshots.
+"""
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR")
+FLUSH_INTERVAL_SECONDS = float(os.getenv("METRICS_FLUSH_INTERVAL_SECONDS", "5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name -> (type, help)
+METRICS = {
+    "http_requests_total": ("counter", "HTTP requests by route template, role and status."),
+    "http_request_errors_total": ("counter", "HTTP requests that raised or returned 5xx."),
+    "http_request_duration_seconds": ("histogram", "HTTP request latency by route template and role."),
+    "http_requests_in_flight": ("gauge", "HTTP requests currently being served."),
+    "http_requests_shed_total": ("counter", "Requests rejected by admission control."),
+    "http_request_timeouts_total": ("counter", "Requests stopped by their deadline or a client disconnect."),
+    "jobs_processed_total": ("counter", "Background jobs run, by kind and outcome (done, retried, failed)."),
+    "order_status_transitions_total": ("counter", "Order workflow transitions."),
+    "product_stock_quantity": ("gauge", "Units in stock per product and warehouse."),
+}
+
+
+class _Shard:
+    def __init__(self):
+        self.counters: dict[tuple, float] = {}
+        self.gauges: dict[tuple, float] = {}
+        # key -> [bucket counts..., +Inf count, sum]
+        self.histograms: dict[tuple, list[float]] = {}
+
+
+_local = threading.local()
+# (owning thread, shard); only taken when a thread records its first value, and by snapshots
+_shards: list[tuple[threading.Thread, _Shard]] = []
+_shards_lock = threading.Lock()
+# Everything recorded by threads that have since exited
+_retired = _Shard()
+
+
+def _shard() -> _Shard:
+    shard = getattr(_local, "shard", None)
+    if shard is None:
+        shard = _local.shard = _Shard()
+        with _shards_lock:
+            _shards.append((threading.current_thread(), shard))
+    return shard
+
+
+def _key(name: str, labels: dict | None) -> tuple:
+    return (name, tuple(sorted(labels.items())) if labels else ())
+
+
+def inc(name: str, labels: dict | None = None, value: float = 1):
+    counters = _shard().counters
+    key = _key(name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def gauge_add(name: str, labels: dict | None = None, value: float = 1):
+    gauges = _shard().gauges
+    key = _key(name, labels)
+    gauges[key] = gauges.get(key, 0) + value
+
+
+def observe(name: str, labels: dict | None, value: float, buckets=LATENCY_BUCKETS):
+    histograms = _shard().histograms
+    key = _key(name, labels)
+    cells = histograms.get(key)
+    if cells is None:
+        cells = histograms[key] = [0] * (len(buckets) + 2)
+    cells[bisect.bisect_left(buckets, value)] += 1
+    cells[-1] += value
+
+
+def order_transition(from_status: str | None, to_status: str):
+    inc("order_status_transitions_total", {"from_status": from_status or "none", "to_status": to_status})
+
+
+# Aggregation
+
+def _add(total: _Shard, shard: _Shard):
+    # list() copies: the shard's thread may be adding keys meanwhile
+    for key, value in list(shard.counters.items()):
+        total.counters[key] = total.counters.get(key, 0) + value
+    for key, value in list(shard.gauges.items()):
+        total.gauges[key] = total.gauges.get(key, 0) + value
+    for key, cells in list(shard.histograms.items()):
+        sums = total.histograms.setdefault(key, [0] * len(cells))
+        for i, cell in enumerate(cells):
+            sums[i] += cell
+
+
+def snapshot() -> dict:
+    """Sum of all shards of this process."""
+    total = _Shard()
+    with _shards_lock:
+        live = []
+        for thread, shard in _shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                # Nothing writes to it any more
+                _add(_retired, shard)
+        _shards[:] = live
+        _add(total, _retired)
+        for _, shard in live:
+            _add(total, shard)
+    return {"counters": total.counters, "gauges": total.gauges, "histograms": total.histograms}
+
+
+def _encode(snap: dict) -> dict:
+    return {kind: [[name, list(labels), value] for (name, labels), value in values.items()]
+            for kind, values in snap.items()}
+
+
+def _decode(data: dict) -> dict:
+    return {kind: {(name, tuple(tuple(pair) for pair in labels)): value for name, labels, value in values}
+            for kind, values in data.items()}
+
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(MULTIPROC_DIR, f"metrics_{pid}.json")
+
+
+def flush():
+    """Write this worker's snapshot for the other workers' scrapes."""
+    if not MULTIPROC_DIR:
+        return
+    path = _snapshot_path(os.getpid())
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(_encode(snapshot()), f)
+    os.replace(tmp, path)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def merged_snapshot() -> dict:
+    snap = snapshot()
+    if not MULTIPROC_DIR:
+        return snap
+    own = _snapshot_path(os.getpid())
+    for path in glob.glob(os.path.join(MULTIPROC_DIR, "metrics_*.json")):
+        if path == own:
+            continue
+        try:
+            with open(path) as f:
+                other = _decode(json.load(f))
+        except (OSError, ValueError):
+            continue
+        pid = int(os.path.basename(path)[len("metrics_"):-len(".json")])
+        for key, value in other["counters"].items():
+            snap["counters"][key] = snap["counters"].get(key, 0) + value
+        for key, cells in other["histograms"].items():
+            total = snap["histograms"].setdefault(key, [0] * len(cells))
+            for i, cell in enumerate(cells):
+                total[i] += cell
+        # Counters of exited workers still count; their in-flight gauges do not
+        if _alive(pid):
+            for key, value in other["gauges"].items():
+                snap["gauges"][key] = snap["gauges"].get(key, 0) + value
+    return snap
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL_SECONDS)
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def start_flusher():
+    if MULTIPROC_DIR:
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+        threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+
+
+# Exposition
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value) -> str:
+    # Integral values print exactly; %g would round large counters to 6 digits
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels_text(labels, extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def render(extra_gauges: dict | None = None) -> str:
+    """Text exposition format; extra_gauges maps (name, labels) keys to values read at scrape time."""
+    snap = merged_snapshot()
+    if extra_gauges:
+        snap["gauges"].update(extra_gauges)
+
+    by_name: dict[str, list[str]] = {}
+    for (name, labels), value in sorted(snap["counters"].items()):
+        by_name.setdefault(name, []).append(f"{name}{_labels_text(labels)} {_number(value)}")
+    for (name, labels), value in sorted(snap["gauges"].items()):
+        by_name.setdefault(name, []).append(f"{name}{_labels_text(labels)} {_number(value)}")
+    for (name, labels), cells in sorted(snap["histograms"].items()):
+        lines = by_name.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, cells):
+            cumulative += count
+            le = 'le="%g"' % bound
+            lines.append(f"{name}_bucket{_labels_text(labels, le)} {_number(cumulative)}")
+        cumulative += cells[len(LATENCY_BUCKETS)]
+        le = 'le="+Inf"'
+        lines.append(f"{name}_bucket{_labels_text(labels, le)} {_number(cumulative)}")
+        lines.append(f"{name}_sum{_labels_text(labels)} {_number(cells[-1])}")
+        lines.append(f"{name}_count{_labels_text(labels)} {_number(cumulative)}")
+
+    out = []
+    for name, lines in by_name.items():
+        kind, help_text = METRICS.get(name, ("untyped", ""))
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        out.extend(lines)
+    return "\n".join(out) + "\n"
+
+
+class MetricsMiddleware:
+    """Records latency, status and in-flight requests per route template and role."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        gauge_add("http_requests_in_flight")
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            status_code = 500
+            raise
+        finally:
+            gauge_add("http_requests_in_flight", value=-1)
+            route = scope.get("route")
+            labels = {
+                "method": scope["method"],
+                # Templates, not raw paths, keep label cardinality bounded
+                "route": getattr(route, "path", "unmatched"),
+                "role": scope.get("state", {}).get("role", "anonymous"),
+            }
+            observe("http_request_duration_seconds", labels, time.perf_counter() - started)
+            inc("http_requests_total", {**labels, "status": str(status_code)})
+            if status_code >= 500:
+                inc("http_request_errors_total", labels)
@@ -0,0 +1,322 @@
+"""Versioned schema migrations.
+
+Each migration runs once and is recorded in the schema_version table, so a
+booting worker only reads one row to know the schema is current. Migrations
+must be idempotent: on a fresh database the baseline already creates the
+current models, and later steps skip what exists.
+
+Run manually with:  python -m app.migrations [--status]
+"""
+import sys
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from .database import Base
+from . import models  # noqa: F401  (registers the tables on Base)
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String(200), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+MIGRATIONS: list[tuple[int, str, callable]] = []
+LOCK_NAME = "distributor_schema_migrations"
+LOCK_TIMEOUT_SECONDS = 60
+
+
+def migration(version: int, description: str):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+# Online-safe DDL helpers
+
+def has_column(conn: Connection, table: str, column: str) -> bool:
+    return column in {c["name"] for c in inspect(conn).get_columns(table)}
+
+
+def has_index(conn: Connection, table: str, name: str) -> bool:
+    return name in {i["name"] for i in inspect(conn).get_indexes(table)}
+
+
+def add_column(conn: Connection, table: str, column: str, ddl: str):
+    """Add a column if it is missing, without blocking writes on MySQL."""
+    if has_column(conn, table, column):
+        return
+    online = ", ALGORITHM=INPLACE, LOCK=NONE" if conn.dialect.name == "mysql" else ""
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}{online}"))
+
+
+def add_index(conn: Connection, table: str, name: str, columns: list[str], unique: bool = False):
+    """Create an index if it is missing, without blocking writes on MySQL."""
+    if has_index(conn, table, name):
+        return
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    cols = ", ".join(columns)
+    if conn.dialect.name == "mysql":
+        conn.execute(text(f"ALTER TABLE {table} ADD {kind} {name} ({cols}), ALGORITHM=INPLACE, LOCK=NONE"))
+    else:
+        conn.execute(text(f"CREATE {kind} {name} ON {table} ({cols})"))
+
+
+def backfill(conn: Connection, table: str, assignments: str, where: str, batch_size: int = 10000):
+    """UPDATE in primary-key ranges, committing each, so no statement locks the whole table."""
+    low, high = conn.execute(text(f"SELECT MIN(id), MAX(id) FROM {table}")).one()
+    if low is None:
+        return
+    for start in range(low, high + 1, batch_size):
+        conn.execute(
+            text(f"UPDATE {table} SET {assignments} WHERE ({where}) AND id >= :start AND id < :stop"),
+            {"start": start, "stop": start + batch_size},
+        )
+        conn.commit()
+
+
+# Migrations
+
+@migration(1, "baseline schema")
+def baseline(conn: Connection):
+    # Creates any missing table from the models; existing tables are left alone
+    Base.metadata.create_all(bind=conn)
+
+
+@migration(2, "order amount columns and full status enum")
+def order_columns(conn: Connection):
+    # Formerly fix_db.py: columns added to orders after the first deployments
+    add_column(conn, "orders", "quantity", "INT NOT NULL DEFAULT 1")
+    add_column(conn, "orders", "total_amount", "FLOAT NOT NULL DEFAULT 0.0")
+    add_column(conn, "orders", "advance_payment", "FLOAT DEFAULT 0.0")
+    add_column(conn, "orders", "remaining_payment", "FLOAT NOT NULL DEFAULT 0.0")
+    if conn.dialect.name == "mysql":
+        conn.execute(text(
+            "ALTER TABLE orders MODIFY COLUMN status ENUM('placed', 'confirmed', 'dispatched', 'delivered', "
+            "'stock_requested', 'payment_requested', 'paid_to_manufacturer') NOT NULL DEFAULT 'placed'"
+        ))
+
+
+@migration(3, "seed collection version counters")
+def seed_collection_versions(conn: Connection):
+    for name in ("orders", "stock", "replenishments"):
+        exists = conn.execute(text("SELECT 1 FROM collection_versions WHERE name = :name"), {"name": name}).first()
+        if not exists:
+            conn.execute(text("INSERT INTO collection_versions (name, version) VALUES (:name, 0)"), {"name": name})
+
+
+@migration(4, "order archive tables, partitioned by month on MySQL")
+def archive_tables(conn: Connection):
+    from .archive import partition_archive
+
+    models.ArchivedOrder.__table__.create(bind=conn, checkfirst=True)
+    models.ArchivedPayment.__table__.create(bind=conn, checkfirst=True)
+    if conn.dialect.name == "mysql":
+        # The archive only receives old orders, so start at the oldest one
+        oldest = conn.execute(text("SELECT MIN(created_at) FROM orders")).scalar()
+        partition_archive(conn, (oldest or datetime.utcnow()).date())
+
+
+@migration(5, "orders (status, created_at) index")
+def order_status_index(conn: Connection):
+    add_index(conn, "orders", "ix_orders_status_created_at", ["status", "created_at"])
+
+
+@migration(6, "bulk import checkpoints")
+def import_checkpoints(conn: Connection):
+    models.ImportCheckpoint.__table__.create(bind=conn, checkfirst=True)
+
+
+MONEY_COLUMNS = {
+    "orders": ["total_amount", "advance_payment", "remaining_payment"],
+    "archived_orders": ["total_amount", "advance_payment", "remaining_payment"],
+    "payments": ["amount"],
+    "archived_payments": ["amount"],
+}
+
+
+@migration(7, "money in integer minor units, account balances")
+def money_minor_units(conn: Connection):
+    from .ledger import recompute_balances
+
+    is_mysql = conn.dialect.name == "mysql"
+    for table, columns in MONEY_COLUMNS.items():
+        # Float columns still present: add the paise columns, copy, then drop the floats
+        legacy = [c for c in columns if has_column(conn, table, c)]
+        if not legacy:
+            continue
+        for column in legacy:
+            add_column(conn, table, f"{column}_minor", "BIGINT NULL")
+        backfill(
+            conn, table,
+            ", ".join(f"{c}_minor = ROUND(COALESCE({c}, 0) * 100)" for c in legacy),
+            " OR ".join(f"{c}_minor IS NULL" for c in legacy),
+        )
+        if is_mysql:
+            changes = [f"MODIFY COLUMN {c}_minor BIGINT NOT NULL DEFAULT 0" for c in legacy]
+            changes += [f"DROP COLUMN {c}" for c in legacy]
+            conn.execute(text(f"ALTER TABLE {table} {', '.join(changes)}, ALGORITHM=INPLACE, LOCK=NONE"))
+        else:
+            for column in legacy:
+                conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+
+    models.AccountBalance.__table__.create(bind=conn, checkfirst=True)
+    recompute_balances(conn)
+
+
+@migration(8, "order search indexes, full-text index on usernames")
+def order_search_indexes(conn: Connection):
+    from .search import create_fulltext
+
+    add_index(conn, "orders", "ix_orders_user_id_created_at", ["user_id", "created_at"])
+    add_index(conn, "orders", "ix_orders_product_name_created_at", ["product_name", "created_at"])
+    add_index(conn, "orders", "ix_orders_created_at", ["created_at"])
+    if conn.dialect.name == "sqlite":
+        # Without statistics SQLite sorts every status match instead of scanning created_at
+        conn.execute(text("ANALYZE orders"))
+    create_fulltext(conn)
+
+
+@migration(9, "warehouses, stock per (warehouse, product), stock transfers")
+def warehouses(conn: Connection):
+    from .inventory import DEFAULT_WAREHOUSE_CODE
+
+    models.Warehouse.__table__.create(bind=conn, checkfirst=True)
+    models.StockTransfer.__table__.create(bind=conn, checkfirst=True)
+    default_id = conn.execute(text("SELECT MIN(id) FROM warehouses")).scalar()
+    if default_id is None:
+        conn.execute(text("INSERT INTO warehouses (code, name, created_at) VALUES (:code, :name, :now)"), {
+            "code": DEFAULT_WAREHOUSE_CODE, "name": "Main warehouse", "now": datetime.utcnow(),
+        })
+        default_id = conn.execute(text("SELECT MIN(id) FROM warehouses")).scalar()
+
+    # Nullable and without foreign keys on existing tables, so orders is not rebuilt
+    add_column(conn, "users", "warehouse_id", "INT NULL")
+    add_index(conn, "users", "ix_users_warehouse_id", ["warehouse_id"])
+    add_column(conn, "orders", "warehouse_id", "INT NULL")
+    add_column(conn, "replenishments", "warehouse_id", "INT NULL")
+
+    if has_column(conn, "product_stock", "warehouse_id"):
+        return
+    # Existing stock is all in the default warehouse; product_stock is small enough to rebuild
+    if conn.dialect.name == "mysql":
+        unique = [i["name"] for i in inspect(conn).get_indexes("product_stock")
+                  if i["unique"] and i["column_names"] == ["product_name"]]
+        conn.execute(text("ALTER TABLE product_stock ADD COLUMN warehouse_id INT NULL"))
+        conn.execute(text("UPDATE product_stock SET warehouse_id = :id"), {"id": default_id})
+        changes = ["MODIFY COLUMN warehouse_id INT NOT NULL"]
+        changes += [f"DROP INDEX {name}" for name in unique]
+        changes += [
+            "ADD UNIQUE INDEX uq_product_stock_warehouse_product (warehouse_id, product_name)",
+            "ADD CONSTRAINT fk_product_stock_warehouse FOREIGN KEY (warehouse_id) REFERENCES warehouses (id)",
+        ]
+        conn.execute(text(f"ALTER TABLE product_stock {', '.join(changes)}"))
+    else:
+        # SQLite cannot drop the inline UNIQUE(product_name): copy into a new table
+        conn.execute(text("ALTER TABLE product_stock RENAME TO product_stock_old"))
+        for index in inspect(conn).get_indexes("product_stock_old"):
+            conn.execute(text(f"DROP INDEX IF EXISTS {index['name']}"))
+        models.ProductStock.__table__.create(bind=conn)
+        conn.execute(text(
+            "INSERT INTO product_stock (id, warehouse_id, product_name, quantity) "
+            "SELECT id, :id, product_name, quantity FROM product_stock_old"
+        ), {"id": default_id})
+        conn.execute(text("DROP TABLE product_stock_old"))
+
+
+@migration(10, "background job queue")
+def job_queue(conn: Connection):
+    models.Job.__table__.create(bind=conn, checkfirst=True)
+
+
+@migration(11, "product_stock (product_name, warehouse_id) index")
+def product_stock_product_index(conn: Connection):
+    add_index(conn, "product_stock", "ix_product_stock_product_warehouse", ["product_name", "warehouse_id"])
+
+
+@migration(12, "idempotency responses as raw bytes with headers")
+def idempotency_raw_responses(conn: Connection):
+    add_column(conn, "idempotency_keys", "response_data", "MEDIUMBLOB NULL" if conn.dialect.name == "mysql" else "BLOB NULL")
+    add_column(conn, "idempotency_keys", "response_headers", "TEXT NULL")
+    if has_column(conn, "idempotency_keys", "response_body"):
+        # Stored responses still inside their TTL keep replaying; response_body is no longer written
+        blob = "BINARY" if conn.dialect.name == "mysql" else "BLOB"
+        conn.execute(text(
+            f"UPDATE idempotency_keys SET response_data = CAST(response_body AS {blob}) "
+            "WHERE response_body IS NOT NULL AND response_data IS NULL"
+        ))
+
+
+# Runner
+
+def current_version(conn: Connection) -> int:
+    if not inspect(conn).has_table("schema_version"):
+        return 0
+    return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def upgrade(engine: Engine) -> list[int]:
+    """Apply pending migrations and return the versions applied."""
+    with engine.connect() as conn:
+        # Cheap path for every boot after the first: one query
+        if current_version(conn) >= latest_version():
+            return []
+
+    applied = []
+    with engine.connect() as conn:
+        is_mysql = conn.dialect.name == "mysql"
+        if is_mysql:
+            # Several workers may boot at once; only one migrates
+            locked = conn.execute(
+                text("SELECT GET_LOCK(:name, :timeout)"), {"name": LOCK_NAME, "timeout": LOCK_TIMEOUT_SECONDS}
+            ).scalar()
+            if locked != 1:
+                raise RuntimeError(
+                    f"Could not take the {LOCK_NAME} lock within {LOCK_TIMEOUT_SECONDS}s; "
+                    "another worker is still migrating"
+                )
+        try:
+            schema_version.create(bind=conn, checkfirst=True)
+            conn.commit()
+            version = current_version(conn)
+            for number, description, fn in MIGRATIONS:
+                if number <= version:
+                    continue
+                print(f"Applying migration {number}: {description}")
+                try:
+                    fn(conn)
+                    conn.execute(schema_version.insert().values(
+                        version=number, description=description, applied_at=datetime.utcnow()
+                    ))
+                    conn.commit()
+                except Exception:
+                    # Without GET_LOCK (SQLite) another worker may have just applied it
+                    conn.rollback()
+                    if current_version(conn) >= number:
+                        continue
+                    raise
+                applied.append(number)
+        finally:
+            if is_mysql:
+                conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
+    return applied
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    if "--status" in sys.argv:
+        with engine.connect() as conn:
+            print(f"Schema version {current_version(conn)} (latest {latest_version()})")
+    else:
+        applied = upgrade(engine)
+        print(f"Applied migrations: {applied}" if applied else "Schema is up to date")
@@ -1,8 +1,10 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
-from sqlalchemy.dialects.mysql import ENUM
+from sqlalchemy import (
+    BigInteger, Column, Integer, Float, String, DateTime, ForeignKey, Text, Enum, Index, LargeBinary, UniqueConstraint
+)
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
+from .money import money_column
 
 class User(Base):
     __tablename__ = "users"
@@ -12,19 +14,56 @@ class User(Base):
     email = Column(String(100), unique=True, index=True, nullable=False)
     hashed_password = Column(String(255), nullable=False)
     role = Column(
-        ENUM("shopkeeper", "salesman", "warehouse_manager", "manufacturer", name="user_role_enum"),
+        Enum("shopkeeper", "salesman", "warehouse_manager", "manufacturer", name="user_role_enum"),
         nullable=False
     )
+    # Managers work at this warehouse; shopkeepers are supplied from it
+    warehouse_id = Column(Integer, ForeignKey("warehouses.id"), nullable=True, index=True)
     orders = relationship("Order", back_populates="user")
 
 
+class Warehouse(Base):
+    __tablename__ = "warehouses"
+
+    id = Column(Integer, primary_key=True, index=True)
+    code = Column(String(20), unique=True, nullable=False)
+    name = Column(String(100), nullable=False)
+    # For nearest-warehouse allocation; warehouses without coordinates are tried last
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
 class ProductStock(Base):
     __tablename__ = "product_stock"
 
     id = Column(Integer, primary_key=True, index=True)
-    product_name = Column(String(100), unique=True, nullable=False)
+    warehouse_id = Column(Integer, ForeignKey("warehouses.id"), nullable=False)
+    product_name = Column(String(100), nullable=False)
     quantity = Column(Integer, default=0, nullable=False)
 
+    warehouse = relationship("Warehouse")
+
+    __table_args__ = (
+        UniqueConstraint("warehouse_id", "product_name", name="uq_product_stock_warehouse_product"),
+        # Spill-over lookups find a product's rows in every warehouse
+        Index("ix_product_stock_product_warehouse", "product_name", "warehouse_id"),
+    )
+
+
+class StockTransfer(Base):
+    __tablename__ = "stock_transfers"
+
+    id = Column(Integer, primary_key=True, index=True)
+    product_name = Column(String(100), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    from_warehouse_id = Column(Integer, ForeignKey("warehouses.id"), nullable=False, index=True)
+    to_warehouse_id = Column(Integer, ForeignKey("warehouses.id"), nullable=False, index=True)
+    status = Column(Enum("in_transit", "received", name="stock_transfer_status_enum"), default="in_transit", nullable=False)
+    requested_by = Column(Integer, ForeignKey("users.id"), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    received_at = Column(DateTime, nullable=True)
+
 
 class Order(Base):
     __tablename__ = "orders"
@@ -33,27 +72,178 @@ class Order(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     product_name = Column(String(100), nullable=False)
     quantity = Column(Integer, nullable=False)
-    total_amount = Column(Float, nullable=False)
-    advance_payment = Column(Float, default=0.0)
-    remaining_payment = Column(Float, nullable=False)
+    # Amounts in paise; total_amount etc. are the rupee views
+    total_amount_minor = Column(BigInteger, nullable=False)
+    advance_payment_minor = Column(BigInteger, default=0, nullable=False)
+    remaining_payment_minor = Column(BigInteger, nullable=False)
+    total_amount = money_column("total_amount_minor")
+    advance_payment = money_column("advance_payment_minor")
+    remaining_payment = money_column("remaining_payment_minor")
     status = Column(
-        ENUM("placed", "confirmed", "dispatched", "delivered", "stock_requested", "payment_requested", "paid_to_manufacturer", name="order_status_enum"),
+        Enum("placed", "confirmed", "dispatched", "delivered", "stock_requested", "payment_requested", "paid_to_manufacturer", name="order_status_enum"),
         default="placed",
         nullable=False
     )
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Supplying warehouse: the shopkeeper's at placement, where dispatch allocated from afterwards
+    warehouse_id = Column(Integer, ForeignKey("warehouses.id"), nullable=True)
 
     user = relationship("User", back_populates="orders")
     payments = relationship("Payment", back_populates="order")
 
+    # Dashboard status filters and the archival scan; the others serve order search, newest first
+    __table_args__ = (
+        Index("ix_orders_status_created_at", "status", "created_at"),
+        Index("ix_orders_user_id_created_at", "user_id", "created_at"),
+        Index("ix_orders_product_name_created_at", "product_name", "created_at"),
+        Index("ix_orders_created_at", "created_at"),
+    )
+
 
 class Payment(Base):
     __tablename__ = "payments"
 
     id = Column(Integer, primary_key=True, index=True)
     order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
-    amount = Column(Float, nullable=False)
-    payment_type = Column(ENUM("advance", "remaining", "stock_supply", name="payment_type_enum"), nullable=False)
+    amount_minor = Column(BigInteger, nullable=False)
+    amount = money_column("amount_minor")
+    payment_type = Column(Enum("advance", "remaining", "stock_supply", name="payment_type_enum"), nullable=False)
     paid_at = Column(DateTime, default=datetime.utcnow)
 
-    order = relationship("Order", back_populates="payments")
\ No newline at end of file
+    order = relationship("Order", back_populates="payments")
+
+class Replenishment(Base):
+    __tablename__ = "replenishments"
+
+    id = Column(Integer, primary_key=True, index=True)
+    product_name = Column(String(100), nullable=False, index=True)
+    quantity = Column(Integer, nullable=False)
+    reorder_point = Column(Integer, nullable=False)
+    status = Column(
+        Enum("requested", "shipped", name="replenishment_status_enum"),
+        default="requested",
+        nullable=False
+    )
+    created_at = Column(DateTime, default=datetime.utcnow)
+    shipped_at = Column(DateTime, nullable=True)
+    warehouse_id = Column(Integer, ForeignKey("warehouses.id"), nullable=True)  # receiving warehouse
+
+
+class IdempotencyRecord(Base):
+    __tablename__ = "idempotency_keys"
+
+    # sha256 of (user, path, Idempotency-Key header)
+    key_hash = Column(String(64), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=True)  # NULL while the first request is running
+    content_type = Column(String(100), nullable=True)
+    # Raw bytes, so PDFs and compressed bodies replay unchanged; MEDIUMBLOB on MySQL
+    response_data = Column(LargeBinary(2**24 - 1), nullable=True)
+    response_headers = Column(Text, nullable=True)  # JSON [[name, value], ...]
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class CollectionVersion(Base):
+    __tablename__ = "collection_versions"
+
+    # Bumped by every write that changes the collection; read for ETags
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    token_hash = Column(String(64), unique=True, nullable=False)  # sha256 of the token
+    family_id = Column(String(32), nullable=False, index=True)    # shared by every rotation of one login
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    revoked_at = Column(DateTime, nullable=True)                  # set when rotated or logged out
+
+
+# Cold storage for delivered, fully-paid orders (see app/archive.py). No foreign
+# keys: MySQL partitions archived_orders by month, and partitioned InnoDB tables
+# cannot take part in foreign keys.
+class ArchivedOrder(Base):
+    __tablename__ = "archived_orders"
+
+    # created_at is part of the key because MySQL requires the partition column in every unique key
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    created_at = Column(DateTime, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    product_name = Column(String(100), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    # Amounts in paise; total_amount etc. are the rupee views
+    total_amount_minor = Column(BigInteger, nullable=False)
+    advance_payment_minor = Column(BigInteger, default=0, nullable=False)
+    remaining_payment_minor = Column(BigInteger, nullable=False)
+    total_amount = money_column("total_amount_minor")
+    advance_payment = money_column("advance_payment_minor")
+    remaining_payment = money_column("remaining_payment_minor")
+    status = Column(String(30), nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    payments = relationship(
+        "ArchivedPayment",
+        primaryjoin="ArchivedOrder.id == foreign(ArchivedPayment.order_id)",
+        viewonly=True,
+    )
+
+
+class ArchivedPayment(Base):
+    __tablename__ = "archived_payments"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    order_id = Column(Integer, nullable=False, index=True)
+    amount_minor = Column(BigInteger, nullable=False)
+    amount = money_column("amount_minor")
+    payment_type = Column(String(20), nullable=False)
+    paid_at = Column(DateTime)
+
+
+class ImportCheckpoint(Base):
+    __tablename__ = "import_checkpoints"
+
+    # Updated in the same transaction as each imported chunk, so a resumed import never loads a line twice
+    job = Column(String(255), primary_key=True)
+    line = Column(Integer, default=0, nullable=False)  # last input line committed
+    rows = Column(Integer, default=0, nullable=False)
+    rejected = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class AccountBalance(Base):
+    __tablename__ = "account_balances"
+
+    # Running totals per shopkeeper, kept in step by every order and payment write (see app/ledger.py)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    billed_minor = Column(BigInteger, default=0, nullable=False)
+    paid_minor = Column(BigInteger, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    billed = money_column("billed_minor")
+    paid = money_column("paid_minor")
+
+    @property
+    def outstanding_minor(self) -> int:
+        return self.billed_minor - self.paid_minor
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(50), nullable=False)
+    payload = Column(Text, nullable=False)  # JSON
+    status = Column(Enum("queued", "running", "failed", name="job_status_enum"), default="queued", nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, nullable=False)
+    # Not before this time; while running, when the claim expires (visibility timeout)
+    run_at = Column(DateTime, nullable=False)
+    locked_by = Column(String(32), nullable=True, index=True)  # claim token
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index("ix_jobs_status_run_at", "status", "run_at"),)
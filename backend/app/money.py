@@ -0,0 +1,38 @@
+"""Money is stored as integer minor units (paise) and exposed in rupees.
+
+Columns end in _minor; models expose the rupee value under the old name
+through money_column(), so API payloads, invoices and filters are unchanged.
+Arithmetic on amounts should use the _minor attributes.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from sqlalchemy.ext.hybrid import hybrid_property
+
+MINOR_UNITS = 100
+
+
+def to_minor(amount) -> int:
+    """Rupees (float, str or Decimal) to paise, rounding half up."""
+    if amount is None:
+        return 0
+    # str() first, so 0.1 becomes exactly 10 rather than 10.000000000000000555
+    return int((Decimal(str(amount)) * MINOR_UNITS).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor(minor: int | None) -> float | None:
+    return None if minor is None else minor / MINOR_UNITS
+
+
+def money_column(minor_attr: str) -> hybrid_property:
+    """Rupee view of an integer minor-unit column, usable on instances and in queries."""
+
+    def getter(self):
+        return from_minor(getattr(self, minor_attr))
+
+    def setter(self, value):
+        setattr(self, minor_attr, to_minor(value))
+
+    def expression(cls):
+        return getattr(cls, minor_attr) / MINOR_UNITS
+
+    return hybrid_property(getter, setter, expr=expression)
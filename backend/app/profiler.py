@@ -0,0 +1,319 @@
+"""On-demand statistical sampling profiler.
+
+A sampler thread reads every thread's stack with sys._current_frames() every
+PROFILER_INTERVAL_MS while at least one profiling session is open, so there
+is no cost when nobody is profiling. Sessions can:
+
+- sample the whole worker for N seconds (GET /debug/profile?seconds=N)
+- sample only while requests to a route are in flight, until K of them have
+  finished (GET /debug/profile?route=/salesman/pending-orders&requests=K)
+- profile a single request sent with an `X-Profile: 1` header; the response
+  carries `X-Profile-Id` and the result is fetched from /debug/profiles/{id}
+
+Route and request sessions keep every stack sampled while their request is in
+flight: the endpoint, but also dependency resolution, request and response
+model validation and serialization, which run in other frames and threads.
+Other requests served at the same time show up too, so profile an otherwise
+quiet worker for clean numbers.
+
+Output is in collapsed-stack format ("frame;frame;frame count"), readable by
+flamegraph.pl, speedscope and inferno. Only the worker that serves the
+request is profiled.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+from jose import JWTError
+from starlette.routing import compile_path
+
+from .auth import decode_access_token
+
+INTERVAL_SECONDS = float(os.getenv("PROFILER_INTERVAL_MS", "5")) / 1000
+MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "120"))
+# Who may profile: nobody unless PROFILER_USERS (usernames) and/or PROFILER_ROLES are set;
+# with both, a user must be in the list and have one of the roles
+PROFILER_ROLES = {r for r in os.getenv("PROFILER_ROLES", "").split(",") if r}
+PROFILER_USERS = {u for u in os.getenv("PROFILER_USERS", "").split(",") if u}
+# Shared by the workers of one host, so a profile id can be fetched from any of them
+PROFILE_DIR = os.getenv("PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "distributor-profiles")
+PROFILES_KEPT = 100
+HEADER = "x-profile"
+ID_HEADER = "x-profile-id"
+
+# Leaf frames of threads that are waiting rather than working
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("metrics.py", "_flush_loop"),
+}
+
+
+def is_allowed(username: str | None, role: str | None) -> bool:
+    if not PROFILER_ROLES and not PROFILER_USERS:
+        return False
+    return (not PROFILER_ROLES or role in PROFILER_ROLES) and (not PROFILER_USERS or username in PROFILER_USERS)
+
+
+class ProfileSession:
+    def __init__(self, seconds: float = MAX_SECONDS, route: str | None = None, max_requests: int | None = None):
+        # With a route, stacks are kept only while requests to it are in flight
+        self.route = route
+        self.route_regex = compile_path(route)[0] if route else None
+        self.max_requests = max_requests
+        self.in_flight = 0
+        self.requests = 0
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self.started = time.monotonic()
+        self.deadline = self.started + seconds
+        self.finished_at = None
+        self.done = threading.Event()
+
+    @property
+    def seconds(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started
+
+    def add(self, stacks: list[tuple]):
+        if self.route and not self.in_flight:
+            return
+        self.samples += 1
+        for stack in stacks:
+            self.stacks[stack] += 1
+
+
+# Sampler
+
+_sessions: list[ProfileSession] = []
+_sessions_lock = threading.Lock()
+_sampler: threading.Thread | None = None
+_idle_codes: dict = {}
+
+
+def _is_idle(code) -> bool:
+    idle = _idle_codes.get(code)
+    if idle is None:
+        idle = _idle_codes[code] = (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+    return idle
+
+
+def _sample_stacks(own_ident: int) -> list[tuple]:
+    stacks = []
+    for ident, frame in sys._current_frames().items():
+        if ident == own_ident or _is_idle(frame.f_code):
+            continue
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        stacks.append(tuple(codes))
+    return stacks
+
+
+def _run_sampler():
+    global _sampler
+    own_ident = threading.get_ident()
+    while True:
+        with _sessions_lock:
+            if not _sessions:
+                _sampler = None
+                return
+            sessions = list(_sessions)
+        stacks = _sample_stacks(own_ident)
+        now = time.monotonic()
+        for session in sessions:
+            session.add(stacks)
+            if now >= session.deadline:
+                stop(session)
+        time.sleep(INTERVAL_SECONDS)
+
+
+def start(session: ProfileSession) -> ProfileSession:
+    global _sampler
+    with _sessions_lock:
+        _sessions.append(session)
+        if _sampler is None:
+            _sampler = threading.Thread(target=_run_sampler, name="profiler-sampler", daemon=True)
+            _sampler.start()
+    return session
+
+
+def stop(session: ProfileSession):
+    with _sessions_lock:
+        if session in _sessions:
+            _sessions.remove(session)
+    if session.finished_at is None:
+        session.finished_at = time.monotonic()
+    session.done.set()
+
+
+def request_started(path: str) -> list[ProfileSession]:
+    """Route sessions the request belongs to (any method); they sample until request_finished."""
+    with _sessions_lock:
+        sessions = [s for s in _sessions if s.route_regex is not None and s.route_regex.match(path)]
+    for session in sessions:
+        session.in_flight += 1
+    return sessions
+
+
+def request_finished(sessions: list[ProfileSession]):
+    # Counts finished requests for sessions limited to the next K requests of a route
+    for session in sessions:
+        session.in_flight -= 1
+        session.requests += 1
+        if session.max_requests and session.requests >= session.max_requests:
+            stop(session)
+
+
+def has_route(routes, path: str) -> bool:
+    """Whether an endpoint is registered under the route template (any method)."""
+    for route in routes:
+        # Included routers are expanded into their routes with the include prefix applied
+        expand = getattr(route, "effective_route_contexts", None)
+        for candidate in (expand() if expand else [route]):
+            if getattr(candidate, "path", None) == path and getattr(candidate, "endpoint", None) is not None:
+                return True
+    return False
+
+
+# Output
+
+_labels: dict = {}
+
+
+def _module_path(filename: str) -> str:
+    # Shortest path relative to sys.path, e.g. sqlalchemy/orm/loading.py or app/routers/salesman.py
+    best = filename
+    for entry in sys.path:
+        root = os.path.abspath(entry or ".") + os.sep
+        if filename.startswith(root) and len(filename) - len(root) < len(best):
+            best = filename[len(root):]
+    return best
+
+
+def _label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{getattr(code, 'co_qualname', code.co_name)} ({_module_path(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+
+def collapsed(session: ProfileSession) -> str:
+    lines = [
+        ";".join(_label(code) for code in stack) + f" {count}"
+        for stack, count in session.stacks.most_common()
+    ]
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def top(session: ProfileSession, limit: int = 30) -> dict:
+    """Self and inclusive sample counts per function, and self samples per top-level package."""
+    self_counts, total_counts, packages = Counter(), Counter(), Counter()
+    for stack, count in session.stacks.items():
+        leaf = stack[-1]
+        self_counts[_label(leaf)] += count
+        packages[_module_path(leaf.co_filename).split(os.sep)[0].removesuffix(".py")] += count
+        for label in {_label(code) for code in stack}:
+            total_counts[label] += count
+    samples = sum(session.stacks.values()) or 1
+
+    def rows(counter):
+        return [{"frame": k, "samples": v, "percent": round(100 * v / samples, 1)} for k, v in counter.most_common(limit)]
+
+    return {
+        "seconds": round(session.seconds, 3),
+        "ticks": session.samples,
+        "samples": sum(session.stacks.values()),
+        "requests": session.requests,
+        "by_package": rows(packages),
+        "self": rows(self_counts),
+        "total": rows(total_counts),
+    }
+
+
+# Stored per-request profiles
+
+def _profile_path(profile_id: str) -> str:
+    return os.path.join(PROFILE_DIR, f"{profile_id}.folded")
+
+
+def save(profile_id: str, text: str):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(_profile_path(profile_id), "w") as f:
+        f.write(text)
+    profiles = sorted(
+        (os.path.join(PROFILE_DIR, name) for name in os.listdir(PROFILE_DIR) if name.endswith(".folded")),
+        key=os.path.getmtime,
+    )
+    for path in profiles[:-PROFILES_KEPT]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def load(profile_id: str) -> str | None:
+    # Ids are uuid4 hex; anything else could point outside PROFILE_DIR
+    if len(profile_id) != 32 or any(c not in "0123456789abcdef" for c in profile_id):
+        return None
+    try:
+        with open(_profile_path(profile_id)) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _requester(headers: list) -> tuple[str | None, str | None]:
+    for name, value in headers:
+        if name == b"authorization":
+            value = value.decode("latin-1")
+            if value.lower().startswith("bearer "):
+                try:
+                    payload = decode_access_token(value[7:])
+                except JWTError:
+                    return None, None
+                return payload.get("sub"), payload.get("role")
+    return None, None
+
+
+class ProfilerMiddleware:
+    """Profiles requests sent with `X-Profile: 1` by an allowed user and tracks requests for route sessions."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        session = profile_id = None
+        headers = scope.get("headers", [])
+        if any(name == HEADER.encode() and value not in (b"", b"0") for name, value in headers):
+            if is_allowed(*_requester(headers)):
+                profile_id = uuid.uuid4().hex
+                session = start(ProfileSession())
+        route_sessions = request_started(scope["path"]) if _sessions else []
+
+        async def send_wrapper(message):
+            if profile_id and message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(ID_HEADER.encode(), profile_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper if session else send)
+        finally:
+            if session:
+                stop(session)
+                try:
+                    save(profile_id, collapsed(session))
+                except OSError as e:
+                    print(f"Could not store profile {profile_id}: {e}")
+            request_finished(route_sessions)
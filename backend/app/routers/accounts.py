@@ -0,0 +1,88 @@
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+from ..database import get_read_db
+from ..dependencies import get_current_user, require_role
+from ..models import AccountBalance, User
+from ..money import from_minor
+from ..schemas import AccountBalanceResponse, AccountStatement
+from .. import ledger
+
+router = APIRouter(prefix="/accounts", tags=["Accounts"])
+
+STAFF_ROLES = ["salesman", "warehouse_manager"]
+
+def _shopkeeper(db: Session, user_id: int, current_user) -> User:
+    # Shopkeepers see their own account; salesmen and warehouse managers see any
+    if current_user.role not in STAFF_ROLES and current_user.id != user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Operation not permitted")
+    user = db.query(User).filter(User.id == user_id, User.role == "shopkeeper").first()
+    if not user:
+        raise HTTPException(status_code=404, detail="Shopkeeper not found")
+    return user
+
+def _balance_response(user: User, balance: AccountBalance) -> AccountBalanceResponse:
+    return AccountBalanceResponse(
+        user_id=user.id,
+        username=user.username,
+        billed=balance.billed,
+        paid=balance.paid,
+        outstanding=from_minor(balance.outstanding_minor),
+        updated_at=balance.updated_at
+    )
+
+def _statement(db: Session, user: User, start: Optional[datetime], end: Optional[datetime]) -> AccountStatement:
+    return AccountStatement(
+        user_id=user.id,
+        username=user.username,
+        start=start,
+        end=end,
+        outstanding=from_minor(ledger.get_balance(db, user.id).outstanding_minor),
+        aging=ledger.aging(db, user.id),
+        **ledger.statement(db, user.id, start, end)
+    )
+
+@router.get("/balances", response_model=list[AccountBalanceResponse])
+def list_balances(
+    current_user = Depends(require_role(STAFF_ROLES)),
+    db: Session = Depends(get_read_db)
+):
+    # Who owes what, largest first: one read of the maintained balance rows
+    rows = (
+        db.query(User, AccountBalance)
+        .join(AccountBalance, AccountBalance.user_id == User.id)
+        .order_by((AccountBalance.billed_minor - AccountBalance.paid_minor).desc())
+        .all()
+    )
+    return [_balance_response(user, balance) for user, balance in rows]
+
+@router.get("/me/statement", response_model=AccountStatement)
+def my_statement(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user = Depends(require_role(["shopkeeper"])),
+    db: Session = Depends(get_read_db)
+):
+    return _statement(db, current_user, start, end)
+
+@router.get("/{user_id}/balance", response_model=AccountBalanceResponse)
+def get_balance(
+    user_id: int,
+    current_user = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    user = _shopkeeper(db, user_id, current_user)
+    return _balance_response(user, ledger.get_balance(db, user.id))
+
+@router.get("/{user_id}/statement", response_model=AccountStatement)
+def get_statement(
+    user_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    # Entries with running balance between start (inclusive) and end (exclusive), plus aging of unpaid orders
+    user = _shopkeeper(db, user_id, current_user)
+    return _statement(db, user, start, end)
@@ -3,12 +3,43 @@ from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from ..database import get_db
 from ..crud import create_user, get_user_by_username
-from ..auth import verify_password, create_access_token
-from ..schemas import UserCreate, UserResponse, Token
+from ..auth import (
+    verify_password, create_access_token, create_refresh_token, hash_refresh_token,
+    ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS,
+)
+from ..models import RefreshToken, User, Warehouse
+from ..schemas import UserCreate, UserResponse, Token, RefreshRequest
 from sqlalchemy.orm import joinedload
+from datetime import datetime, timedelta
+import secrets
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
+def issue_tokens(db: Session, user: User, family_id: str = None):
+    # New access token plus a refresh token in the given rotation family
+    refresh_token = create_refresh_token()
+    db.add(RefreshToken(
+        user_id=user.id,
+        token_hash=hash_refresh_token(refresh_token),
+        family_id=family_id or secrets.token_hex(16),
+        expires_at=datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    ))
+    db.commit()
+    access_token = create_access_token(data={"sub": user.username, "role": user.role})
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    }
+
+def revoke_family(db: Session, family_id: str):
+    db.query(RefreshToken).filter(
+        RefreshToken.family_id == family_id,
+        RefreshToken.revoked_at.is_(None)
+    ).update({RefreshToken.revoked_at: datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+
 @router.post("/register", response_model=UserResponse)
 def register(user: UserCreate, db: Session = Depends(get_db)):
     #check if user  exists
@@ -17,6 +48,8 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
         )
+    if user.warehouse_id is not None and db.get(Warehouse, user.warehouse_id) is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown warehouse")
     return create_user(db, user)
 
 @router.post("/login", response_model = Token)
@@ -28,5 +61,50 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
             detail="Invalid username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = create_access_token(data={"sub": user.username, "role": user.role})
-    return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
+    return issue_tokens(db, user)
+
+@router.post("/refresh", response_model=Token)
+def refresh(body: RefreshRequest, db: Session = Depends(get_db)):
+    # Rotates the refresh token; no password check, so no bcrypt
+    invalid = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    token = db.query(RefreshToken).filter(
+        RefreshToken.token_hash == hash_refresh_token(body.refresh_token)
+    ).first()
+    if not token:
+        raise invalid
+
+    if token.revoked_at is not None:
+        # A rotated token was presented again: assume it leaked and end the whole session
+        revoke_family(db, token.family_id)
+        raise invalid
+
+    if token.expires_at < datetime.utcnow():
+        raise invalid
+
+    user = db.query(User).filter(User.id == token.user_id).first()
+    if not user:
+        raise invalid
+
+    # Conditional update so two concurrent refreshes cannot both rotate the same token
+    rotated = db.query(RefreshToken).filter(
+        RefreshToken.id == token.id,
+        RefreshToken.revoked_at.is_(None)
+    ).update({RefreshToken.revoked_at: datetime.utcnow()}, synchronize_session=False)
+    if not rotated:
+        db.rollback()
+        revoke_family(db, token.family_id)
+        raise invalid
+    return issue_tokens(db, user, family_id=token.family_id)
+
+@router.post("/logout")
+def logout(body: RefreshRequest, db: Session = Depends(get_db)):
+    token = db.query(RefreshToken).filter(
+        RefreshToken.token_hash == hash_refresh_token(body.refresh_token)
+    ).first()
+    if token:
+        revoke_family(db, token.family_id)
+    return {"message": "Logged out successfully"}
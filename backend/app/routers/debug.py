@@ -0,0 +1,61 @@
+import asyncio
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy.orm import Session
+from ..database import get_db
+from ..dependencies import get_current_user
+from .. import profiler
+
+router = APIRouter(prefix="/debug", tags=["Diagnostics"])
+
+def require_profiler_access(current_user = Depends(get_current_user)):
+    if not profiler.is_allowed(current_user.username, current_user.role):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Profiling is restricted to administrators"
+        )
+    return current_user
+
+@router.get("/profile")
+async def run_profile(
+    request: Request,
+    seconds: float = Query(10, gt=0, le=profiler.MAX_SECONDS),
+    route: Optional[str] = Query(None, description="Route template, e.g. /salesman/pending-orders"),
+    requests: Optional[int] = Query(None, ge=1, description="Stop after this many requests to the route"),
+    format: Literal["collapsed", "top"] = "collapsed",
+    current_user = Depends(require_profiler_access),
+    db: Session = Depends(get_db)
+):
+    # Return the auth lookup's connection to the pool instead of holding it while sampling
+    db.close()
+    # Samples this worker; with a route, only while requests to that route are in flight
+    if route:
+        if not profiler.has_route(request.app.routes, route):
+            raise HTTPException(status_code=404, detail=f"No route registered at {route}")
+    elif requests:
+        raise HTTPException(status_code=400, detail="requests needs a route")
+
+    session = profiler.start(profiler.ProfileSession(seconds, route, requests))
+    try:
+        while not session.done.is_set():
+            await asyncio.sleep(0.05)
+    finally:
+        profiler.stop(session)
+
+    headers = {
+        "X-Profile-Seconds": f"{session.seconds:.3f}",
+        "X-Profile-Samples": str(sum(session.stacks.values())),
+        "X-Profile-Requests": str(session.requests),
+    }
+    if format == "top":
+        return JSONResponse(profiler.top(session), headers=headers)
+    return PlainTextResponse(profiler.collapsed(session), headers=headers)
+
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+def get_request_profile(profile_id: str, current_user = Depends(require_profiler_access)):
+    # Collapsed stacks of a request sent with X-Profile: 1
+    text = profiler.load(profile_id)
+    if text is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(text)
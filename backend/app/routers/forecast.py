@@ -0,0 +1,52 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+from ..database import get_db, get_read_db
+from ..dependencies import require_role
+from ..schemas import DemandForecastResponse, ReorderPointResponse, ReplenishmentResponse
+from .. import forecasting, inventory
+
+router = APIRouter(prefix="/forecast", tags=["Forecasting"])
+
+@router.get("/demand", response_model=list[DemandForecastResponse])
+def get_demand_forecast(
+    current_user = Depends(require_role(["warehouse_manager", "manufacturer"])),
+    db: Session = Depends(get_read_db)
+):
+    forecasts = forecasting.get_forecasts(db)
+    return [DemandForecastResponse(**f) for f in forecasts.values()]
+
+@router.get("/reorder-points", response_model=list[ReorderPointResponse])
+def get_reorder_points(
+    current_user = Depends(require_role(["warehouse_manager"])),
+    db: Session = Depends(get_read_db)
+):
+    forecasts = forecasting.get_forecasts(db)
+    # Demand is forecast per product, so stock is compared over all warehouses
+    stock_levels = inventory.on_hand(db)
+
+    result = []
+    for name, forecast in forecasts.items():
+        on_hand = stock_levels.get(name, 0)
+        result.append(ReorderPointResponse(
+            **forecast,
+            current_stock=on_hand,
+            below_reorder_point=(forecast["reorder_point"] > 0 and on_hand <= forecast["reorder_point"])
+        ))
+    return result
+
+@router.post("/replenish", response_model=list[ReplenishmentResponse])
+def trigger_replenishment(
+    current_user = Depends(require_role(["warehouse_manager"])),
+    db: Session = Depends(get_db)
+):
+    # Request stock from the manufacturer for every product at or below its reorder point
+    forecasts = forecasting.get_forecasts(db)
+    created = []
+    for name in forecasts:
+        replenishment = forecasting.check_reorder_point(db, name, forecasts, warehouse_id=current_user.warehouse_id)
+        if replenishment:
+            created.append(replenishment)
+    db.commit()
+    for replenishment in created:
+        db.refresh(replenishment)
+    return created
@@ -1,18 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
-from ..database import get_db
+from ..database import get_db, get_read_db
 from ..dependencies import get_current_user, require_role
-from ..models import Order, ProductStock, User
-from ..schemas import OrderAdminResponse, PaymentRequestResponse
+from ..models import Order, User, Replenishment
+from ..schemas import OrderAdminResponse, PaymentRequestResponse, ReplenishmentResponse
 from sqlalchemy.orm import joinedload
+from datetime import datetime
+from .. import inventory, metrics, versioning
 
 router = APIRouter(prefix="/manufacturer", tags=["Manufacturer"])
 
 @router.get("/stock-requests", response_model=list[OrderAdminResponse])
 def get_stock_requests(
+    request: Request,
     current_user = Depends(require_role(["manufacturer"])),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
+    return versioning.conditional_response(
+        request, db, [versioning.ORDERS], current_user.role, lambda: _stock_requests(db)
+    )
+
+def _stock_requests(db: Session):
     orders = (
         db.query(Order, User.username)
         .options(joinedload(Order.payments))
@@ -53,7 +61,7 @@ def request_payment(
     current_user = Depends(require_role(["manufacturer"])),
     db: Session = Depends(get_db)
 ):
-    order = db.query(Order).filter(Order.id == order_id).first()
+    order = db.query(Order).filter(Order.id == order_id).with_for_update().first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
@@ -77,7 +85,9 @@ def request_payment(
     # Let's just update the status to payment_requested.
     
     order.status = "payment_requested"
+    versioning.bump(db, versioning.ORDERS)
     db.commit()
+    metrics.order_transition("stock_requested", "payment_requested")
     db.refresh(order)
     return {
         "message": "Payment requested from warehouse manager successfully",
@@ -93,30 +103,77 @@ def ship_stock(
     current_user = Depends(require_role(["manufacturer"])),
     db: Session = Depends(get_db)
 ):
-    order = db.query(Order).filter(Order.id == order_id).first()
+    order = db.query(Order).filter(Order.id == order_id).with_for_update().first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
     if order.status != "paid_to_manufacturer":
         raise HTTPException(status_code=400, detail="Order is not paid by warehouse yet")
 
-    # Increase stock in warehouse
-    stock = db.query(ProductStock).filter(ProductStock.product_name == order.product_name).first()
-    if not stock:
-        stock = ProductStock(product_name=order.product_name, quantity=0)
-        db.add(stock)
-    
-    stock.quantity += order.quantity
+    # Increase stock in the warehouse that will dispatch the order
+    if order.warehouse_id is None:
+        order.warehouse_id = inventory.default_warehouse(db).id
+    stock = inventory.receive(db, order.warehouse_id, order.product_name, order.quantity)
+    new_stock_quantity = stock.quantity
     
     # After shipping to warehouse, the order returns to 'confirmed' status 
     # so the warehouse manager can now 'dispatch' it to the salesman.
     order.status = "confirmed"
+    warehouse_id = order.warehouse_id
+    versioning.bump(db, versioning.ORDERS, versioning.STOCK)
     
     db.commit()
-    db.refresh(order)
+    metrics.order_transition("paid_to_manufacturer", "confirmed")
 
     return {
         "message": "Stock shipped to warehouse successfully",
-        "order_id": order.id,
-        "new_stock_quantity": stock.quantity
+        "order_id": order_id,
+        "warehouse_id": warehouse_id,
+        "new_stock_quantity": new_stock_quantity
+    }
+
+
+@router.get("/replenishments", response_model=list[ReplenishmentResponse])
+def get_replenishments(
+    request: Request,
+    current_user = Depends(require_role(["manufacturer", "warehouse_manager"])),
+    db: Session = Depends(get_read_db)
+):
+    # Forecast-driven stock requests, open ones first
+    return versioning.conditional_response(
+        request, db, [versioning.REPLENISHMENTS], current_user.role,
+        lambda: [
+            ReplenishmentResponse.model_validate(r)
+            for r in db.query(Replenishment).order_by(Replenishment.status, Replenishment.created_at.desc()).all()
+        ]
+    )
+
+@router.post("/ship-replenishment/{replenishment_id}")
+def ship_replenishment(
+    replenishment_id: int,
+    current_user = Depends(require_role(["manufacturer"])),
+    db: Session = Depends(get_db)
+):
+    replenishment = db.query(Replenishment).filter(Replenishment.id == replenishment_id).with_for_update().first()
+    if not replenishment:
+        raise HTTPException(status_code=404, detail="Replenishment not found")
+
+    if replenishment.status != "requested":
+        raise HTTPException(status_code=400, detail="Replenishment has already been shipped")
+
+    if replenishment.warehouse_id is None:
+        replenishment.warehouse_id = inventory.default_warehouse(db).id
+    stock = inventory.receive(db, replenishment.warehouse_id, replenishment.product_name, replenishment.quantity)
+    new_stock_quantity = stock.quantity
+    replenishment.status = "shipped"
+    replenishment.shipped_at = datetime.utcnow()
+    versioning.bump(db, versioning.REPLENISHMENTS, versioning.STOCK)
+
+    db.commit()
+
+    return {
+        "message": "Replenishment shipped to warehouse successfully",
+        "replenishment_id": replenishment.id,
+        "warehouse_id": replenishment.warehouse_id,
+        "new_stock_quantity": new_stock_quantity
     }
@@ -1,15 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy.orm import joinedload
-from ..database import get_db
+from ..database import get_db, get_read_db
 from ..dependencies import get_current_user, require_role
 from ..models import Order, Payment, ProductStock
 from ..schemas import OrderCreate, OrderResponse
-import io
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
+from ..money import MINOR_UNITS, to_minor
+from .. import archive, encoding, ledger, metrics, versioning
 
 router = APIRouter(prefix="/orders", tags=["Orders"])
 
@@ -28,16 +26,18 @@ def place_order(
             status_code=400,
             detail="Invalid product name."
         )
-    total_amount = order_in.quantity * product_prices[order_in.product_name]
+    # Exact arithmetic in paise
+    total_minor = order_in.quantity * product_prices[order_in.product_name] * MINOR_UNITS
+    advance_minor = to_minor(order_in.advance_payment)
 
-    if order_in.advance_payment > total_amount * 0.6:
+    if advance_minor * 10 > total_minor * 6:
         raise HTTPException(
             status_code=400,
             detail="Advance payment cannot exceed 60% of total amount."
         )
 
-    remaining_payment = total_amount - order_in.advance_payment
-    if remaining_payment < 0:
+    remaining_minor = total_minor - advance_minor
+    if remaining_minor < 0:
         raise HTTPException(
             status_code=400,
             detail="Advance payment cannot exceed total amount."
@@ -47,106 +47,57 @@ def place_order(
         user_id=current_user.id,
         product_name=order_in.product_name,
         quantity=order_in.quantity,
-        total_amount=total_amount,
-        advance_payment=order_in.advance_payment,
-        remaining_payment=remaining_payment
+        total_amount_minor=total_minor,
+        advance_payment_minor=advance_minor,
+        remaining_payment_minor=remaining_minor,
+        warehouse_id=current_user.warehouse_id
     )
     db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
-    
-    # CREATE advance payment
-    if order_in.advance_payment > 0:
-        advance_payment = Payment(
+    db.flush()
+
+    # CREATE advance payment, in the same transaction as the order and the balance update
+    if advance_minor > 0:
+        db.add(Payment(
             order_id=db_order.id,
-            amount=order_in.advance_payment,
+            amount_minor=advance_minor,
             payment_type="advance"
-        )
-        db.add(advance_payment)
-        db.commit()
-        db.refresh(db_order)
+        ))
+    ledger.add(db, current_user.id, billed_minor=total_minor, paid_minor=advance_minor)
+    versioning.bump(db, versioning.ORDERS)
+    db.commit()
+    db.refresh(db_order)
+    metrics.order_transition(None, "placed")
     return db_order
 
 @router.get("/my-orders", response_model=list[OrderResponse])
 def get_my_orders(
+    request: Request,
     current_user = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    orders = db.query(Order).options(joinedload(Order.payments)).filter(Order.user_id == current_user.id).all()
+    # Includes orders already moved to the archive
+    orders = archive.orders_for_user(db, current_user.id)
     for order in orders:
-        order.fully_paid = (order.remaining_payment == 0)
-    return orders
+        order.fully_paid = (order.remaining_payment_minor == 0)
+    return encoding.render(request, [OrderResponse.model_validate(order) for order in orders])
 
 @router.get("/{order_id}/invoice")
 def generate_invoice(
     order_id: int,
     current_user = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    print(f"DEBUG: Generating invoice. OrderID: {order_id}, UserID: {current_user.id}")
-    order = db.query(Order).options(joinedload(Order.payments)).filter(
-        Order.id == order_id
-    ).first()
+    order = archive.find_order(db, order_id)
 
     if not order:
-        print("DEBUG: Order not found in DB at all.")
         raise HTTPException(status_code=404, detail="Order not found")
     
-    print(f"DEBUG: Order found. OrderUserID: {order.user_id}")
     if order.user_id != current_user.id:
-        print("DEBUG: User mismatch.")
         raise HTTPException(status_code=404, detail="Order not found (user mismatch)")
 
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    
-    # Header
-    c.setFont("Helvetica-Bold", 24)
-    c.drawString(50, 750, "INVOICE")
-    
-    c.setFont("Helvetica", 12)
-    c.drawString(50, 730, f"Order ID: #{order.id}")
-    c.drawString(50, 715, f"Date: {order.created_at.strftime('%Y-%m-%d %H:%M')}")
-    c.drawString(50, 700, f"Customer: {current_user.username}")
-    
-    # Line
-    c.setStrokeColor(colors.grey)
-    c.line(50, 680, 550, 680)
-    
-    # Order Details
-    y = 650
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(50, y, "Item")
-    c.drawString(300, y, "Quantity")
-    c.drawString(450, y, "Total")
-    
-    y -= 30
-    c.setFont("Helvetica", 12)
-    c.drawString(50, y, order.product_name)
-    c.drawString(300, y, str(order.quantity))
-    c.drawString(450, y, f"Rs {order.total_amount:.2f}")
-
-    # Payment Details
-    y -= 50
-    c.line(50, y, 550, y)
-    y -= 30
-    
-    c.drawString(350, y, "Total Amount:")
-    c.drawString(450, y, f"Rs {order.total_amount:.2f}")
-    y -= 20
-    c.drawString(350, y, "Advance Paid:")
-    c.drawString(450, y, f"Rs {order.advance_payment:.2f}")
-    y -= 20
-    c.drawString(350, y, "Remaining Due:")
-    c.drawString(450, y, f"Rs {order.remaining_payment:.2f}")
-    y -= 20
-    
-    # Status
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(50, y, f"Status: {order.status.upper()}")
-
-    c.save()
-    buffer.seek(0)
+    # reportlab is heavy; load it on the first invoice
+    from .. import invoices
+    buffer = invoices.customer_invoice(order, current_user.username)
     
     return StreamingResponse(
         buffer, 
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
 from sqlalchemy.orm import joinedload
-from ..database import get_db
+from ..database import get_db, get_read_db
 from ..dependencies import get_current_user, require_role
 from ..models import Order, User, Payment
 from ..schemas import OrderAdminResponse, ConfirmOrderInput, DeliverOrderInput
+from ..money import to_minor
+from .. import ledger, metrics, versioning
 
 
 
@@ -13,9 +15,15 @@ router = APIRouter(prefix="/salesman", tags=["Salesman"])
 
 @router.get("/pending-orders", response_model=list[OrderAdminResponse])
 def get_pending_orders(
+    request: Request,
     current_user = Depends(require_role(["salesman"])),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
+    return versioning.conditional_response(
+        request, db, [versioning.ORDERS], current_user.role, lambda: _pending_orders(db)
+    )
+
+def _pending_orders(db: Session):
     # Salesman sees 'placed' orders to confirm, and 'dispatched' orders to deliver
     orders = (
         db.query(Order, User.username)
@@ -52,7 +60,7 @@ def confirm_order(
     current_user = Depends(require_role(["salesman"])),
     db: Session = Depends(get_db)
 ):
-    order = db.query(Order).filter(Order.id == input_data.order_id).first()
+    order = db.query(Order).filter(Order.id == input_data.order_id).with_for_update().first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
@@ -80,8 +88,10 @@ def confirm_order(
 
     # Confirm the order
     order.status = "confirmed"
+    versioning.bump(db, versioning.ORDERS)
     #order.remaining_payment = 0  # Now fully paid
     db.commit()
+    metrics.order_transition("placed", "confirmed")
     db.refresh(order)
 
     return {
@@ -96,32 +106,35 @@ def deliver_order(
     current_user = Depends(require_role(["salesman"])),
     db: Session = Depends(get_db)
 ):
-    order = db.query(Order).filter(Order.id == input_data.order_id).first()
+    order = db.query(Order).filter(Order.id == input_data.order_id).with_for_update().first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
     if order.status != "dispatched":
         raise HTTPException(status_code=400, detail="Order must be dispatched before delivery")
     
-    if input_data.collected_amount != order.remaining_payment:
+    collected_minor = to_minor(input_data.collected_amount)
+    if collected_minor != order.remaining_payment_minor:
         raise HTTPException(
             status_code=400, 
             detail=f"Incorrect payment. Expected: {order.remaining_payment}, Got: {input_data.collected_amount}"
         )
 
     # Record final payment
-    if input_data.collected_amount > 0:
+    if collected_minor > 0:
         payment = Payment(
             order_id=order.id,
-            amount=input_data.collected_amount,
+            amount_minor=collected_minor,
             payment_type="remaining"
         )
         db.add(payment)
+        ledger.add(db, order.user_id, paid_minor=collected_minor)
     
-    order.remaining_payment = 0
+    order.remaining_payment_minor = 0
     order.status = "delivered"
+    versioning.bump(db, versioning.ORDERS)
     
     db.commit()
-    db.refresh(order)
+    metrics.order_transition("dispatched", "delivered")
     
-    return {"message": "Order delivered and paid successfully!", "order_id": order.id}
\ No newline at end of file
+    return {"message": "Order delivered and paid successfully!", "order_id": input_data.order_id}
\ No newline at end of file
@@ -1,14 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from ..database import get_db
+from ..database import get_db, get_read_db
 from ..dependencies import get_current_user, require_role
-from ..models import Order, ProductStock, User  # ← Changed Stock → ProductStock
-from ..schemas import OrderAdminResponse, StockAction, StockResponse, delivered, PayManufacturerInput
-import io
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
+from ..models import Order, ProductStock, StockTransfer, User, Warehouse  # ← Changed Stock → ProductStock
+from ..schemas import (
+    OrderAdminResponse, OrderSearchPage, OrderStatus, OrderSearchResult, StockAction, StockResponse, StockTransferCreate,
+    StockTransferResponse, WarehouseCreate, WarehouseResponse, delivered, PayManufacturerInput
+)
+from .. import archive, forecasting, inventory, jobs, metrics, search, versioning
 
 router = APIRouter(prefix="/warehouse", tags=["Warehouse Manager"])
 
@@ -18,18 +20,43 @@ MANUFACTURER_PRICES = {
     "cold_drinks": 40, "chewing_gums": 25, "juices": 100, "jelly": 60 
 }
 
+# Managers with a warehouse_id only see and act on their own warehouse; orders not yet
+# assigned to a warehouse are visible to every manager
+def _scoped(query, column, current_user):
+    if current_user.warehouse_id is None:
+        return query
+    return query.filter((column == current_user.warehouse_id) | (column.is_(None)))
+
+def _cache_scope(current_user) -> str:
+    return f"{current_user.role}:{current_user.warehouse_id or 'all'}"
+
+def _check_scope(order: Order, current_user):
+    if current_user.warehouse_id is not None and order.warehouse_id not in (None, current_user.warehouse_id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Order belongs to another warehouse")
+
+def _origin(db: Session, order: Order, current_user) -> Warehouse:
+    warehouse_id = order.warehouse_id or current_user.warehouse_id
+    warehouse = db.get(Warehouse, warehouse_id) if warehouse_id else None
+    return warehouse or inventory.default_warehouse(db)
+
 @router.get("/pending-actions", response_model=list[OrderAdminResponse])
 def get_pending_actions(
+    request: Request,
     current_user = Depends(require_role(["warehouse_manager"])),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
+    return versioning.conditional_response(
+        request, db, [versioning.ORDERS], _cache_scope(current_user), lambda: _pending_actions(db, current_user)
+    )
+
+def _pending_actions(db: Session, current_user):
     # Manager needs to see confirmed orders AND payment requests from manufacturer
-    orders = (
+    orders = _scoped(
         db.query(Order, User.username)
         .join(User, Order.user_id == User.id)
-        .filter(Order.status.in_(["confirmed", "payment_requested", "paid_to_manufacturer", "stock_requested"]))
-        .all()
-    )
+        .filter(Order.status.in_(["confirmed", "payment_requested", "paid_to_manufacturer", "stock_requested"])),
+        Order.warehouse_id, current_user
+    ).all()
 
     result = []
     for order, username in orders:
@@ -58,31 +85,43 @@ def process_order(
     current_user = Depends(require_role(["warehouse_manager"])),
     db: Session = Depends(get_db)
 ):
-    order = db.query(Order).filter(Order.id == action_data.order_id).first()
+    order = db.query(Order).filter(Order.id == action_data.order_id).with_for_update().first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
-    
-    stock = db.query(ProductStock).filter(ProductStock.product_name == order.product_name).first()
+    _check_scope(order, current_user)
 
     if action_data.action == "dispatch":
         if order.status != "confirmed":
             raise HTTPException(status_code=400, detail="Order must be confirmed before dispatch")
-            
-        if not stock or stock.quantity < order.quantity:
+
+        # The order's warehouse first, then the nearest ones
+        origin = _origin(db, order, current_user)
+        try:
+            allocations = inventory.allocate(db, order.product_name, order.quantity, origin)
+        except inventory.InsufficientStock as e:
             raise HTTPException(
                 status_code=400,
-                detail=f"Insufficient stock for {order.product_name}. Available: {stock.quantity if stock else 0}, Required: {order.quantity}"
+                detail=f"Insufficient stock for {order.product_name}. Available: {e.available}, Required: {order.quantity}"
             )
-        
-        stock.quantity -= order.quantity
+
+        remaining_stock = next((s.quantity for s, _ in allocations if s.warehouse_id == origin.id), 0)
+        allocated = [{"warehouse_id": s.warehouse_id, "quantity": taken} for s, taken in allocations]
+        # The order stays with its depot even when other depots supplied some or all of it
+        order.warehouse_id = origin.id
         order.status = "dispatched"
+        versioning.bump(db, versioning.ORDERS, versioning.STOCK)
+        if forecasting.AUTO_REPLENISH:
+            # Ask the manufacturer for more before the next dispatch fails; forecasting runs after the response
+            jobs.enqueue(db, "reorder_check", {"product_name": order.product_name, "warehouse_id": origin.id})
         db.commit()
+        metrics.order_transition("confirmed", "dispatched")
         db.refresh(order)
 
         return {
             "message": "Order dispatched successfully to salesman",
             "order_id": order.id,
-            "remaining_stock": stock.quantity
+            "remaining_stock": remaining_stock,
+            "allocations": allocated
         }
 
     elif action_data.action == "request_stock":
@@ -90,7 +129,9 @@ def process_order(
             raise HTTPException(status_code=400, detail="Can only request stock for confirmed orders")
             
         order.status = "stock_requested"
+        versioning.bump(db, versioning.ORDERS)
         db.commit()
+        metrics.order_transition("confirmed", "stock_requested")
         db.refresh(order)
 
         return {
@@ -104,112 +145,215 @@ def pay_manufacturer(
     current_user = Depends(require_role(["warehouse_manager"])),
     db: Session = Depends(get_db)
 ):
-    order = db.query(Order).filter(Order.id == input_data.order_id).first()
+    order = db.query(Order).filter(Order.id == input_data.order_id).with_for_update().first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
+    _check_scope(order, current_user)
     
     if order.status != "payment_requested":
         raise HTTPException(status_code=400, detail="No payment requested for this order")
     
     # Record the payment logic
     order.status = "paid_to_manufacturer"
+    versioning.bump(db, versioning.ORDERS)
     db.commit()
+    metrics.order_transition("payment_requested", "paid_to_manufacturer")
     db.refresh(order)
     
     return {"message": "Payment sent to manufacturer successfully", "order_id": order.id}
 
 @router.get("/stock", response_model=list[StockResponse])
 def get_stock(
+    request: Request,
     current_user = Depends(require_role(["warehouse_manager"])),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    all_stock = db.query(ProductStock).all()
+    return versioning.conditional_response(
+        request, db, [versioning.STOCK], _cache_scope(current_user), lambda: _stock_levels(db, current_user)
+    )
+
+def _stock_levels(db: Session, current_user):
+    # Each depot's dashboard reads only its own rows
+    query = db.query(ProductStock)
+    if current_user.warehouse_id is not None:
+        query = query.filter(ProductStock.warehouse_id == current_user.warehouse_id)
     results = []
-    for stock in all_stock:
-        results.append(StockResponse(item_name=stock.product_name, quantity=stock.quantity, id=stock.id))
+    for stock in query.order_by(ProductStock.warehouse_id, ProductStock.product_name).all():
+        results.append(StockResponse(
+            item_name=stock.product_name, quantity=stock.quantity, id=stock.id, warehouse_id=stock.warehouse_id
+        ))
     return results
 
 
 @router.get("/delivered-orders", response_model=list[delivered])
 def get_delivered_orders(
+    request: Request,
     current_user = Depends(require_role(["warehouse_manager"])),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    orders = db.query(Order).filter(Order.status == "delivered").all()
+    return versioning.conditional_response(
+        request, db, [versioning.ORDERS], _cache_scope(current_user), lambda: _delivered_orders(db, current_user)
+    )
+
+def _delivered_orders(db: Session, current_user):
+    orders = _scoped(db.query(Order).filter(Order.status == "delivered"), Order.warehouse_id, current_user).all()
     result = []
     for order in orders:
         result.append(delivered(order_id=order.id, product_name=order.product_name, quantity=order.quantity))
     return result
 
+@router.get("/orders/search", response_model=OrderSearchPage)
+def search_orders(
+    q: Optional[str] = Query(None, max_length=100, description="Order ID or ID prefix, username or product words"),
+    order_status: Optional[list[OrderStatus]] = Query(None, alias="status"),
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    current_user = Depends(require_role(["warehouse_manager"])),
+    db: Session = Depends(get_read_db)
+):
+    # One extra row tells whether there is a next page without counting every match
+    rows = search.search_orders(
+        db, q, order_status, created_from, created_to, limit=page_size + 1, offset=(page - 1) * page_size,
+        scope=lambda query: _scoped(query, Order.warehouse_id, current_user)
+    )
+    results = [
+        OrderSearchResult(
+            id=order.id,
+            user_id=order.user_id,
+            username=username,
+            product_name=order.product_name,
+            quantity=order.quantity,
+            total_amount=order.total_amount,
+            remaining_payment=order.remaining_payment,
+            status=order.status,
+            created_at=order.created_at
+        )
+        for order, username in rows[:page_size]
+    ]
+    return OrderSearchPage(results=results, page=page, page_size=page_size, has_more=len(rows) > page_size)
+
 @router.get("/{order_id}/invoice")
 def generate_manufacturer_invoice(
     order_id: int,
     current_user = Depends(require_role(["warehouse_manager", "manufacturer"])),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    order = db.query(Order).filter(Order.id == order_id).first()
+    order = archive.find_order(db, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
     # Calculate wholesale amount
     m_price = order.quantity * MANUFACTURER_PRICES.get(order.product_name, 0)
 
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    
-    # Header
-    c.setFont("Helvetica-Bold", 24)
-    c.drawString(50, 750, "STOCK SUPPLY INVOICE")
-    
-    c.setFont("Helvetica", 12)
-    c.drawString(50, 730, f"Stock Request ID: #{order.id}")
-    c.drawString(50, 715, f"Date: {order.created_at.strftime('%Y-%m-%d %H:%M')}")
-    c.drawString(50, 700, f"From: Manufacturer")
-    c.drawString(50, 685, f"To: Warehouse Manager")
-    
-    # Line
-    c.setStrokeColor(colors.grey)
-    c.line(50, 665, 550, 665)
-    
-    # Order Details
-    y = 630
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(50, y, "Item")
-    c.drawString(300, y, "Quantity")
-    c.drawString(450, y, "Wholesale Total")
-    
-    y -= 30
-    c.setFont("Helvetica", 12)
-    c.drawString(50, y, order.product_name.replace("_", " ").title())
-    c.drawString(300, y, str(order.quantity))
-    c.drawString(450, y, f"INR {m_price:.2f}")
-
-    # Payment Details
-    y -= 50
-    c.line(50, y, 550, y)
-    y -= 30
-    
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(350, y, "TOTAL DUE:")
-    c.drawString(450, y, f"Rs {m_price:.2f}")
-    y -= 30
-    
-    # Status
-    # Based on our logic, if status is 'paid_to_manufacturer' or later, it's paid.
-    payment_status = "PENDING PAYMENT"
-    if order.status in ["paid_to_manufacturer", "dispatched", "delivered", "confirmed"]:
-        if order.status != "stock_requested" and order.status != "payment_requested":
-             payment_status = "PAID"
-             
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(50, y, f"Status: {payment_status}")
-    c.drawString(50, y-20, f"Workflow State: {order.status.upper()}")
-
-    c.save()
-    buffer.seek(0)
+    # reportlab is heavy; load it on the first invoice
+    from .. import invoices
+    buffer = invoices.stock_supply_invoice(order, m_price)
     
     return StreamingResponse(
         buffer, 
         media_type="application/pdf", 
         headers={"Content-Disposition": f"attachment; filename=stock_invoice_{order.id}.pdf"}
     )
+
+
+# Warehouses and stock transfers
+
+@router.get("/warehouses", response_model=list[WarehouseResponse])
+def list_warehouses(
+    current_user = Depends(require_role(["warehouse_manager", "manufacturer"])),
+    db: Session = Depends(get_read_db)
+):
+    return db.query(Warehouse).order_by(Warehouse.id).all()
+
+@router.post("/warehouses", response_model=WarehouseResponse)
+def create_warehouse(
+    warehouse_in: WarehouseCreate,
+    current_user = Depends(require_role(["warehouse_manager"])),
+    db: Session = Depends(get_db)
+):
+    # Only managers not tied to a depot (head office) open new ones
+    if current_user.warehouse_id is not None:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Operation not permitted")
+    if db.query(Warehouse).filter(Warehouse.code == warehouse_in.code).first():
+        raise HTTPException(status_code=400, detail="Warehouse code already exists")
+    warehouse = Warehouse(**warehouse_in.model_dump())
+    db.add(warehouse)
+    db.commit()
+    db.refresh(warehouse)
+    return warehouse
+
+@router.get("/transfers", response_model=list[StockTransferResponse])
+def list_transfers(
+    current_user = Depends(require_role(["warehouse_manager"])),
+    db: Session = Depends(get_read_db)
+):
+    query = db.query(StockTransfer)
+    if current_user.warehouse_id is not None:
+        query = query.filter(
+            (StockTransfer.from_warehouse_id == current_user.warehouse_id)
+            | (StockTransfer.to_warehouse_id == current_user.warehouse_id)
+        )
+    return query.order_by(StockTransfer.status, StockTransfer.created_at.desc()).all()
+
+@router.post("/transfers", response_model=StockTransferResponse)
+def create_transfer(
+    transfer_in: StockTransferCreate,
+    current_user = Depends(require_role(["warehouse_manager"])),
+    db: Session = Depends(get_db)
+):
+    from_id = transfer_in.from_warehouse_id or current_user.warehouse_id
+    if from_id is None:
+        raise HTTPException(status_code=400, detail="from_warehouse_id is required")
+    if current_user.warehouse_id is not None and from_id != current_user.warehouse_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Can only send stock from your own warehouse")
+    if transfer_in.quantity <= 0:
+        raise HTTPException(status_code=400, detail="Quantity must be positive")
+    if from_id == transfer_in.to_warehouse_id:
+        raise HTTPException(status_code=400, detail="Source and destination must differ")
+    if db.get(Warehouse, from_id) is None or db.get(Warehouse, transfer_in.to_warehouse_id) is None:
+        raise HTTPException(status_code=404, detail="Warehouse not found")
+
+    # Stock leaves the source now and arrives when the destination receives it
+    try:
+        inventory.take(db, from_id, transfer_in.product_name, transfer_in.quantity)
+    except inventory.InsufficientStock as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Insufficient stock for {transfer_in.product_name}. Available: {e.available}, Required: {transfer_in.quantity}"
+        )
+    transfer = StockTransfer(
+        product_name=transfer_in.product_name,
+        quantity=transfer_in.quantity,
+        from_warehouse_id=from_id,
+        to_warehouse_id=transfer_in.to_warehouse_id,
+        requested_by=current_user.id
+    )
+    db.add(transfer)
+    versioning.bump(db, versioning.STOCK)
+    db.commit()
+    db.refresh(transfer)
+    return transfer
+
+@router.post("/transfers/{transfer_id}/receive", response_model=StockTransferResponse)
+def receive_transfer(
+    transfer_id: int,
+    current_user = Depends(require_role(["warehouse_manager"])),
+    db: Session = Depends(get_db)
+):
+    transfer = db.query(StockTransfer).filter(StockTransfer.id == transfer_id).with_for_update().first()
+    if not transfer:
+        raise HTTPException(status_code=404, detail="Transfer not found")
+    if current_user.warehouse_id is not None and transfer.to_warehouse_id != current_user.warehouse_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Transfer is for another warehouse")
+    if transfer.status != "in_transit":
+        raise HTTPException(status_code=400, detail="Transfer has already been received")
+
+    inventory.receive(db, transfer.to_warehouse_id, transfer.product_name, transfer.quantity)
+    transfer.status = "received"
+    transfer.received_at = datetime.utcnow()
+    versioning.bump(db, versioning.STOCK)
+    db.commit()
+    db.refresh(transfer)
+    return transfer
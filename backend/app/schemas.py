@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, model_validator
 from typing import Literal
 from datetime import datetime
 from typing import Optional
@@ -8,6 +8,7 @@ class UserBase(BaseModel):
     username: str
     email: EmailStr
     role: Literal["shopkeeper", "salesman", "warehouse_manager", "manufacturer"]
+    warehouse_id: Optional[int] = None  # managers: where they work; shopkeepers: who supplies them
 
 #For creating a user (registration)
 class UserCreate(UserBase):
@@ -24,6 +25,13 @@ class UserResponse(UserBase):
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None  # access token lifetime in seconds
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+OrderStatus = Literal["placed", "confirmed", "dispatched", "delivered", "stock_requested", "payment_requested", "paid_to_manufacturer"]
 
 class OrderBase(BaseModel):
     total_amount: float
@@ -66,6 +74,7 @@ class StockResponse(BaseModel):
     id: int
     item_name: str
     quantity: int
+    warehouse_id: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -117,3 +126,165 @@ class DeliverOrderInput(BaseModel):
 
         
 
+
+class DemandForecastResponse(BaseModel):
+    product_name: str
+    daily_demand_sma: float
+    daily_demand_ewma: float
+    demand_std: float
+    reorder_point: int
+    days_with_demand: int
+
+class ReorderPointResponse(DemandForecastResponse):
+    current_stock: int
+    below_reorder_point: bool
+
+class ReplenishmentResponse(BaseModel):
+    id: int
+    product_name: str
+    quantity: int
+    reorder_point: int
+    status: str
+    created_at: datetime
+    shipped_at: Optional[datetime] = None
+    warehouse_id: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+
+# Bulk import rows (app/bulk_import.py)
+
+class UserImport(UserBase):
+    id: Optional[int] = None
+    password: Optional[str] = None
+    hashed_password: Optional[str] = None  # bcrypt hash from the legacy system, stored as is
+
+    @model_validator(mode="after")
+    def check_password(self):
+        if not self.password and not self.hashed_password:
+            raise ValueError("password or hashed_password is required")
+        return self
+
+class PaymentImport(BaseModel):
+    id: Optional[int] = None
+    order_id: Optional[int] = None  # taken from the enclosing order when nested
+    amount: float
+    payment_type: Literal["advance", "remaining", "stock_supply"]
+    paid_at: Optional[datetime] = None
+
+class OrderImport(OrderCreate):
+    id: Optional[int] = None
+    user_id: Optional[int] = None
+    username: Optional[str] = None
+    total_amount: float
+    remaining_payment: Optional[float] = None
+    status: OrderStatus
+    created_at: Optional[datetime] = None
+    payments: list[PaymentImport] = []
+
+    @model_validator(mode="after")
+    def check_order(self):
+        if self.user_id is None and not self.username:
+            raise ValueError("user_id or username is required")
+        if self.remaining_payment is None:
+            self.remaining_payment = self.total_amount - (self.advance_payment or 0.0)
+        if self.remaining_payment < 0:
+            raise ValueError("advance_payment exceeds total_amount")
+        return self
+
+class StockImport(BaseModel):
+    product_name: str
+    quantity: int
+    warehouse_id: Optional[int] = None  # default warehouse when missing
+
+
+# Warehouses and transfers (app/inventory.py)
+
+class WarehouseCreate(BaseModel):
+    code: str
+    name: str
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+
+class WarehouseResponse(WarehouseCreate):
+    id: int
+
+    class Config:
+        from_attributes = True
+
+class StockTransferCreate(BaseModel):
+    product_name: Literal["candy", "snacks", "chocolates", "biscuits", "cold_drinks", "chewing_gums", "juices", "jelly"]
+    quantity: int
+    to_warehouse_id: int
+    from_warehouse_id: Optional[int] = None  # the manager's own warehouse when missing
+
+class StockTransferResponse(BaseModel):
+    id: int
+    product_name: str
+    quantity: int
+    from_warehouse_id: int
+    to_warehouse_id: int
+    status: str
+    requested_by: int
+    created_at: datetime
+    received_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+# Shopkeeper accounts (app/ledger.py); amounts in rupees
+
+class AccountBalanceResponse(BaseModel):
+    user_id: int
+    username: str
+    billed: float
+    paid: float
+    outstanding: float
+    updated_at: Optional[datetime] = None
+
+class StatementEntry(BaseModel):
+    date: datetime
+    entry_type: Literal["order", "payment"]
+    order_id: int
+    description: str
+    debit: float
+    credit: float
+    balance: float
+
+class AgingBuckets(BaseModel):
+    current: float      # up to 30 days old
+    days_31_60: float
+    days_61_90: float
+    over_90: float
+
+class AccountStatement(BaseModel):
+    user_id: int
+    username: str
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    opening_balance: float
+    closing_balance: float
+    outstanding: float
+    aging: AgingBuckets
+    entries: list[StatementEntry]
+
+# Order search (app/search.py)
+
+class OrderSearchResult(BaseModel):
+    id: int
+    user_id: int
+    username: str
+    product_name: str
+    quantity: int
+    total_amount: float
+    remaining_payment: float
+    status: str
+    created_at: Optional[datetime] = None
+
+class OrderSearchPage(BaseModel):
+    results: list[OrderSearchResult]
+    page: int
+    page_size: int
+    has_more: bool
@@ -0,0 +1,174 @@
+"""Order search for managers.
+
+Every word of the query must match the order in one of three ways:
+
+- all digits: the order ID, or IDs starting with those digits,
+- a word of the shopkeeper's username, by prefix,
+- a word of the product name, by prefix.
+
+Usernames are matched through a full-text index: FULLTEXT on MySQL, an FTS5
+table kept in sync by triggers on SQLite (plain prefix ranges on the unique
+username index where FTS5 is missing). Each word resolves to a handful of
+user IDs or product names first, and orders are then read through the
+(user_id, created_at), (product_name, created_at), (status, created_at) or
+(created_at) indexes, newest first.
+
+Ranking: the order whose ID is the query comes first, then the orders of the
+shopkeeper whose username is the query, then the rest, newest first. The
+first two are only sorted on when they exist, so broad searches (a status, a
+product) stay index scans without a sort.
+"""
+import re
+from datetime import datetime
+from typing import get_args
+
+from sqlalchemy import column, false, func, or_, select, table, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from .models import Order, User
+from .schemas import OrderCreate
+
+MAX_TERMS = 5
+# orders.id is a signed 32-bit INT on MySQL; larger numbers cannot be an order ID
+MAX_ORDER_ID = 2**31 - 1
+PRODUCTS = get_args(OrderCreate.model_fields["product_name"].annotation)
+users_fts = table("users_fts", column("rowid"), column("username"))
+
+
+def create_fulltext(conn: Connection):
+    """Full-text index on usernames: FULLTEXT on MySQL, an FTS5 table plus triggers on SQLite."""
+    if conn.dialect.name == "mysql":
+        indexes = {i["name"] for i in conn.dialect.get_indexes(conn, "users")}
+        if "ft_users_username" not in indexes:
+            # InnoDB cannot build FULLTEXT with LOCK=NONE; users is small enough for a short lock
+            conn.execute(text("ALTER TABLE users ADD FULLTEXT INDEX ft_users_username (username)"))
+        return
+    if conn.dialect.name != "sqlite" or not _fts5_available(conn):
+        return
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+        "username, content='users', content_rowid='id', tokenize='unicode61')"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN "
+        "INSERT INTO users_fts (rowid, username) VALUES (new.id, new.username); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN "
+        "INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', old.id, old.username); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF username ON users BEGIN "
+        "INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', old.id, old.username); "
+        "INSERT INTO users_fts (rowid, username) VALUES (new.id, new.username); END"
+    ))
+    conn.execute(text("INSERT INTO users_fts (users_fts) VALUES ('rebuild')"))
+
+
+def _fts5_available(conn: Connection) -> bool:
+    return bool(conn.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar())
+
+
+_has_users_fts = None
+
+
+def _sqlite_fts(db: Session) -> bool:
+    global _has_users_fts
+    if _has_users_fts is None:
+        _has_users_fts = db.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'"
+        )).first() is not None
+    return _has_users_fts
+
+
+def _terms(db: Session, q: str) -> list[str]:
+    # Words only: keeps MATCH / AGAINST operators out of user input. "_" is part of a word for
+    # MySQL FULLTEXT and for prefix ranges on whole usernames, but a separator for FTS5's tokenizer
+    if db.bind.dialect.name == "sqlite" and _sqlite_fts(db):
+        q = q.replace("_", " ")
+    return [t for t in re.split(r"[^\w]+", q.lower()) if t][:MAX_TERMS]
+
+
+def _product_matches(term: str) -> list[str]:
+    # cold_drinks is found by "cold", "drinks", "cold_d" and "cold_drinks"
+    return [name for name in PRODUCTS if name.startswith(term) or any(w.startswith(term) for w in name.split("_"))]
+
+
+def _username_prefix(db: Session, prefix: str):
+    if db.bind.dialect.name == "mysql":
+        return User.username.startswith(prefix, autoescape=True)
+    # SQLite's LIKE is case-insensitive and so skips the (binary) index; a range does not
+    return (User.username >= prefix) & (User.username < prefix + "\uffff")
+
+
+def _matching_users(db: Session, term: str):
+    """IDs of users with a username word starting with term, as a subquery."""
+    dialect = db.bind.dialect.name
+    if dialect == "mysql":
+        return select(User.id).where(or_(
+            User.username.match(f"{term}*"), _username_prefix(db, term)
+        ))
+    if dialect == "sqlite" and _sqlite_fts(db):
+        return select(users_fts.c.rowid).where(users_fts.c.username.match(f"{term}*"))
+    return select(User.id).where(_username_prefix(db, term))
+
+
+def _is_number(term: str) -> bool:
+    # isdigit() alone accepts "²" and other digits int() rejects
+    return term.isascii() and term.isdigit()
+
+
+def _id_prefix(term: str, max_id: int):
+    """Orders whose ID starts with the digits of term, as ranges on the primary key."""
+    if term.startswith("0"):
+        return false()
+    low = high = int(term)
+    ranges = []
+    while low <= max_id:
+        ranges.append(Order.id.between(low, high))
+        low, high = low * 10, high * 10 + 9
+    return or_(*ranges) if ranges else false()
+
+
+def search_orders(db: Session, q: str | None = None, statuses: list[str] | None = None,
+                  created_from: datetime | None = None, created_to: datetime | None = None,
+                  limit: int = 20, offset: int = 0, scope=None) -> list:
+    """(order, username) rows matching the query and filters, best match first.
+
+    scope, if given, takes the select and returns it restricted (e.g. to a manager's warehouse).
+    """
+    query = select(Order, User.username).join(User, Order.user_id == User.id)
+    if scope is not None:
+        query = scope(query)
+    if statuses:
+        query = query.where(Order.status.in_(statuses))
+    if created_from is not None:
+        query = query.where(Order.created_at >= created_from)
+    if created_to is not None:
+        query = query.where(Order.created_at < created_to)
+
+    ranking = []
+    terms = _terms(db, q or "")
+    if terms:
+        max_id = None
+        for term in terms:
+            matches = [Order.user_id.in_(_matching_users(db, term))]
+            names = _product_matches(term)
+            if names:
+                matches.append(Order.product_name.in_(names))
+            if _is_number(term):
+                if max_id is None:
+                    max_id = db.execute(select(func.max(Order.id))).scalar() or 0
+                matches.append(_id_prefix(term, max_id))
+            query = query.where(or_(*matches))
+
+        whole = q.strip().lstrip("#")
+        if _is_number(whole) and int(whole) <= MAX_ORDER_ID and db.get(Order, int(whole)) is not None:
+            ranking.append((Order.id == int(whole)).desc())
+        exact_user = db.execute(select(User.id).where(User.username == q.strip())).scalar()
+        if exact_user is not None:
+            ranking.append((Order.user_id == exact_user).desc())
+
+    query = query.order_by(*ranking, Order.created_at.desc(), Order.id.desc()).limit(limit).offset(offset)
+    return db.execute(query).all()
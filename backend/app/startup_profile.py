@@ -0,0 +1,44 @@
+"""Cold-start timing: import, router registration and database readiness.
+
+main.py wraps each startup phase in `timed(...)`; the report is printed once
+the app has started and again when the database becomes ready. For a
+per-module import breakdown run:  python -X importtime -c "import app.main"
+"""
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# main.py imports this module first, so timings start at the first app import
+_process_start = time.perf_counter()
+phases: list[tuple[str, float]] = []
+
+ENABLED = os.getenv("STARTUP_PROFILE", "true").lower() in ("1", "true", "yes")
+
+
+@contextmanager
+def timed(label: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases.append((label, time.perf_counter() - started))
+
+
+def record(label: str, seconds: float):
+    phases.append((label, seconds))
+
+
+def since_start() -> float:
+    return time.perf_counter() - _process_start
+
+
+def report(title: str):
+    if not ENABLED:
+        return
+    lines = [f"Startup profile ({title}, pid {os.getpid()}):"]
+    for label, seconds in phases:
+        lines.append(f"  {label:<40}{seconds * 1000:>9.1f} ms")
+    lines.append(f"  {'total since app import':<40}{since_start() * 1000:>9.1f} ms")
+    lines.append(f"  {'modules loaded':<40}{len(sys.modules):>9}")
+    print("\n".join(lines))
@@ -0,0 +1,132 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Request, Response
+from sqlalchemy import event, insert, update
+from sqlalchemy.orm import Session
+
+from . import encoding
+from .models import CollectionVersion
+
+# Collections whose version is bumped by the writes that change them
+ORDERS = "orders"
+STOCK = "stock"
+REPLENISHMENTS = "replenishments"
+
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "30"))
+RESPONSE_CACHE_MAX_ENTRIES = 256
+# The body depends on the caller (role, warehouse) as well as on the negotiated format
+VARY = "Accept, Accept-Encoding, Authorization"
+
+
+def bump(db: Session, *names: str):
+    """Increment collection versions once the caller's transaction commits.
+
+    The increments run in their own short transaction right after the commit,
+    so writes do not hold the collection_versions row locks (one row per
+    collection, shared by every write) for the length of their transaction.
+    A rolled back transaction bumps nothing.
+    """
+    pending = db.info.get("versioning_bumps")
+    if pending is None:
+        pending = db.info["versioning_bumps"] = set()
+        event.listen(db, "after_commit", _apply_bumps)
+        event.listen(db, "after_rollback", _discard_bumps)
+    pending.update(names)
+
+
+def _apply_bumps(session: Session):
+    pending = session.info["versioning_bumps"]
+    if not pending:
+        return
+    names = sorted(pending)
+    pending.clear()
+    table = CollectionVersion.__table__
+    with session.get_bind().begin() as conn:
+        for name in names:
+            updated = conn.execute(
+                update(table).where(table.c.name == name).values(version=table.c.version + 1)
+            ).rowcount
+            if not updated:
+                conn.execute(insert(table).values(name=name, version=1))
+
+
+def _discard_bumps(session: Session):
+    session.info["versioning_bumps"].clear()
+
+
+def get_versions(db: Session, names: list[str]) -> dict[str, int]:
+    rows = db.query(CollectionVersion.name, CollectionVersion.version).filter(CollectionVersion.name.in_(names)).all()
+    versions = {name: 0 for name in names}
+    versions.update({name: version for name, version in rows})
+    return versions
+
+
+def make_etag(versions: dict[str, int], scope: str, media_type: str, content_encoding: str | None) -> str:
+    """Validator for one representation: the collection versions, whose data it shows, and how it is encoded."""
+    parts = [f"{name}.{version}" for name, version in sorted(versions.items())]
+    parts += [scope, media_type, content_encoding or "identity"]
+    return 'W/"' + hashlib.sha256("\n".join(parts).encode()).hexdigest()[:32] + '"'
+
+
+def _matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison: W/"x" and "x" are the same representation
+    return "*" in candidates or etag in candidates or etag[2:] in candidates
+
+
+class ResponseCache:
+    """Short-lived cache of encoded list payloads keyed by (endpoint, etag)."""
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL_SECONDS, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[float, object]] = OrderedDict()
+        # Sync endpoints run in the threadpool
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def put(self, key: tuple, content):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, content)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+response_cache = ResponseCache()
+
+
+def conditional_response(request: Request, db: Session, collections: list[str], scope: str, build):
+    """Answer a list endpoint with 304, a cached payload, or a freshly built one.
+
+    `scope` names whose view of the collections `build` returns (a role, or a
+    role and warehouse). Versions are read before the data, so a payload is
+    never older than the ETag it is served with. `build` is only called on a
+    cache miss, and the cache holds the already serialized and compressed body
+    per representation.
+    """
+    media_type = encoding.negotiate_media_type(request.headers.get("accept"))
+    content_encoding = encoding.negotiate_encoding(request.headers.get("accept-encoding"))
+    etag = make_etag(get_versions(db, collections), scope, media_type, content_encoding)
+    validators = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": VARY}
+    if _matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=validators)
+
+    key = (request.url.path, etag)
+    cached = response_cache.get(key)
+    if cached is None:
+        cached = encoding.encode(request, build())
+        response_cache.put(key, cached)
+    body, headers = cached
+    return Response(content=body, headers={**headers, **validators})
@@ -0,0 +1,65 @@
+"""Bytes-on-wire and serialize time of list payloads per response format.
+
+Run from backend/:  python -m benchmarks.encoding_benchmark [rows]
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+from app import encoding
+from app.schemas import OrderAdminResponse, PaymentResponse
+
+PRODUCTS = ["candy", "snacks", "chocolates", "biscuits", "cold_drinks", "chewing_gums", "juices", "jelly"]
+STATUSES = ["placed", "confirmed", "dispatched", "stock_requested", "payment_requested"]
+
+
+def sample_orders(n: int) -> list[OrderAdminResponse]:
+    start = datetime(2024, 1, 1)
+    orders = []
+    for i in range(n):
+        created = start + timedelta(minutes=7 * i)
+        quantity = 1 + i % 20
+        total = quantity * 100.0
+        orders.append(OrderAdminResponse(
+            id=i + 1,
+            user_id=1 + i % 250,
+            username=f"shop_{i % 250:04d}",
+            product_name=PRODUCTS[i % len(PRODUCTS)],
+            quantity=quantity,
+            total_amount=total,
+            advance_payment=total * 0.2,
+            remaining_payment=total * 0.8,
+            status=STATUSES[i % len(STATUSES)],
+            manufacturer_price=quantity * 80.0,
+            created_at=created,
+            payments=[PaymentResponse(id=i + 1, amount=total * 0.2, payment_type="advance", paid_at=created)],
+            fully_paid=False,
+        ))
+    return orders
+
+
+def measure(data, media_type, content_encoding, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body, used = encoding.compress(encoding.serialize(data, media_type), content_encoding)
+        best = min(best, time.perf_counter() - started)
+    return len(body), best
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    data = sample_orders(rows)
+    baseline = None
+    print(f"{rows} OrderAdminResponse rows")
+    print(f"{'format':<52}{'bytes':>12}{'vs json':>10}{'ms':>10}")
+    for media_type in encoding.MEDIA_TYPES:
+        for content_encoding in [None, "gzip"] + (["br"] if encoding.brotli else []):
+            size, seconds = measure(data, media_type, content_encoding)
+            baseline = baseline or size
+            label = media_type + (f" + {content_encoding}" if content_encoding else "")
+            print(f"{label:<52}{size:>12}{size / baseline:>9.0%}{seconds * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+# Production launch: gunicorn master + uvicorn workers
+#   gunicorn app.main:app -c gunicorn.conf.py
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn_worker.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2, 8)))
+
+# Import the app once in the master and fork workers from it, so each new
+# worker starts serving without re-importing FastAPI, SQLAlchemy and the routers.
+# Database engines connect lazily, so no connection is shared across the fork.
+preload_app = True
+
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
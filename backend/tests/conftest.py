@@ -0,0 +1,51 @@
+"""Shared fixtures: the app on a throwaway SQLite database, migrated once per test run.
+
+Run from backend/:  pip install -r requirements-dev.txt && python -m pytest
+"""
+import os
+import tempfile
+import uuid
+
+# Before anything imports app.database
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='distributor-tests-')}/test.db"
+os.environ.setdefault("JOBS_INLINE_WORKERS", "0")    # tests run jobs themselves
+os.environ.setdefault("ADMISSION_CONTROL", "false")  # no rate limits between tests
+os.environ.setdefault("STARTUP_PROFILE", "false")
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="session")
+def client():
+    from app.database import db_ready
+    from app.main import app
+
+    with TestClient(app) as c:
+        assert db_ready.wait(30), "migrations did not finish"
+        yield c
+
+
+@pytest.fixture
+def db(client):
+    from app.database import SessionLocal
+
+    with SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture
+def login(client):
+    """login(role, warehouse_id=None, username=None) registers a fresh user and returns (user id, auth headers)."""
+
+    def register_and_login(role: str, warehouse_id: int | None = None, username: str | None = None):
+        username = username or f"{role}-{uuid.uuid4().hex[:8]}"
+        response = client.post("/auth/register", json={
+            "username": username, "email": f"{username}@example.com", "password": "secret123",
+            "role": role, "warehouse_id": warehouse_id,
+        })
+        assert response.status_code == 200, response.text
+        token = client.post("/auth/login", data={"username": username, "password": "secret123"}).json()
+        return response.json()["id"], {"Authorization": f"Bearer {token['access_token']}"}
+
+    return register_and_login
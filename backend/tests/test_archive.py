@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+
+from app import archive
+from app.database import SessionLocal
+from app.models import ArchivedOrder, Order
+
+
+def test_archive_orders_returns_the_count_without_printing(db, login, capsys):
+    user_id, _ = login("shopkeeper")
+    old = datetime.utcnow() - timedelta(days=400)
+    orders = [
+        Order(user_id=user_id, product_name="candy", quantity=1, status="delivered", created_at=old,
+              total_amount=10, advance_payment=10, remaining_payment=0)
+        for _ in range(5)
+    ]
+    db.add_all(orders)
+    db.commit()
+    ids = [order.id for order in orders]
+
+    assert archive.archive_orders(SessionLocal, days=300, dry_run=True) == 5
+    moved = archive.archive_orders(SessionLocal, days=300, batch_size=2, pause=0)
+
+    assert moved == 5
+    assert capsys.readouterr().out == ""
+    db.expire_all()
+    assert db.query(Order).filter(Order.id.in_(ids)).count() == 0
+    assert isinstance(archive.find_order(db, ids[0]), ArchivedOrder)
@@ -0,0 +1,104 @@
+import time
+import uuid
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app import versioning
+from app.database import get_db
+from app.deadlines import DeadlineExceeded, DeadlineMiddleware, deadline_exceeded_handler
+from app.idempotency import IdempotencyMiddleware
+from app.models import CollectionVersion
+
+# Counts to a hundred million in SQL: far longer than any deadline below
+SLOW_QUERY = text(
+    "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) SELECT count(*) FROM n"
+)
+TIMEOUT = {"X-Request-Timeout": "0.3"}
+
+
+def _create_row(db: Session, tag: str) -> CollectionVersion:
+    row = CollectionVersion(name=f"{tag}-{uuid.uuid4().hex[:8]}", version=0)
+    db.add(row)
+    versioning.bump(db, row.name)
+    db.commit()
+    return row
+
+
+@pytest.fixture(scope="module")
+def slow_client(client):
+    """An app with the deadline and idempotency middleware (as in app.main) and test-only slow routes."""
+    app = FastAPI()
+    app.add_middleware(DeadlineMiddleware)
+    app.add_exception_handler(DeadlineExceeded, deadline_exceeded_handler)
+    app.add_middleware(IdempotencyMiddleware)
+
+    @app.api_route("/slow-query", methods=["GET", "POST"])
+    def slow_query(db: Session = Depends(get_db)):
+        return {"count": db.execute(SLOW_QUERY).scalar()}
+
+    @app.post("/commit-then-slow")
+    def commit_then_slow(tag: str, db: Session = Depends(get_db)):
+        row = _create_row(db, tag)
+        time.sleep(0.5)
+        db.refresh(row)
+        return {"version": row.version}
+
+    @app.post("/commit-then-time-out")
+    def commit_then_time_out(tag: str, db: Session = Depends(get_db)):
+        _create_row(db, tag)
+        raise DeadlineExceeded("deadline")
+
+    with TestClient(app) as c:
+        yield c
+
+
+def _rows(db, tag):
+    db.expire_all()
+    return db.query(CollectionVersion).filter(CollectionVersion.name.like(f"{tag}-%")).count()
+
+
+def test_statement_past_the_deadline_is_interrupted_with_504(slow_client):
+    started = time.monotonic()
+    response = slow_client.get("/slow-query", headers=TIMEOUT)
+
+    assert response.status_code == 504
+    assert time.monotonic() - started < 5
+
+
+def test_timed_out_idempotent_request_is_not_replayed(slow_client, login):
+    _, headers = login("shopkeeper")
+    headers = {**headers, **TIMEOUT, "Idempotency-Key": "slow-1"}
+
+    assert slow_client.post("/slow-query", headers=headers).status_code == 504
+    # The key was released rather than stored, so the retry runs (and times out) again
+    retry = slow_client.post("/slow-query", headers=headers)
+    assert retry.status_code == 504
+    assert "idempotent-replayed" not in retry.headers
+
+
+def test_statements_after_commit_are_not_interrupted(slow_client, db):
+    tag = f"after-commit-{uuid.uuid4().hex[:8]}"
+
+    response = slow_client.post("/commit-then-slow", params={"tag": tag}, headers=TIMEOUT)
+
+    assert response.status_code == 200, response.text
+    # The version bump runs after COMMIT too
+    assert response.json() == {"version": 1}
+    assert _rows(db, tag) == 1
+
+
+def test_failure_after_commit_is_replayed_not_retried(slow_client, db, login):
+    _, headers = login("shopkeeper")
+    headers = {**headers, "Idempotency-Key": f"committed-{uuid.uuid4().hex}"}
+    tag = f"committed-{uuid.uuid4().hex[:8]}"
+
+    assert slow_client.post("/commit-then-time-out", params={"tag": tag}, headers=headers).status_code == 504
+    retry = slow_client.post("/commit-then-time-out", params={"tag": tag}, headers=headers)
+
+    assert retry.status_code == 504
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert _rows(db, tag) == 1
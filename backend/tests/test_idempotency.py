@@ -0,0 +1,120 @@
+import threading
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.idempotency import IdempotencyMiddleware
+from app.models import Order
+
+ORDER = {"product_name": "snacks", "quantity": 1}
+
+
+def _key():
+    return {"Idempotency-Key": uuid.uuid4().hex}
+
+
+def _orders(db, user_id):
+    db.expire_all()
+    return db.query(Order).filter(Order.user_id == user_id).count()
+
+
+def test_retry_with_same_body_replays_the_stored_response(client, db, login):
+    user_id, headers = login("shopkeeper")
+    headers = {**headers, **_key()}
+
+    first = client.post("/orders/", headers=headers, json=ORDER)
+    retry = client.post("/orders/", headers=headers, json=ORDER)
+
+    assert first.status_code == 200, first.text
+    assert "idempotent-replayed" not in first.headers
+    assert retry.status_code == 200
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.content == first.content
+    assert retry.headers["content-type"] == first.headers["content-type"]
+    assert _orders(db, user_id) == 1
+
+
+def test_client_errors_are_replayed_too(client, db, login):
+    user_id, headers = login("shopkeeper")
+    headers = {**headers, **_key()}
+    too_much_advance = {**ORDER, "advance_payment": 1000}
+
+    first = client.post("/orders/", headers=headers, json=too_much_advance)
+    retry = client.post("/orders/", headers=headers, json=too_much_advance)
+
+    assert first.status_code == retry.status_code == 400
+    assert retry.headers["idempotent-replayed"] == "true"
+
+
+def test_same_key_with_another_body_is_rejected(client, db, login):
+    user_id, headers = login("shopkeeper")
+    headers = {**headers, **_key()}
+
+    assert client.post("/orders/", headers=headers, json=ORDER).status_code == 200
+    other = client.post("/orders/", headers=headers, json={**ORDER, "quantity": 2})
+
+    assert other.status_code == 422
+    assert _orders(db, user_id) == 1
+
+
+def test_keys_are_scoped_per_user(client, db, login):
+    key = _key()
+    first_id, first = login("shopkeeper")
+    second_id, second = login("shopkeeper")
+
+    assert client.post("/orders/", headers={**first, **key}, json=ORDER).status_code == 200
+    response = client.post("/orders/", headers={**second, **key}, json=ORDER)
+
+    assert response.status_code == 200
+    assert "idempotent-replayed" not in response.headers
+    assert (_orders(db, first_id), _orders(db, second_id)) == (1, 1)
+
+
+def test_invalid_token_with_a_key_is_rejected(client):
+    response = client.post("/orders/", headers={"Authorization": "Bearer not-a-token", **_key()}, json=ORDER)
+
+    assert response.status_code == 401
+
+
+@pytest.fixture
+def blocking_client():
+    """An app whose endpoint waits for `release` once `started`, to hold a key in flight."""
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    app = FastAPI()
+    app.add_middleware(IdempotencyMiddleware)
+
+    @app.post("/blocking")
+    def blocking():
+        calls.append(1)
+        started.set()
+        release.wait(10)
+        return {"calls": len(calls)}
+
+    with TestClient(app) as c:
+        yield c, started, release, calls
+    release.set()
+
+
+def test_duplicate_of_an_in_flight_request_gets_409(blocking_client):
+    client, started, release, calls = blocking_client
+    headers = _key()
+    responses = {}
+
+    first = threading.Thread(target=lambda: responses.setdefault("first", client.post("/blocking", headers=headers)))
+    first.start()
+    assert started.wait(10)
+
+    duplicate = client.post("/blocking", headers=headers)
+    release.set()
+    first.join(10)
+
+    assert duplicate.status_code == 409
+    assert responses["first"].status_code == 200
+    assert len(calls) == 1
+    # Once the first one has finished, a retry is answered with its response
+    replay = client.post("/blocking", headers=headers)
+    assert replay.headers["idempotent-replayed"] == "true"
+    assert replay.json() == {"calls": 1}
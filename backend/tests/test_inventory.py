@@ -0,0 +1,144 @@
+import uuid
+
+import pytest
+
+from app import inventory
+from app.models import Order, ProductStock, Replenishment, Warehouse
+
+
+@pytest.fixture
+def depots(db):
+    """origin, near (about 85 km away) and far (about 850 km away), each with no stock yet."""
+    suffix = uuid.uuid4().hex[:6]
+    warehouses = [
+        Warehouse(code=f"{name}-{suffix}", name=name, latitude=-40.0, longitude=longitude)
+        for name, longitude in (("origin", 170.0), ("near", 171.0), ("far", 180.0))
+    ]
+    db.add_all(warehouses)
+    db.commit()
+    return warehouses
+
+
+def _stock(db, product_name, levels):
+    for warehouse, quantity in levels.items():
+        db.add(ProductStock(warehouse_id=warehouse.id, product_name=product_name, quantity=quantity))
+    db.commit()
+
+
+def _levels(db, product_name, warehouses):
+    db.expire_all()
+    rows = {s.warehouse_id: s.quantity for s in db.query(ProductStock).filter_by(product_name=product_name)}
+    return [rows.get(w.id, 0) for w in warehouses]
+
+
+def test_allocate_takes_from_origin_then_the_nearest_depots(db, depots):
+    origin, near, far = depots
+    product = f"test-{uuid.uuid4().hex[:8]}"
+    _stock(db, product, {origin: 3, near: 2, far: 10})
+
+    allocations = inventory.allocate(db, product, 7, origin)
+    db.commit()
+
+    assert [(stock.warehouse_id, taken) for stock, taken in allocations] == [(origin.id, 3), (near.id, 2), (far.id, 2)]
+    assert _levels(db, product, depots) == [0, 0, 8]
+
+
+def test_allocate_leaves_other_depots_alone_when_origin_has_enough(db, depots):
+    origin, near, far = depots
+    product = f"test-{uuid.uuid4().hex[:8]}"
+    _stock(db, product, {origin: 5, near: 5})
+
+    allocations = inventory.allocate(db, product, 4, origin)
+    db.commit()
+
+    assert [(stock.warehouse_id, taken) for stock, taken in allocations] == [(origin.id, 4)]
+    assert _levels(db, product, depots) == [1, 5, 0]
+
+
+def test_allocate_takes_nothing_when_all_depots_together_fall_short(db, depots):
+    origin, near, far = depots
+    product = f"test-{uuid.uuid4().hex[:8]}"
+    _stock(db, product, {origin: 3, near: 2, far: 1})
+
+    with pytest.raises(inventory.InsufficientStock) as raised:
+        inventory.allocate(db, product, 7, origin)
+
+    assert raised.value.available == 6
+    db.commit()
+    assert _levels(db, product, depots) == [3, 2, 1]
+
+
+def test_dispatch_spills_over_but_keeps_the_order_at_its_depot(client, db, depots, login):
+    origin, near, far = depots
+    _stock(db, "juices", {origin: 3, near: 10})
+    _, shopkeeper = login("shopkeeper", warehouse_id=origin.id)
+    _, salesman = login("salesman")
+    _, manager = login("warehouse_manager")
+    order = client.post("/orders/", headers=shopkeeper, json={"product_name": "juices", "quantity": 5}).json()
+    client.post("/salesman/confirm-order", headers=salesman, json={"order_id": order["id"]})
+
+    response = client.post("/warehouse/process-order", headers=manager,
+                           json={"order_id": order["id"], "action": "dispatch"})
+
+    assert response.status_code == 200, response.text
+    assert response.json()["allocations"] == [
+        {"warehouse_id": origin.id, "quantity": 3}, {"warehouse_id": near.id, "quantity": 2},
+    ]
+    db.expire_all()
+    assert db.get(Order, order["id"]).warehouse_id == origin.id
+    assert _levels(db, "juices", depots) == [0, 8, 0]
+    # A second dispatch of the same order finds it already dispatched
+    again = client.post("/warehouse/process-order", headers=manager,
+                        json={"order_id": order["id"], "action": "dispatch"})
+    assert again.status_code == 400
+    assert _levels(db, "juices", depots) == [0, 8, 0]
+
+
+def test_transfer_moves_stock_once_received(client, db, depots, login):
+    origin, near, far = depots
+    _stock(db, "jelly", {origin: 10})
+    _, sender = login("warehouse_manager", warehouse_id=origin.id)
+    _, receiver = login("warehouse_manager", warehouse_id=near.id)
+
+    response = client.post("/warehouse/transfers", headers=sender,
+                           json={"product_name": "jelly", "quantity": 4, "to_warehouse_id": near.id})
+    assert response.status_code == 200, response.text
+    transfer = response.json()
+    assert (transfer["from_warehouse_id"], transfer["status"]) == (origin.id, "in_transit")
+    # Taken from the sender at once, added to the receiver only on receipt
+    assert _levels(db, "jelly", depots) == [6, 0, 0]
+
+    # Only the receiving depot can receive it, and only once
+    assert client.post(f"/warehouse/transfers/{transfer['id']}/receive", headers=sender).status_code == 403
+    response = client.post(f"/warehouse/transfers/{transfer['id']}/receive", headers=receiver)
+    assert response.status_code == 200, response.text
+    assert response.json()["status"] == "received"
+    assert _levels(db, "jelly", depots) == [6, 4, 0]
+    assert client.post(f"/warehouse/transfers/{transfer['id']}/receive", headers=receiver).status_code == 400
+
+
+def test_transfer_beyond_stock_is_rejected(client, db, depots, login):
+    origin, near, far = depots
+    _stock(db, "candy", {origin: 2})
+    _, sender = login("warehouse_manager", warehouse_id=origin.id)
+
+    response = client.post("/warehouse/transfers", headers=sender,
+                           json={"product_name": "candy", "quantity": 5, "to_warehouse_id": far.id})
+
+    assert response.status_code == 400
+    assert _levels(db, "candy", depots) == [2, 0, 0]
+
+
+def test_replenishment_is_shipped_once(client, db, depots, login):
+    origin, near, far = depots
+    replenishment = Replenishment(product_name="biscuits", quantity=6, reorder_point=2, warehouse_id=near.id)
+    db.add(replenishment)
+    db.commit()
+    _, manufacturer = login("manufacturer")
+
+    first = client.post(f"/manufacturer/ship-replenishment/{replenishment.id}", headers=manufacturer)
+    second = client.post(f"/manufacturer/ship-replenishment/{replenishment.id}", headers=manufacturer)
+
+    assert first.status_code == 200, first.text
+    assert second.status_code == 400
+    assert _levels(db, "biscuits", depots) == [0, 6, 0]
@@ -0,0 +1,165 @@
+from datetime import datetime
+
+import pytest
+
+from app import forecasting, jobs
+from app.database import SessionLocal
+from app.models import Job, ProductStock
+
+
+@pytest.fixture
+def handler_calls():
+    """A "test_echo" handler (batches of 10) that fails on payloads with "fail"; yields its calls."""
+    calls = []
+
+    @jobs.handler("test_echo", batch_size=10)
+    def echo(db, payloads):
+        calls.append(payloads)
+        if any(p.get("fail") for p in payloads):
+            raise ValueError("bad payload")
+
+    yield calls
+    jobs.HANDLERS.pop("test_echo")
+    with SessionLocal() as db:
+        db.query(Job).filter(Job.kind == "test_echo").delete()
+        db.commit()
+
+
+def _enqueue(db, *payloads, max_attempts=jobs.MAX_ATTEMPTS):
+    for payload in payloads:
+        jobs.enqueue(db, "test_echo", payload, max_attempts=max_attempts)
+    db.commit()
+
+
+def _jobs(db):
+    db.expire_all()
+    return db.query(Job).filter(Job.kind == "test_echo").order_by(Job.id).all()
+
+
+def test_enqueued_jobs_run_as_one_batch_and_are_deleted(client, db, handler_calls):
+    _enqueue(db, {"n": 1}, {"n": 2}, {"n": 3})
+
+    assert jobs.run_once(SessionLocal, ["test_echo"]) == 3
+    assert handler_calls == [[{"n": 1}, {"n": 2}, {"n": 3}]]
+    assert _jobs(db) == []
+
+
+def test_rolled_back_enqueue_leaves_no_job(client, db, handler_calls):
+    jobs.enqueue(db, "test_echo", {"n": 1})
+    db.rollback()
+
+    assert jobs.run_once(SessionLocal, ["test_echo"]) == 0
+
+
+def test_failing_job_is_retried_alone_with_backoff(client, db, handler_calls):
+    _enqueue(db, {"n": 1}, {"fail": True})
+
+    jobs.run_once(SessionLocal, ["test_echo"])
+
+    # The batch failed, was split, and only the bad payload is left
+    assert handler_calls == [[{"n": 1}, {"fail": True}], [{"n": 1}], [{"fail": True}]]
+    [job] = _jobs(db)
+    assert job.status == "queued"
+    assert job.attempts == 1
+    assert job.locked_by is None
+    assert job.run_at > datetime.utcnow()
+    assert "bad payload" in job.last_error
+    # Not due until its backoff has passed
+    assert jobs.run_once(SessionLocal, ["test_echo"]) == 0
+
+
+def test_job_fails_after_max_attempts_and_can_be_requeued(client, db, handler_calls):
+    _enqueue(db, {"fail": True}, max_attempts=1)
+
+    jobs.run_once(SessionLocal, ["test_echo"])
+
+    [job] = _jobs(db)
+    assert job.status == "failed"
+    assert jobs.retry_failed(db) >= 1
+    [job] = _jobs(db)
+    assert (job.status, job.attempts) == ("queued", 0)
+
+
+def test_claimed_job_is_hidden_until_visibility_timeout(client, db, handler_calls, monkeypatch):
+    _enqueue(db, {"n": 1})
+    token, claimed = jobs.claim(db, ["test_echo"])
+    db.expunge_all()
+    assert len(claimed) == 1
+    assert jobs.claim(db, ["test_echo"]) == ("", [])
+
+    # The worker "dies"; once its claim expires another worker takes the job over
+    monkeypatch.setattr(jobs, "VISIBILITY_SECONDS", 0)
+    db.query(Job).filter(Job.locked_by == token).update({Job.run_at: datetime.utcnow()})
+    db.commit()
+    new_token, reclaimed = jobs.claim(db, ["test_echo"])
+    db.expunge_all()
+    assert [job.attempts for job in reclaimed] == [2]
+
+    # The first worker finishing late must not delete the job it no longer owns
+    jobs._run(SessionLocal, "test_echo", token, claimed)
+    assert len(_jobs(db)) == 1
+    jobs._run(SessionLocal, "test_echo", new_token, reclaimed)
+    assert _jobs(db) == []
+
+
+def test_reorder_checks_keep_every_depot_in_a_batch(client, db, monkeypatch):
+    checked = []
+    monkeypatch.setattr(forecasting, "get_forecasts", lambda db: {})
+    monkeypatch.setattr(forecasting, "check_reorder_point",
+                        lambda db, product, forecasts, warehouse_id=None: checked.append((product, warehouse_id)))
+
+    forecasting.run_reorder_checks(db, [
+        {"product_name": "candy", "warehouse_id": 1},
+        {"product_name": "candy", "warehouse_id": 2},
+        {"product_name": "candy", "warehouse_id": 1},
+        {"product_name": "jelly", "warehouse_id": 2},
+    ])
+
+    assert checked == [("candy", 1), ("candy", 2), ("jelly", 2)]
+
+
+def test_only_dispatch_defers_work_to_the_queue(client, db, login, monkeypatch):
+    """Placing, shipping and delivering stay synchronous on purpose: their effects are the response.
+
+    Only dispatch has a follow-up (the reorder-point check) that the caller does not wait for.
+    """
+    monkeypatch.setattr(forecasting, "AUTO_REPLENISH", True)
+    shopkeeper_id, shopkeeper = login("shopkeeper", warehouse_id=1)
+    _, salesman = login("salesman")
+    _, manager = login("warehouse_manager")
+    _, manufacturer = login("manufacturer")
+
+    def queued():
+        db.expire_all()
+        return db.query(Job).count()
+
+    def stock():
+        db.expire_all()
+        row = db.query(ProductStock).filter_by(warehouse_id=1, product_name="juices").first()
+        return row.quantity if row else 0
+
+    before = queued()
+    order = client.post("/orders/", headers=shopkeeper, json={"product_name": "juices", "quantity": 2}).json()
+    assert queued() == before
+
+    client.post("/salesman/confirm-order", headers=salesman, json={"order_id": order["id"]})
+    client.post("/warehouse/process-order", headers=manager, json={"order_id": order["id"], "action": "request_stock"})
+    client.post(f"/manufacturer/request-payment/{order['id']}", headers=manufacturer)
+    client.post("/warehouse/pay-manufacturer", headers=manager, json={"order_id": order["id"]})
+    stock_before = stock()
+    response = client.post(f"/manufacturer/ship-stock/{order['id']}", headers=manufacturer)
+    assert response.status_code == 200, response.text
+    assert stock() == stock_before + 2
+    assert queued() == before
+
+    response = client.post("/warehouse/process-order", headers=manager,
+                           json={"order_id": order["id"], "action": "dispatch"})
+    assert response.status_code == 200, response.text
+    assert queued() == before + 1
+    db.expire_all()
+    assert db.query(Job).order_by(Job.id.desc()).first().kind == "reorder_check"
+
+    response = client.post("/salesman/deliver-order", headers=salesman,
+                           json={"order_id": order["id"], "collected_amount": order["remaining_payment"]})
+    assert response.status_code == 200, response.text
+    assert queued() == before + 1
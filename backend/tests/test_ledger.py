@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import ledger
+from app.models import AccountBalance, Order, Payment
+from app.money import to_minor
+
+NOW = datetime(2026, 6, 30, 12, 0)
+
+
+@pytest.fixture
+def shopkeeper(login):
+    return login("shopkeeper")
+
+
+def _order(db, user_id, total, advance, days_ago, paid_remaining_days_ago=None):
+    created = NOW - timedelta(days=days_ago)
+    order = Order(
+        user_id=user_id, product_name="candy", quantity=1, status="placed", created_at=created,
+        total_amount=total, advance_payment=advance, remaining_payment=0 if paid_remaining_days_ago else total - advance,
+    )
+    db.add(order)
+    db.flush()
+    db.add(Payment(order_id=order.id, amount=advance, payment_type="advance", paid_at=created))
+    if paid_remaining_days_ago is not None:
+        db.add(Payment(
+            order_id=order.id, amount=order.total_amount_minor / 100 - advance, payment_type="remaining",
+            paid_at=NOW - timedelta(days=paid_remaining_days_ago),
+        ))
+    db.commit()
+    return order
+
+
+def test_to_minor_rounds_half_up_from_the_decimal_value():
+    assert to_minor(0.1) == 10
+    assert to_minor(2.675) == 268  # 2.675 as a float is 2.67499999...
+    assert to_minor("19.995") == 2000
+    assert to_minor(None) == 0
+
+
+def test_rupee_attributes_map_to_paise_columns(db, shopkeeper):
+    user_id, _ = shopkeeper
+    order = _order(db, user_id, total=50.5, advance=30.3, days_ago=1)
+
+    assert (order.total_amount_minor, order.advance_payment_minor, order.remaining_payment_minor) == (5050, 3030, 2020)
+    assert order.remaining_payment == 20.2
+    # The same names work in queries, without integer division
+    assert db.query(Order.id).filter(Order.user_id == user_id, Order.total_amount == 50.5).scalar() == order.id
+    assert float(db.query(Order.remaining_payment).filter(Order.id == order.id).scalar()) == 20.2
+
+
+def test_add_creates_the_balance_then_increments_it(db, shopkeeper):
+    user_id, _ = shopkeeper
+
+    ledger.add(db, user_id, billed_minor=10000, paid_minor=6000)
+    ledger.add(db, user_id, paid_minor=4000)
+    ledger.add(db, user_id, billed_minor=550)
+    db.commit()
+
+    balance = db.get(AccountBalance, user_id)
+    assert (balance.billed_minor, balance.paid_minor, balance.outstanding_minor) == (10550, 10000, 550)
+    assert (balance.billed, balance.paid) == (105.5, 100.0)
+
+
+def test_placed_orders_update_balance_and_statement(client, login, shopkeeper):
+    user_id, headers = shopkeeper
+    _, staff = login("warehouse_manager")
+
+    for product_name, quantity, advance in (("candy", 2, 100), ("jelly", 1, 40.5)):
+        response = client.post("/orders/", headers=headers, json={
+            "product_name": product_name, "quantity": quantity, "advance_payment": advance,
+        })
+        assert response.status_code == 200, response.text
+
+    balance = client.get(f"/accounts/{user_id}/balance", headers=staff).json()
+    statement = client.get("/accounts/me/statement", headers=headers).json()
+    assert (balance["billed"], balance["paid"], balance["outstanding"]) == (280.0, 140.5, 139.5)
+    assert statement["outstanding"] == statement["closing_balance"] == 139.5
+
+
+def test_statement_runs_the_balance_and_opens_at_start(db, shopkeeper):
+    user_id, _ = shopkeeper
+    first = _order(db, user_id, total=100, advance=60, days_ago=40)
+    second = _order(db, user_id, total=50.5, advance=30.3, days_ago=10, paid_remaining_days_ago=5)
+
+    full = ledger.statement(db, user_id)
+    assert [(e["entry_type"], e["order_id"], e["debit"], e["credit"], e["balance"]) for e in full["entries"]] == [
+        ("order", first.id, 100.0, 0.0, 100.0),
+        ("payment", first.id, 0.0, 60.0, 40.0),
+        ("order", second.id, 50.5, 0.0, 90.5),
+        ("payment", second.id, 0.0, 30.3, 60.2),
+        ("payment", second.id, 0.0, 20.2, 40.0),
+    ]
+    assert (full["opening_balance"], full["closing_balance"]) == (0.0, 40.0)
+    assert full["entries"][1]["description"] == f"Advance payment for order #{first.id}"
+
+    window = ledger.statement(db, user_id, start=NOW - timedelta(days=20), end=NOW - timedelta(days=7))
+    assert window["opening_balance"] == 40.0
+    assert [e["balance"] for e in window["entries"]] == [90.5, 60.2]
+    assert window["closing_balance"] == 60.2
+
+
+def test_aging_buckets_unpaid_orders_by_age(db, shopkeeper):
+    user_id, _ = shopkeeper
+    _order(db, user_id, total=100, advance=60, days_ago=45)
+    _order(db, user_id, total=10, advance=6, days_ago=100)
+    _order(db, user_id, total=20, advance=12, days_ago=3)
+    _order(db, user_id, total=50, advance=30, days_ago=70, paid_remaining_days_ago=60)
+
+    assert ledger.aging(db, user_id, now=NOW) == {
+        "current": 8.0, "days_31_60": 40.0, "days_61_90": 0.0, "over_90": 4.0,
+    }
@@ -0,0 +1,36 @@
+import threading
+
+from app import metrics
+
+
+def _in_threads(count: int, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_shards_of_exited_threads_are_folded_into_one():
+    labels = {"test": "shards"}
+    before = metrics.snapshot()["counters"].get(metrics._key("test_events_total", labels), 0)
+    shards_before = len(metrics._shards)
+
+    _in_threads(50, lambda: metrics.inc("test_events_total", labels))
+    counters = metrics.snapshot()["counters"]
+
+    assert counters[metrics._key("test_events_total", labels)] == before + 50
+    assert len(metrics._shards) <= shards_before
+    # Folded counts stay in later snapshots too
+    _in_threads(10, lambda: metrics.inc("test_events_total", labels))
+    assert metrics.snapshot()["counters"][metrics._key("test_events_total", labels)] == before + 60
+
+
+def test_histograms_of_exited_threads_are_kept():
+    labels = {"test": "histogram"}
+
+    _in_threads(3, lambda: metrics.observe("test_duration_seconds", labels, 0.02))
+    cells = metrics.snapshot()["histograms"][metrics._key("test_duration_seconds", labels)]
+
+    assert sum(cells[:-1]) == 3
+    assert round(cells[-1], 6) == 0.06
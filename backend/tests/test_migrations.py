@@ -0,0 +1,146 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from app import migrations
+
+# The schema create_all built before versioned migrations: money as FLOAT rupees
+BASELINE_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR(50) NOT NULL UNIQUE, "
+    "email VARCHAR(100) NOT NULL UNIQUE, hashed_password VARCHAR(255) NOT NULL, role VARCHAR(17) NOT NULL)",
+    "CREATE TABLE product_stock (id INTEGER PRIMARY KEY, product_name VARCHAR(100) NOT NULL UNIQUE, "
+    "quantity INTEGER NOT NULL)",
+    "CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id), "
+    "product_name VARCHAR(100) NOT NULL, quantity INTEGER NOT NULL, total_amount FLOAT NOT NULL, "
+    "advance_payment FLOAT, remaining_payment FLOAT NOT NULL, status VARCHAR(20) NOT NULL, created_at DATETIME)",
+    "CREATE TABLE payments (id INTEGER PRIMARY KEY, order_id INTEGER NOT NULL REFERENCES orders (id), "
+    "amount FLOAT NOT NULL, payment_type VARCHAR(12) NOT NULL, paid_at DATETIME)",
+]
+
+
+def _engine(tmp_path, name="test.db"):
+    return create_engine(f"sqlite:///{tmp_path / name}")
+
+
+def _columns(conn, table):
+    return {c["name"] for c in inspect(conn).get_columns(table)}
+
+
+def test_upgrade_from_baseline_converts_money_to_paise(tmp_path):
+    engine = _engine(tmp_path)
+    with engine.begin() as conn:
+        for ddl in BASELINE_SCHEMA:
+            conn.execute(text(ddl))
+        conn.execute(text(
+            "INSERT INTO users VALUES (1, 'shop', 'shop@example.com', 'x', 'shopkeeper'), "
+            "(2, 'quiet', 'quiet@example.com', 'x', 'shopkeeper')"
+        ))
+        conn.execute(text("INSERT INTO product_stock VALUES (1, 'candy', 7), (2, 'jelly', 3)"))
+        conn.execute(text(
+            "INSERT INTO orders VALUES "
+            "(1, 1, 'candy', 1, 100.1, 60.06, 40.04, 'delivered', '2025-01-02 10:00:00'), "
+            "(2, 1, 'jelly', 3, 0.3, NULL, 0.3, 'placed', '2025-02-03 10:00:00')"
+        ))
+        conn.execute(text(
+            "INSERT INTO payments VALUES (1, 1, 60.06, 'advance', '2025-01-02 10:00:00'), "
+            "(2, 1, 40.04, 'remaining', '2025-01-09 10:00:00'), (3, 1, 90.0, 'stock_supply', NULL)"
+        ))
+
+    applied = migrations.upgrade(engine)
+
+    assert applied == [number for number, _, _ in migrations.MIGRATIONS]
+    with engine.connect() as conn:
+        assert migrations.current_version(conn) == migrations.latest_version()
+        assert {"total_amount", "advance_payment", "remaining_payment"}.isdisjoint(_columns(conn, "orders"))
+        assert "amount" not in _columns(conn, "payments")
+        orders = conn.execute(text(
+            "SELECT id, total_amount_minor, advance_payment_minor, remaining_payment_minor FROM orders ORDER BY id"
+        )).all()
+        assert [tuple(row) for row in orders] == [(1, 10010, 6006, 4004), (2, 30, 0, 30)]
+        payments = conn.execute(text("SELECT amount_minor FROM payments ORDER BY id")).scalars().all()
+        assert payments == [6006, 4004, 9000]
+        # Balances count customer payments only, not the warehouse's stock_supply
+        balances = conn.execute(text("SELECT user_id, billed_minor, paid_minor FROM account_balances")).all()
+        assert [tuple(row) for row in balances] == [(1, 10040, 10010)]
+        # Existing stock lands in the default warehouse
+        stock = conn.execute(text(
+            "SELECT w.code, s.product_name, s.quantity FROM product_stock s JOIN warehouses w ON w.id = s.warehouse_id "
+            "ORDER BY s.id"
+        )).all()
+        assert [tuple(row) for row in stock] == [("main", "candy", 7), ("main", "jelly", 3)]
+
+
+def test_upgrade_adds_amount_columns_missing_from_the_first_deployments(tmp_path):
+    engine = _engine(tmp_path)
+    with engine.begin() as conn:
+        conn.execute(text(BASELINE_SCHEMA[0]))
+        conn.execute(text(
+            "CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, product_name VARCHAR(100) NOT NULL, "
+            "status VARCHAR(20) NOT NULL, created_at DATETIME)"
+        ))
+        conn.execute(text("INSERT INTO users VALUES (1, 'shop', 'shop@example.com', 'x', 'shopkeeper')"))
+        conn.execute(text("INSERT INTO orders VALUES (1, 1, 'candy', 'placed', '2024-12-01 10:00:00')"))
+
+    migrations.upgrade(engine)
+
+    with engine.connect() as conn:
+        row = conn.execute(text(
+            "SELECT quantity, total_amount_minor, advance_payment_minor, remaining_payment_minor FROM orders"
+        )).one()
+        assert tuple(row) == (1, 0, 0, 0)
+
+
+def test_fresh_database_gets_every_migration_once(tmp_path):
+    engine = _engine(tmp_path)
+
+    applied = migrations.upgrade(engine)
+
+    assert applied == [number for number, _, _ in migrations.MIGRATIONS]
+    with engine.connect() as conn:
+        tables = set(inspect(conn).get_table_names())
+        assert {table.name for table in migrations.Base.metadata.sorted_tables} <= tables
+        versions = conn.execute(text("SELECT version FROM schema_version ORDER BY version")).scalars().all()
+        assert versions == applied
+        # Seeded by migrations rather than by the baseline
+        assert conn.execute(text("SELECT code FROM warehouses")).scalars().all() == ["main"]
+        assert conn.execute(text("SELECT COUNT(*) FROM collection_versions")).scalar() == 3
+
+
+def test_rerun_with_nothing_pending_changes_nothing(tmp_path):
+    engine = _engine(tmp_path)
+    migrations.upgrade(engine)
+    with engine.connect() as conn:
+        before = conn.execute(text("SELECT * FROM schema_version ORDER BY version")).all()
+
+    assert migrations.upgrade(engine) == []
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT * FROM schema_version ORDER BY version")).all() == before
+
+
+def test_only_pending_migrations_run(tmp_path, monkeypatch):
+    engine = _engine(tmp_path)
+    migrations.upgrade(engine)
+    ran = []
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS + [
+        (migrations.latest_version() + 1, "test step", lambda conn: ran.append(conn)),
+    ])
+
+    assert migrations.upgrade(engine) == [migrations.latest_version()]
+    assert len(ran) == 1
+    assert migrations.upgrade(engine) == []
+    assert len(ran) == 1
+
+
+def test_failed_migration_is_not_recorded(tmp_path, monkeypatch):
+    engine = _engine(tmp_path)
+    migrations.upgrade(engine)
+    version = migrations.latest_version()
+
+    def broken(conn):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS + [(version + 1, "broken step", broken)])
+
+    with pytest.raises(RuntimeError, match="boom"):
+        migrations.upgrade(engine)
+    with engine.connect() as conn:
+        assert migrations.current_version(conn) == version
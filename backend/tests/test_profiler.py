@@ -0,0 +1,34 @@
+from app import profiler
+
+
+def test_profiling_is_denied_unless_configured(client, login, monkeypatch):
+    _, manager = login("warehouse_manager")
+    assert client.get("/debug/profile", params={"seconds": 0.1}, headers=manager).status_code == 403
+
+    monkeypatch.setattr(profiler, "PROFILER_ROLES", {"warehouse_manager"})
+    response = client.get("/debug/profile", params={"seconds": 0.1}, headers=manager)
+    assert response.status_code == 200, response.text
+
+
+def test_is_allowed_needs_every_configured_list(monkeypatch):
+    assert not profiler.is_allowed("alice", "manufacturer")
+
+    monkeypatch.setattr(profiler, "PROFILER_USERS", {"alice"})
+    assert profiler.is_allowed("alice", "shopkeeper")
+    assert not profiler.is_allowed("bob", "manufacturer")
+
+    monkeypatch.setattr(profiler, "PROFILER_ROLES", {"manufacturer"})
+    assert profiler.is_allowed("alice", "manufacturer")
+    assert not profiler.is_allowed("alice", "shopkeeper")
+
+
+def test_frames_are_labelled_without_co_qualname():
+    # Python 3.10 code objects have no co_qualname
+    class Code:
+        co_name = "dispatch"
+        co_filename = "/srv/app/routers/warehouse.py"
+        co_firstlineno = 42
+
+    code = Code()
+
+    assert profiler._label(code).startswith("dispatch (")
@@ -0,0 +1,45 @@
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def manager(login):
+    return login("warehouse_manager")[1]
+
+
+def _search(client, headers, **params):
+    return client.get("/warehouse/orders/search", headers=headers, params=params)
+
+
+def test_order_id_ranks_first(client, login, manager):
+    _, shopkeeper = login("shopkeeper")
+    order = client.post("/orders/", headers=shopkeeper, json={"product_name": "snacks", "quantity": 1}).json()
+
+    response = _search(client, manager, q=str(order["id"]))
+
+    assert response.status_code == 200, response.text
+    assert response.json()["results"][0]["id"] == order["id"]
+
+
+def test_username_with_underscore_matches(client, login, manager):
+    username = f"shop_{uuid.uuid4().hex[:8]}"
+    _, shopkeeper = login("shopkeeper", username=username)
+    client.post("/orders/", headers=shopkeeper, json={"product_name": "snacks", "quantity": 1})
+
+    response = _search(client, manager, q=username)
+
+    assert response.status_code == 200, response.text
+    assert {row["username"] for row in response.json()["results"]} == {username}
+
+
+@pytest.mark.parametrize("q", ["²", "١٢٣", "#99999999999999999999", "99999999999999999999"])
+def test_non_ascii_and_huge_numbers_are_not_ids(client, manager, q):
+    response = _search(client, manager, q=q)
+
+    assert response.status_code == 200, response.text
+
+
+def test_unknown_status_is_rejected(client, manager):
+    assert _search(client, manager, status="placed").status_code == 200
+    assert _search(client, manager, status="lost").status_code == 422
@@ -0,0 +1,57 @@
+from app import versioning
+
+
+def test_unchanged_collection_is_answered_with_304(client, login):
+    _, manager = login("warehouse_manager")
+
+    first = client.get("/warehouse/pending-actions", headers=manager)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+
+    again = client.get("/warehouse/pending-actions", headers={**manager, "If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["etag"] == etag
+    for response in (first, again):
+        assert {"Accept", "Accept-Encoding", "Authorization"} <= {v.strip() for v in response.headers["vary"].split(",")}
+    assert again.content == b""
+
+
+def test_etag_is_per_warehouse_and_representation(client, login):
+    _, north = login("warehouse_manager", warehouse_id=1)
+    _, south = login("warehouse_manager", warehouse_id=2)
+    etag = client.get("/warehouse/stock", headers=north).headers["etag"]
+
+    # Same versions, another depot's rows: no 304 for an ETag taken from the first one
+    other = client.get("/warehouse/stock", headers={**south, "If-None-Match": etag})
+    assert other.status_code == 200
+    assert other.headers["etag"] != etag
+
+    # Same depot, another format
+    msgpack = client.get("/warehouse/stock", headers={**north, "Accept": "application/msgpack", "If-None-Match": etag})
+    assert msgpack.status_code == 200
+    assert msgpack.headers["etag"] != etag
+
+
+def test_write_changes_the_etag(client, login):
+    _, manager = login("warehouse_manager")
+    _, shopkeeper = login("shopkeeper", warehouse_id=1)
+    etag = client.get("/warehouse/pending-actions", headers=manager).headers["etag"]
+
+    response = client.post("/orders/", headers=shopkeeper, json={"product_name": "candy", "quantity": 1})
+    assert response.status_code == 200, response.text
+
+    after = client.get("/warehouse/pending-actions", headers={**manager, "If-None-Match": etag})
+    assert after.status_code == 200
+    assert after.headers["etag"] != etag
+
+
+def test_bump_applies_only_when_the_transaction_commits(db):
+    before = versioning.get_versions(db, [versioning.REPLENISHMENTS])[versioning.REPLENISHMENTS]
+
+    versioning.bump(db, versioning.REPLENISHMENTS)
+    db.rollback()
+    assert versioning.get_versions(db, [versioning.REPLENISHMENTS])[versioning.REPLENISHMENTS] == before
+
+    versioning.bump(db, versioning.REPLENISHMENTS)
+    db.commit()
+    assert versioning.get_versions(db, [versioning.REPLENISHMENTS])[versioning.REPLENISHMENTS] == before + 1
@@ -48,6 +48,9 @@ export const AuthProvider = ({ children }) => {
 
             const token = response.data.access_token || response.data.token;
             localStorage.setItem('token', token);
+            if (response.data.refresh_token) {
+                localStorage.setItem('refresh_token', response.data.refresh_token);
+            }
             await fetchUser();
             return true;
         } catch (error) {
@@ -57,7 +60,12 @@ export const AuthProvider = ({ children }) => {
     };
 
     const logout = () => {
+        const refreshToken = localStorage.getItem('refresh_token');
+        if (refreshToken) {
+            api.post('/auth/logout', { refresh_token: refreshToken }).catch(() => {});
+        }
         localStorage.removeItem('token');
+        localStorage.removeItem('refresh_token');
         setUser(null);
     };
 
@@ -4,6 +4,10 @@ const api = axios.create({
     baseURL: 'http://localhost:8000',
 });
 
+// After a write the backend answers with X-Primary-Until; echoing it back until then keeps
+// our reads on the primary database, so we see our own write instead of a lagging replica
+const PRIMARY_UNTIL = 'X-Primary-Until';
+
 // Add a request interceptor to include the JWT token in headers
 api.interceptors.request.use(
     (config) => {
@@ -11,6 +15,10 @@ api.interceptors.request.use(
         if (token) {
             config.headers.Authorization = `Bearer ${token}`;
         }
+        const primaryUntil = sessionStorage.getItem('primary_until');
+        if (primaryUntil) {
+            config.headers[PRIMARY_UNTIL] = primaryUntil;
+        }
         return config;
     },
     (error) => {
@@ -18,4 +26,44 @@ api.interceptors.request.use(
     }
 );
 
+// Access tokens are short-lived: on a 401, swap the refresh token for a new pair once and retry
+let refreshing = null;
+
+api.interceptors.response.use(
+    (response) => {
+        const primaryUntil = response.headers[PRIMARY_UNTIL.toLowerCase()];
+        if (primaryUntil) {
+            sessionStorage.setItem('primary_until', primaryUntil);
+        }
+        return response;
+    },
+    async (error) => {
+        const original = error.config;
+        const refreshToken = localStorage.getItem('refresh_token');
+        if (
+            error.response?.status !== 401 ||
+            !refreshToken ||
+            original._retried ||
+            original.url === '/auth/refresh'
+        ) {
+            return Promise.reject(error);
+        }
+        original._retried = true;
+        try {
+            refreshing = refreshing || api.post('/auth/refresh', { refresh_token: refreshToken });
+            const { data } = await refreshing;
+            localStorage.setItem('token', data.access_token);
+            localStorage.setItem('refresh_token', data.refresh_token);
+        } catch (refreshError) {
+            localStorage.removeItem('token');
+            localStorage.removeItem('refresh_token');
+            return Promise.reject(error);
+        } finally {
+            refreshing = null;
+        }
+        original.headers.Authorization = `Bearer ${localStorage.getItem('token')}`;
+        return api(original);
+    }
+);
+
 export default api;